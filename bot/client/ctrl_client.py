@@ -2,20 +2,21 @@
 
 from time import time
 import zmq
-from simplejson.decoder import JSONDecodeError
 
 import lib.messages as msgs
+import lib.wire as wire
 
 
-def api_method(ctrl_sock, obj_name, method):
+def api_method(ctrl_client, obj_name, method):
     """Factory for ZMQ-based remote function calls.
 
     API methods map 1-1 with exported methods on the bot. When they are
     called, they pass that call on to the method they represent on the bot
     via ZMQ. They back up to a ZMQ message with the cmd key set to 'call'.
 
-    :param ctrl_sock: ZMQ socket to CtrlServer, used when method is called.
-    :type ctrl_sock: zmq.core.socket.Socket
+    :param ctrl_client: Client connected to CtrlServer, used when method
+        is called.
+    :type ctrl_client: CtrlClient
     :param obj_name: Name of the remote object that contains the method.
     :type obj_name: string
     :param method: Name of the remote method to call.
@@ -29,8 +30,7 @@ def api_method(ctrl_sock, obj_name, method):
         :returns: Dict result returned by server.
 
         """
-        ctrl_sock.send_json(msgs.call_req(obj_name, method, params))
-        return ctrl_sock.recv_json()
+        return ctrl_client.request(msgs.call_req(obj_name, method, params))
     return func
 
 
@@ -46,11 +46,11 @@ class ApiClass(object):
 
     """
 
-    def __init__(self, ctrl_sock, obj_name, methods):
+    def __init__(self, ctrl_client, obj_name, methods):
         """Build ZMQ-backed API call methods for this object.
 
-        :param ctrl_sock: ZMQ REQ/REP socket to the on-bot CtrlServer.
-        :type ctrl_sock: zmq.sugar.socket.Socket
+        :param ctrl_client: Client connected to the on-bot CtrlServer.
+        :type ctrl_client: CtrlClient
         :param obj_name: Name of exported object that owns the given methods.
         :type obj_name: string
         :param methods: Exported methods owned by the given object.
@@ -60,7 +60,77 @@ class ApiClass(object):
         self.name = obj_name
         self.api_methods = methods
         for method in methods:
-            setattr(self, method, api_method(ctrl_sock, obj_name, method))
+            setattr(self, method, api_method(ctrl_client, obj_name, method))
+
+
+class CallBatch(object):
+
+    """Queues API calls, to send them to CtrlServer in one round trip.
+
+    Use as a context manager, the calls are sent when the block exits
+    (unless it raised):
+
+        with ctrl_client.batch() as batch:
+            batch.call("driver", "move", {"speed": 40, "angle": 180})
+            batch.call("follower", "rotate_to_line", {"direction": "right"})
+        print batch.results
+
+    """
+
+    def __init__(self, ctrl_client, stop_on_error=True):
+        """Build an empty batch.
+
+        :param ctrl_client: Client to send the batch through.
+        :type ctrl_client: CtrlClient
+        :param stop_on_error: Don't run the calls after one that fails.
+        :type stop_on_error: boolean
+
+        """
+        self.ctrl_client = ctrl_client
+        self.stop_on_error = stop_on_error
+        self.calls = []
+        self.replies = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+
+    def call(self, obj_name, method, params=None):
+        """Queue a call to a remote API method, see CtrlClient.call.
+
+        :returns: Index of the call's reply in replies and results.
+
+        """
+        if params is None:
+            params = {}
+        self.calls.append(msgs.call_req(obj_name, method, params))
+        return len(self.calls) - 1
+
+    def send(self):
+        """Send the queued calls and wait for their replies.
+
+        :returns: List of reply dicts, one per call. Calls that weren't run
+            because an earlier one failed get an error reply.
+
+        """
+        reply = self.ctrl_client.request(
+            msgs.batch_req(self.calls, self.stop_on_error))
+        if reply["type"] != "batch_reply":
+            # Whole batch was rejected, so every call failed with it
+            self.replies = [reply] * len(self.calls)
+            return self.replies
+        self.replies = reply["replies"]
+        skipped = msgs.error("Not run, an earlier call in batch failed")
+        self.replies += [skipped] * (len(self.calls) - len(self.replies))
+        return self.replies
+
+    @property
+    def results(self):
+        """Return values of the calls, None for calls that failed."""
+        return [reply.get("call_return") for reply in self.replies]
 
 
 class CtrlClient(object):
@@ -80,11 +150,14 @@ class CtrlClient(object):
 
     """
 
-    def __init__(self, ctrl_addr="tcp://127.0.0.1:60000"):
+    def __init__(self, ctrl_addr="tcp://127.0.0.1:60000", encoding="json"):
         """Build ZMQ socket, connect to CtrlServer, discover exported objects.
 
         :param ctrl_addr: Address of control server to connect to via ZMQ.
         :type ctrl_addr: string
+        :param encoding: Preferred message encoding, see lib.wire. JSON is
+            readable on the wire, bin is faster for high-rate clients.
+        :type encoding: string
 
         """
         # Build ZMQ socket to talk with control server
@@ -92,9 +165,41 @@ class CtrlClient(object):
         self.ctrl_addr = ctrl_addr
         self.ctrl_sock = self.context.socket(zmq.REQ)
         self.ctrl_sock.connect(ctrl_addr)
+        self.encoding = "json"
+        if encoding != "json":
+            self.negotiate([encoding])
         self.discover()
         print "CtrlClient connected to CtrlServer at {}".format(ctrl_addr)
 
+    def request(self, msg):
+        """Send a message to CtrlServer and wait for its reply.
+
+        :param msg: Message dict, from lib.messages.
+        :type msg: dict
+        :returns: Reply message dict.
+
+        """
+        self.ctrl_sock.send(wire.dumps(msg, self.encoding))
+        return wire.loads(self.ctrl_sock.recv())[0]
+
+    def negotiate(self, encodings):
+        """Agree with CtrlServer on the encoding of later messages.
+
+        Servers that don't know hello_req reply with an error, in which
+        case JSON is kept.
+
+        :param encodings: Encodings to ask for, in order of preference.
+        :type encodings: list
+        :returns: Encoding that will be used.
+
+        """
+        self.encoding = "json"
+        reply = self.request(msgs.hello_req(list(encodings)))
+        if reply["type"] == "hello_reply" and \
+                reply["encoding"] in wire.encodings:
+            self.encoding = reply["encoding"]
+        return self.encoding
+
     def discover(self):
         """Gets list of exported objects/methods, maps to local attributes.
 
@@ -103,8 +208,7 @@ class CtrlClient(object):
 
         """
         # Send list command to server and get response
-        self.ctrl_sock.send_json(msgs.list_req())
-        reply = self.ctrl_sock.recv_json()
+        reply = self.request(msgs.list_req())
 
         if reply["type"] != "list_reply":
             print "Error discovering objects: {}".format(reply)
@@ -119,8 +223,7 @@ class CtrlClient(object):
         # as a local representation of that object (including its
         # exported methods).
         for obj_name, methods in self.objects.items():
-            setattr(self, obj_name, ApiClass(
-                self.ctrl_sock, obj_name, methods))
+            setattr(self, obj_name, ApiClass(self, obj_name, methods))
 
     def call(self, obj_name, method, params):
         """Call a remote API method by name.
@@ -138,8 +241,54 @@ class CtrlClient(object):
         :returns: Result dict returned by remote control server.
 
         """
-        self.ctrl_sock.send_json(msgs.call_req(obj_name, method, params))
-        return self.ctrl_sock.recv_json()
+        return self.request(msgs.call_req(obj_name, method, params))
+
+    def batch(self, stop_on_error=True):
+        """Build a batch of API calls, sent in one round trip.
+
+        :param stop_on_error: Don't run the calls after one that fails.
+        :type stop_on_error: boolean
+        :returns: CallBatch context manager, see its docs for usage.
+
+        """
+        return CallBatch(self, stop_on_error)
+
+    def start_job(self, obj_name, method, params):
+        """Start a remote API call as a background job.
+
+        Needs CtrlServer in router mode. The call runs on the server while
+        this client is free to send other messages.
+
+        :param obj_name: Remote object on which to call a method over ZMQ.
+        :type obj_name: string
+        :param method: Remote method to call over ZMQ.
+        :type method: string
+        :param params: Params to pass to remote method, called over ZMQ.
+        :type params: dict
+        :returns: job_reply with the job's ID, or error dict.
+
+        """
+        return self.request(msgs.job_req(obj_name, method, params))
+
+    def job_status(self, job_id):
+        """Get the state of a background job, and its reply once done.
+
+        :param job_id: ID of the job, from start_job.
+        :type job_id: int
+        :returns: job_status_reply or error dict.
+
+        """
+        return self.request(msgs.job_status_req(job_id))
+
+    def cancel_job(self, job_id):
+        """Cancel a queued background job, or ask a running one to stop.
+
+        :param job_id: ID of the job, from start_job.
+        :type job_id: int
+        :returns: job_status_reply or error dict.
+
+        """
+        return self.request(msgs.job_cancel_req(job_id))
 
     def exit_server(self):
         """Send a message to the server, asking it to die.
@@ -147,8 +296,7 @@ class CtrlClient(object):
         :returns: Reply message from the server.
 
         """
-        self.ctrl_sock.send_json(msgs.exit_req())
-        return self.ctrl_sock.recv_json()
+        return self.request(msgs.exit_req())
 
     def ping(self):
         """Ping the control server.
@@ -157,13 +305,38 @@ class CtrlClient(object):
 
         """
         start = time()
-        self.ctrl_sock.send_json(msgs.ping_req())
-        reply = self.ctrl_sock.recv_json()
+        reply = self.request(msgs.ping_req())
         reply_time = (time() - start) * 1000
         if reply["type"] != "ping_reply":
             print "Ping failed: {}".format(reply)
         return reply_time
 
+    def check_performance(self, num_calls=1000):
+        """Time round trips of ping_req and driver.move in each encoding.
+
+        Moves are at speed 0, so the bot stays put.
+
+        :param num_calls: Number of round trips to time for each average.
+        :type num_calls: int
+        :returns: Dict of average round trip times in milliseconds.
+
+        """
+        encoding = self.encoding
+        move_req = msgs.call_req("driver", "move", {"speed": 0, "angle": 0})
+        results = {}
+        try:
+            for self.encoding in wire.encodings:
+                for name, msg in (("ping", msgs.ping_req()),
+                                  ("move", move_req)):
+                    start = time()
+                    for i in xrange(num_calls):
+                        self.request(msg)
+                    results["{}_{}_ms".format(self.encoding, name)] = \
+                        (time() - start) * 1000 / num_calls
+        finally:
+            self.encoding = encoding
+        return results
+
     def stop_full(self):
         self.call("ctrl", "stop_full", {})
 
@@ -9,6 +9,8 @@ except ImportError:
     sys.stderr.write("ERROR: Failed to import zmq. Is it installed?")
     raise
 
+import lib.telemetry as telemetry
+
 
 class SubClient(object):
 
@@ -21,6 +23,10 @@ class SubClient(object):
     and CtrlServer) running on the bot. The server own bot systems, like
     gunner and follower.
 
+    Published topics arrive as multipart telemetry frames (see
+    lib.telemetry). Use recv to get decoded messages one at a time, or
+    add_callback and then dispatch to have them passed to callbacks.
+
     """
 
     def __init__(self, sub_addr="tcp://127.0.0.1:60001"):
@@ -35,6 +41,8 @@ class SubClient(object):
         self.sub_addr = sub_addr
         self.sub_sock = self.context.socket(zmq.SUB)
         self.sub_sock.connect(self.sub_addr)
+        # (topic prefix, callback) pairs, see add_callback
+        self.callbacks = []
         print "SubClient subscribed to PubServer at {}".format(self.sub_addr)
 
     def print_msgs(self):
@@ -46,11 +54,81 @@ class SubClient(object):
         print "Printing messages, ctrl+c to quit loop..."
         while True:
             try:
-                pprint(self.sub_sock.recv())
+                topic, seq, timestamp, value = self.recv()
+                pprint("{} {}".format(topic, value))
             except KeyboardInterrupt:
                 print
                 return
 
+    def recv(self, timeout=None):
+        """Receive and decode the next published message.
+
+        NumPy array values are read-only views of the received frame, so
+        copy them before changing them.
+
+        :param timeout: Secs. to wait for a message, forever if None.
+        :type timeout: float
+        :returns: Tuple of topic, sequence no., monotonic sample time (on
+            the bot's clock) and value, or None if timeout expired.
+
+        """
+        if timeout is not None and \
+                not self.sub_sock.poll(timeout * 1000):
+            return None
+        return telemetry.unpack_frames(
+            self.sub_sock.recv_multipart(copy=False))
+
+    def add_callback(self, topic, callback):
+        """Subscribe to a topic and have its messages passed to a callback.
+
+        Callbacks are called by dispatch, with the topic, sequence no.,
+        sample time and value of each message whose topic starts with the
+        given topic.
+
+        :param topic: Topic (prefix) to listen for.
+        :type topic: string
+        :param callback: Function to call with each message.
+        :type callback: callable
+
+        """
+        self.callbacks.append((topic, callback))
+        self.add_topic(topic)
+
+    def del_callback(self, topic, callback):
+        """Stop passing messages of a topic to a callback.
+
+        The topic stays subscribed while other callbacks use it.
+
+        :param topic: Topic (prefix) given to add_callback.
+        :type topic: string
+        :param callback: Callback given to add_callback.
+        :type callback: callable
+
+        """
+        self.callbacks.remove((topic, callback))
+        self.del_topic(topic)
+
+    def dispatch(self, timeout=None, max_msgs=None):
+        """Receive messages and pass them to their callbacks.
+
+        :param timeout: Secs. to wait for each message, forever if None.
+        :type timeout: float
+        :param max_msgs: Stop after this many messages, never if None.
+        :type max_msgs: int
+        :returns: Number of messages received.
+
+        """
+        count = 0
+        while max_msgs is None or count < max_msgs:
+            msg = self.recv(timeout)
+            if msg is None:
+                break
+            count += 1
+            for topic, callback in self.callbacks:
+                if msg[0].startswith(topic):
+                    callback(*msg)
+        return count
+
     def add_topic(self, topic):
         """Set SUB socket to listen for the given topic.
 
@@ -0,0 +1,164 @@
+"""Mecanum wheel kinematics shared by the drivers.
+
+Wheel values are computed from the unit vector (sin, cos) of
+angle * pi / 180 + pi / 4. Since the bot drives at a handful of angles,
+unit vectors are cached per angle instead of being recomputed each move.
+The formulae are from Mecanumdrive.pdf in google drive, and every function
+gives exactly the same floats as the original MecDriver code.
+
+Wheel values are returned as (front_left, front_right, back_left,
+back_right), see MecDriver.wheel_names.
+
+"""
+
+from math import sin, cos, pi, fabs
+
+import numpy as np
+
+
+# Unit vectors by angle, see unit_vector
+unit_vectors = {}
+
+# Bounds the cache, in case some caller sweeps through lots of angles
+max_unit_vectors = 4096
+
+
+def unit_vector(angle):
+    """Get the (sin, cos) of a translation angle, offset by pi/4.
+
+    :param angle: Angle of translation in degrees (90=left, 270=right).
+    :type angle: float
+    :returns: Tuple of sin(angle * pi / 180 + pi / 4) and cos of the same.
+
+    """
+    try:
+        return unit_vectors[angle]
+    except KeyError:
+        pass
+    vector = (sin(angle * pi / 180 + pi / 4), cos(angle * pi / 180 + pi / 4))
+    if len(unit_vectors) < max_unit_vectors:
+        unit_vectors[angle] = vector
+    return vector
+
+
+def move_wheels(speed, angle):
+    """Get wheel values to translate without rotation.
+
+    The largest wheel value is scaled to speed, for maximum efficiency.
+    Speed must not be zero.
+
+    :param speed: Magnitude of translation speed (% of max).
+    :type speed: float
+    :param angle: Angle of translation in degrees (90=left, 270=right).
+    :type angle: float
+    :returns: Tuple of the four wheel values.
+
+    """
+    s, c = unit_vector(angle)
+    front_left = speed * s
+    front_right = speed * c
+    # Back wheels mirror the front ones, so only two magnitudes to compare
+    max_wheel_speed = max(fabs(front_left), fabs(front_right))
+    front_left = front_left * speed / max_wheel_speed
+    front_right = front_right * speed / max_wheel_speed
+    return (front_left, front_right, front_right, front_left)
+
+
+def compound_wheels(translate_speed, translate_angle, angular_rate):
+    """Get wheel values to translate and rotate at the same time.
+
+    Wheel values are scaled so the largest is translate_speed +
+    angular_rate.
+
+    :param translate_speed: Magnitude of translation speed (% of max).
+    :type translate_speed: float
+    :param translate_angle: Angle of translation in degrees.
+    :type translate_angle: float
+    :param angular_rate: Rotation rate, positive is counterclockwise.
+    :type angular_rate: float
+    :returns: Tuple of the four wheel values.
+
+    """
+    s, c = unit_vector(translate_angle)
+    front_left = translate_speed * s + angular_rate
+    front_right = translate_speed * c - angular_rate
+    back_left = translate_speed * c + angular_rate
+    back_right = translate_speed * s - angular_rate
+    max_wheel_speed = max(fabs(front_left), fabs(front_right),
+                          fabs(back_left), fabs(back_right))
+    total_speed = translate_speed + angular_rate
+    return (front_left * total_speed / max_wheel_speed,
+            front_right * total_speed / max_wheel_speed,
+            back_left * total_speed / max_wheel_speed,
+            back_right * total_speed / max_wheel_speed)
+
+
+def compound_wheels_array(translate_speeds, translate_angles, angular_rates):
+    """Get wheel values for many compound moves at once.
+
+    Vectorized version of compound_wheels, for planning or simulating a
+    whole sequence of commands. Rows give the same floats as calling
+    compound_wheels for each command; rows where every wheel would be
+    zero are nan instead of raising ZeroDivisionError.
+
+    :param translate_speeds: Translation speed of each command.
+    :type translate_speeds: sequence of floats
+    :param translate_angles: Translation angle of each command, in degrees.
+    :type translate_angles: sequence of floats
+    :param angular_rates: Rotation rate of each command.
+    :type angular_rates: sequence of floats
+    :returns: Nx4 float array, columns are the four wheels.
+
+    """
+    speeds = np.asarray(translate_speeds, dtype=float)
+    rates = np.asarray(angular_rates, dtype=float)
+    # Unit vectors come from math.sin/cos, numpy's can differ in the last bit
+    vectors = np.array([unit_vector(angle) for angle in translate_angles],
+                       dtype=float).reshape(-1, 2)
+    s = speeds * vectors[:, 0]
+    c = speeds * vectors[:, 1]
+    wheels = np.column_stack((s + rates, c - rates, c + rates, s - rates))
+    max_wheel_speeds = np.abs(wheels).max(axis=1)
+    total_speeds = speeds + rates
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return wheels * total_speeds[:, np.newaxis] / \
+            max_wheel_speeds[:, np.newaxis]
+
+
+def reference_move_wheels(speed, angle):
+    """Original, uncached MecDriver.move math, to check and time against."""
+    front_left = speed * sin(angle * pi / 180 + pi / 4)
+    front_right = speed * cos(angle * pi / 180 + pi / 4)
+    back_left = speed * cos(angle * pi / 180 + pi / 4)
+    back_right = speed * sin(angle * pi / 180 + pi / 4)
+    max_wheel_speed = max(
+        [fabs(front_left), fabs(front_right),
+            fabs(back_left), fabs(back_right)]
+    )
+    front_left = front_left * speed / max_wheel_speed
+    front_right = front_right * speed / max_wheel_speed
+    back_left = back_left * speed / max_wheel_speed
+    back_right = back_right * speed / max_wheel_speed
+    return (front_left, front_right, back_left, back_right)
+
+
+def reference_compound_wheels(translate_speed, translate_angle, angular_rate):
+    """Original, uncached MecDriver.compound_move math."""
+    front_left = translate_speed * \
+        sin(translate_angle * pi / 180 + pi / 4) + angular_rate
+    front_right = translate_speed * \
+        cos(translate_angle * pi / 180 + pi / 4) - angular_rate
+    back_left = translate_speed * \
+        cos(translate_angle * pi / 180 + pi / 4) + angular_rate
+    back_right = translate_speed * \
+        sin(translate_angle * pi / 180 + pi / 4) - angular_rate
+    max_wheel_speed = max(
+        [fabs(front_left), fabs(front_right),
+            fabs(back_left), fabs(back_right)]
+    )
+    total_speed = translate_speed + angular_rate
+    front_left = front_left * total_speed / max_wheel_speed
+    front_right = front_right * total_speed / max_wheel_speed
+    back_left = back_left * total_speed / max_wheel_speed
+    back_right = back_right * total_speed / max_wheel_speed
+    return (front_left, front_right, back_left, back_right)
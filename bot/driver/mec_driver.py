@@ -1,9 +1,10 @@
 """Pass low-level move commands to motors with mecanum wheels."""
 
-from math import sin, cos, pi, fabs, sqrt, hypot, atan2, degrees
+from math import pi, hypot, atan2, degrees
 from time import sleep, time
 
 import bot.driver.driver as driver
+import bot.driver.kinematics as kinematics
 import bot.lib.lib as lib
 from bot.hardware.dmcc_motor import DMCCMotorSet
 
@@ -21,6 +22,9 @@ class MecDriver(driver.Driver):
     min_angular_rate = -100
     max_angular_rate = 100
 
+    # Order of wheel values given to set_wheels
+    wheel_names = ("front_left", "front_right", "back_left", "back_right")
+
     # Used to keep track of last set speeds.
     # translate_speed = 0
     # translate_angle = 0
@@ -57,6 +61,20 @@ class MecDriver(driver.Driver):
         else:
             self.motors[name].velocity = value
 
+    @lib.api_call
+    def set_wheels(self, front_left, front_right, back_left, back_right):
+        """Set all four wheels in one batched update.
+
+        Writes are grouped per DMCC board and unchanged wheels are skipped,
+        see DMCCMotorSet.set_batch.
+
+        :returns: Number of motors written.
+
+        """
+        return self.motors.set_batch(
+            MecDriver.wheel_names,
+            (front_left, front_right, back_left, back_right), self.mode)
+
     @property
     def speed(self):
         """Getter for bot's current overall speed as % of max
@@ -136,10 +154,7 @@ class MecDriver(driver.Driver):
 
         # if rate == 0:  # TODO deadband (epsilon) check?
 
-        self.set_motor("front_left", -rate)
-        self.set_motor("front_right", rate)
-        self.set_motor("back_left", -rate)
-        self.set_motor("back_right", rate)
+        self.set_wheels(-rate, rate, -rate, rate)
 
         # NOTE(napratin, 9/17):
         # Set motor directions, based on http://goo.gl/B1KEUV
@@ -159,7 +174,7 @@ class MecDriver(driver.Driver):
         """
 
         # Validate params
-        self.logger.debug("speed: {}, angle: {}".format(speed, angle))
+        self.logger.debug("speed: %s, angle: %s", speed, angle)
         try:
             assert MecDriver.min_speed <= speed <= MecDriver.max_speed
         except AssertionError:
@@ -175,44 +190,18 @@ class MecDriver(driver.Driver):
         # Handle zero speed, prevent divide-by-zero error
         if speed == 0:  # TODO deadband (epsilon) check?
             self.logger.debug("Special case for speed == 0")
-            self.set_motor("front_left", 0)
-            self.set_motor("front_right", 0)
-            self.set_motor("back_left", 0)
-            self.set_motor("back_right", 0)
+            self.set_wheels(0, 0, 0, 0)
             return
 
-        # Calculate motor speeds
-        # Formulae from Mecanumdrive.pdf in google drive.
+        # Calculate motor speeds, normalized so the fastest is at speed
         # TODO Check math: why are all the phase offsets +pi/4?
-        front_left = speed * sin(angle * pi / 180 + pi / 4)
-        front_right = speed * cos(angle * pi / 180 + pi / 4)
-        back_left = speed * cos(angle * pi / 180 + pi / 4)
-        back_right = speed * sin(angle * pi / 180 + pi / 4)
-        self.logger.debug((
-            "pre-scale : front_left: {:6.2f}, front_right: {:6.2f},"
-            " back_left: {:6.2f}, back_right: {:6.2f}").format(
-                front_left, front_right, back_left, back_right))
-
-        # Find largest motor speed,
-        # use that to normalize multipliers and maintain maximum efficiency
-        max_wheel_speed = max(
-            [fabs(front_left), fabs(front_right),
-                fabs(back_left), fabs(back_right)]
-        )
-        front_left = front_left * speed / max_wheel_speed
-        front_right = front_right * speed / max_wheel_speed
-        back_left = back_left * speed / max_wheel_speed
-        back_right = back_right * speed / max_wheel_speed
+        wheels = kinematics.move_wheels(speed, angle)
         self.logger.debug(
-            ("post-scale: front_left: {:6.2f}, front_right: {:6.2f},"
-                " back_left: {:6.2f}, back_right: {:6.2f}").format(
-                    front_left, front_right, back_left, back_right))
+            "post-scale: front_left: %6.2f, front_right: %6.2f,"
+            " back_left: %6.2f, back_right: %6.2f", *wheels)
 
         # Set motor speeds
-        self.set_motor("front_left", front_left)
-        self.set_motor("front_right", front_right)
-        self.set_motor("back_left", back_left)
-        self.set_motor("back_right", back_right)
+        self.set_wheels(*wheels)
 
     @lib.api_call
     def hard_stop(self,current_speed, current_angle=0):
@@ -255,46 +244,20 @@ class MecDriver(driver.Driver):
             self.logger.warn("Total speed of move exceeds max: {}/{}".format(
                 total_speed, MecDriver.max_speed))
 
-        self.logger.debug("translate_speed: {}, " +
-                          "translate_angle: {}, " +
-                          "angular_rate: {}".format(translate_speed,
-                                                    translate_angle,
-                                                    angular_rate))
-
-        # Calculate overall voltage multiplier
-        front_left = translate_speed * \
-            sin(translate_angle * pi / 180 + pi / 4) + angular_rate
-        front_right = translate_speed * \
-            cos(translate_angle * pi / 180 + pi / 4) - angular_rate
-        back_left = translate_speed * \
-            cos(translate_angle * pi / 180 + pi / 4) + angular_rate
-        back_right = translate_speed * \
-            sin(translate_angle * pi / 180 + pi / 4) - angular_rate
-
-        # Find largest motor speed,
-        # use that to normalize multipliers and maintain maximum efficiency
-        max_wheel_speed = max(
-            [fabs(front_left), fabs(front_right),
-                fabs(back_left), fabs(back_right)]
-        )
-
-        total_speed = translate_speed + angular_rate
-
-        front_left = front_left * total_speed / max_wheel_speed
-        front_right = front_right * total_speed / max_wheel_speed
-        back_left = back_left * total_speed / max_wheel_speed
-        back_right = back_right * total_speed / max_wheel_speed
+        self.logger.debug(
+            "translate_speed: %s, translate_angle: %s, angular_rate: %s",
+            translate_speed, translate_angle, angular_rate)
 
+        # Calculate overall voltage multiplier, normalized so the fastest
+        # wheel is at total_speed
+        wheels = kinematics.compound_wheels(
+            translate_speed, translate_angle, angular_rate)
         self.logger.debug(
-            ("post-scale: front_left: {:6.2f}, front_right: {:6.2f},"
-                " back_left: {:6.2f}, back_right: {:6.2f}").format(
-                    front_left, front_right, back_left, back_right))
+            "post-scale: front_left: %6.2f, front_right: %6.2f,"
+            " back_left: %6.2f, back_right: %6.2f", *wheels)
 
         # Set motor speeds
-        self.set_motor("front_left", front_left)
-        self.set_motor("front_right", front_right)
-        self.set_motor("back_left", back_left)
-        self.set_motor("back_right", back_right)
+        self.set_wheels(*wheels)
 
     @lib.api_call
     def drive(self, speed=50, angle=0, duration=1):
@@ -326,3 +289,34 @@ class MecDriver(driver.Driver):
     def jerk(self, speed=80, angle=0, duration=.2):
         """Makes small forward jump - a thin wrapper over drive()."""
         self.drive(speed, angle, duration)
+
+    @lib.api_call
+    def check_performance(self, num_calls=10000):
+        """Time the move math, with and without the kinematics table.
+
+        Only the wheel math is timed, no motors are set.
+
+        :param num_calls: Number of calls to time for each function.
+        :type num_calls: int
+        :returns: Dict of calls/sec of the original and table-based math.
+
+        """
+        angles = [0, 45, 90, 180, 270]
+        args = [(50, angles[i % len(angles)], 10) for i in xrange(num_calls)]
+        rates = {}
+        for name, func in (
+                ("reference_move", kinematics.reference_move_wheels),
+                ("move", kinematics.move_wheels),
+                ("reference_compound_move",
+                    kinematics.reference_compound_wheels),
+                ("compound_move", kinematics.compound_wheels)):
+            if "compound" in name:
+                start_time = time()
+                for speed, angle, rate in args:
+                    func(speed, angle, rate)
+            else:
+                start_time = time()
+                for speed, angle, rate in args:
+                    func(speed, angle)
+            rates[name] = num_calls / (time() - start_time)
+        return rates
@@ -4,3 +4,26 @@ class LineLostError(Exception):
 
     def __str__(self):
         return repr(self.value)
+
+
+class RoutineStopped(Exception):
+    """Raised by a follower routine that was stopped before finishing.
+
+    The motors are already stopped when this is raised.
+
+    """
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
+class RoutineCancelled(RoutineStopped):
+    """Raised when a routine is cancelled, see Follower.cancel."""
+    pass
+
+
+class RoutineTimeout(RoutineStopped):
+    """Raised when a routine runs past its timeout."""
+    pass
@@ -1,6 +1,8 @@
 """Logic for line following."""
 
 import sys
+import threading
+from contextlib import contextmanager
 from time import time
 from time import sleep
 import numpy as np
@@ -9,9 +11,10 @@ import bot.lib.lib as lib
 import bot.hardware.ir_hub as ir_hub_mod
 import bot.driver.mec_driver as mec_driver_mod
 import pid as pid_mod
+import loop_scheduler as loop_scheduler_mod
 import bot.hardware.color_sensor as color_sensor_mod
 
-from error_cases import LineLostError
+from error_cases import LineLostError, RoutineCancelled, RoutineTimeout
 
 class Follower(object):
 
@@ -29,6 +32,67 @@ class Follower(object):
 
     THRESH = 60
 
+    # Bits of the branch mask given by classify_branches
+    Front_Branch = 8
+    Back_Branch = 4
+    Left_Branch = 2
+    Right_Branch = 1
+    Branch_Bits = (("front", Front_Branch), ("back", Back_Branch),
+                   ("left", Left_Branch), ("right", Right_Branch))
+
+    # What recover does for each branch mask.
+    # Entries are (log message, method name, method args, recover again?).
+    Recovery_Cases = (
+        # 0: nothing
+        ("completely lost. Flailing", None, (), False),
+        # 1: right
+        ("C1: right known: rotate right", "rotate_to_line", ("right",), True),
+        # 2: left
+        ("C2: left known: rotate left", "rotate_to_line", ("left",), True),
+        # 3: left, right
+        ("C3: sides known: roate right", "rotate_to_line", ("right",), True),
+        # 4: back
+        ("C4: back known: Inch back", "inch", (180,), True),
+        # 5: back, right
+        ("C5: back/right known: rotate right", "rotate_to_line", ("right",),
+            False),
+        # 6: back, left
+        ("C6: back/left known: rotate right", "rotate_to_line", ("left",),
+            False),
+        # 7: back, left, right
+        # Todo: SHould this be a end condition?
+        ("C7: front only known: inch fwd", "turn_around", (), True),
+        # 8: front
+        ("C8: Inch forward", "inch", (0,), True),
+        # 9: front, right
+        ("C9: front/side. Done", None, (), False),
+        # 10: front, left
+        ("C10: front/side. Done", None, (), False),
+        # 11 - 14: front, with back and/or both sides
+        ("Recovered successfully. Now following line - Cases 11 - 14",
+            None, (), False),
+        ("Recovered successfully. Now following line - Cases 11 - 14",
+            None, (), False),
+        ("Recovered successfully. Now following line - Cases 11 - 14",
+            None, (), False),
+        ("Recovered successfully. Now following line - Cases 11 - 14",
+            None, (), False),
+        # 15: all
+        ("C15: Reached activity area. Take appropriate action.",
+            None, (), False))
+
+    # Max no. of recovery actions taken by one recover call
+    max_recovery_steps = 10
+
+    # Rows of IR frames (see IRHub.read_frame)
+    Front, Back, Left, Right = range(4)
+
+    # Line position for the index of an array's strongest reading,
+    # see track_position
+    Position_Table = np.array(
+        [5.0 * (4.0 - i) * (4.0 - i) * (4.0 - i) for i in range(4)] +
+        [5.0 * (3.0 - i) * (3.0 - i) * (3.0 - i) for i in range(4, 8)])
+
     def __init__(self):
         # Build logger
         self.logger = lib.get_logger()
@@ -49,6 +113,14 @@ class Follower(object):
         self.back_right_error = 0.0
         self.back_left = pid_mod.PID();
         self.back_left_error = 0.0
+        # Runs analog_state at a fixed rate
+        self.loop = loop_scheduler_mod.LoopScheduler()
+
+        # Cancellation of long-running routines, see cancel and routine
+        self.stop_event = threading.Event()
+        self.routine_depth = 0
+        self.routine_deadline = None
+        self.timeouts = lib.get_config()["follower_timeouts"]
         self.strafe = pid_mod.PID()
         self.strafe_error = 0.0
         self.rotate_pid = pid_mod.PID()
@@ -230,17 +302,20 @@ class Follower(object):
         """Recieves time period for which to continuously watch for line.
         Returns True when line is found.
         Returns False if line is not found before time is hit.
+        Raises RoutineCancelled if cancelled first.
         """
-        start_time = time()
-        while True:
-            reading = self.ir_hub.read_all()
-            for name, array in reading.iteritems():
-                if self.reading_contains_pattern([1, 1], array):
-                    return {"line_found": True,
-                            "time_elapsed": time() - start_time}
-                if time() - start_time > max_time:
+        start_time = lib.monotonic()
+        snapshot = None
+        with self.routine():
+            while True:
+                snapshot = self.wait_for_snapshot(snapshot)
+                for name, array in snapshot.readings.iteritems():
+                    if self.reading_contains_pattern([1, 1], array):
+                        return {"line_found": True,
+                                "time_elapsed": lib.monotonic() - start_time}
+                if lib.monotonic() - start_time > max_time:
                     return {"line_found": False,
-                            "time_elapsed": time() - start_time}
+                            "time_elapsed": lib.monotonic() - start_time}
 
     @lib.api_call
     def assign_states(self, current_ir_reading=None):
@@ -686,14 +761,12 @@ class Follower(object):
     def analog_state(self):
         """Make call to analog arrays"""
 
-        # Take current time before reading ADC readings of the IRs
-        previous_time = time()
         self.front_right.set_k_values(kp = .2, kd = 0.1, ki = 0.0)
         self.front_left.set_k_values(kp = .2, kd = 0.1, ki = 0.0)
 
         self.back_right.set_k_values(kp = .03, kd = 0.009, ki = 0.0)
         self.back_left.set_k_values(kp = .03, kd = 0.009, ki = 0.0)
-        self.front_bin = [[0 for x in range(8)] for y in range(3)]
+        self.front_bin = np.zeros((3, 8), dtype=np.uint8)
 
         self.front_right_error = 0.0
         self.front_left_error = 0.0
@@ -702,28 +775,26 @@ class Follower(object):
         left_count = 0
         right_count = 0
 
+        self.loop.reset()
         while True:
-            # Read ir arrays
-            self.array_block = self.ir_hub.read_all()
-            self.normalize_arrays()
-            self.track_position()
-
-            # Get the current time of the CPU
-            current_time = time()
-            self.sampling_time = current_time - previous_time
+            # Wait for the next tick, PIDs use the measured time between ticks
+            self.sampling_time = self.loop.wait_for_tick()
+            self.check_stop()
 
-            # time before reading the IRs
-            previous_time = time()
+            # Read ir arrays, as one 4x8 block
+            raw_frame = self.ir_hub.read_frame()
+            self.loop.end_phase("read")
+            self.frame = self.normalize_frame(raw_frame)
+            self.bot_front_position, self.bot_back_position = \
+                self.track_frame_position(self.frame)
 
             # Count the number of hits
-            front_hits = self.count_num_of_hits(self.array_block["front"])
-            back_hits  = self.count_num_of_hits(self.array_block["back"])
-            right_hits = self.count_num_of_hits(self.array_block['right'])
-            left_hits  = self.count_num_of_hits(self.array_block['left'])
+            front_hits, back_hits, left_hits, right_hits = \
+                self.count_frame_hits(self.frame)
 
-            self.front_bin[2] = self.front_bin[1]
-            self.front_bin[1] = self.front_bin[0]
-            self.front_bin[0] = self.assign_bin(self.array_block["front"])
+            self.front_bin = np.roll(self.front_bin, 1, axis=0)
+            self.front_bin[0] = self.assign_frame_bins(
+                self.frame[Follower.Front])
 
             # print "fornt hits {}".format(self.front_bin[0])
             #right_hits = self.count_num_of_hits(self.array_block["right"])
@@ -745,8 +816,11 @@ class Follower(object):
             #        self.driver.move(0,0)
             #        return "right turn"
 
-            if front_hits > 3 or self.is_centerred_on_line('left') \
-                    or self.is_centerred_on_line('right'): # or right_hits > 2 or left_hits > 2:
+            raw_readings = dict(zip(self.ir_hub.frame_order, raw_frame))
+            # Was also: or right_hits > 2 or left_hits > 2
+            if front_hits > 3 \
+                    or self.is_centerred_on_line('left', raw_readings) \
+                    or self.is_centerred_on_line('right', raw_readings):
                 sleep(0.01)
                 self.driver.move(60,180)
                 sleep(0.01)
@@ -771,7 +845,7 @@ class Follower(object):
                 self.driver.move(speed = 0, angle = 0)
                 print "lost line"
                 raise LineLostError("reading: {}".format(
-                                        self.array_block()))
+                                        self.frame.tolist()))
 
             if(front_hits > 0):
                 # Call PID
@@ -846,14 +920,27 @@ class Follower(object):
                 elif(self.back_left_error <= -80):
                     self.back_left_error = -80
 
-            self.driver.set_motor(name = "front_right",
-                                 value = self.front_right_error)
-            self.driver.set_motor(name = "front_left",
-                                 value = self.front_left_error)
-            self.driver.set_motor(name = "back_right",
-                                 value = self.back_right_error)
-            self.driver.set_motor(name = "back_left",
-                                 value = self.back_left_error)
+            self.loop.end_phase("compute")
+
+            # Outputs from a late tick are stale, leave them for the next one
+            if not self.loop.should_actuate():
+                continue
+            self.driver.set_wheels(
+                front_left=self.front_left_error,
+                front_right=self.front_right_error,
+                back_left=self.back_left_error,
+                back_right=self.back_right_error)
+            self.loop.end_phase("actuate")
+
+    @lib.api_call
+    def get_loop_stats(self):
+        """Get timing stats of the analog_state control loop.
+
+        :returns: Dict of overruns, per-phase timings and a histogram of
+            loop periods, see LoopScheduler.get_stats.
+
+        """
+        return self.loop.get_stats()
 
     def normalize_arrays(self):
         """Uesd to mormaliza ir readings coming form the ir array"""
@@ -904,6 +991,51 @@ class Follower(object):
                 array[index] = 1
         return array
 
+    def normalize_frame(self, frame):
+        """Vectorized normalize_arrays, over a whole IR frame at once.
+
+        :param frame: Raw IR frame, see IRHub.read_frame.
+        :type frame: numpy.ndarray
+        :returns: Normalized uint8 frame.
+
+        """
+        return np.clip(155 - frame.astype(np.int16), 0, 155).astype(np.uint8)
+
+    def track_frame_position(self, frame):
+        """Vectorized track_position, over a whole normalized IR frame.
+
+        :param frame: Normalized IR frame.
+        :type frame: numpy.ndarray
+        :returns: Tuple of bot front and back positions.
+
+        """
+        rows = frame[Follower.Front:Follower.Back + 1]
+        indices = rows.argmax(axis=1)
+        peaks = rows[(0, 1), indices]
+        positions = Follower.Position_Table[indices]
+        return tuple(0 if peak < 10 else float(position)
+                     for peak, position in zip(peaks, positions))
+
+    def count_frame_hits(self, frame):
+        """Vectorized count_num_of_hits, for every array of a frame.
+
+        :param frame: Normalized IR frame.
+        :type frame: numpy.ndarray
+        :returns: List of hit counts, in frame row order.
+
+        """
+        return (frame > 90).sum(axis=1).tolist()
+
+    def assign_frame_bins(self, frame):
+        """Vectorized assign_bin, for one array or a whole frame.
+
+        :param frame: Normalized IR array or frame.
+        :type frame: numpy.ndarray
+        :returns: uint8 array of the same shape, 1 above THRESH, else 0.
+
+        """
+        return (frame > self.THRESH).astype(np.uint8)
+
     @lib.api_call
     def check_for_branch(self, side):
         """Checks to see if there is a branch on the left.
@@ -917,229 +1049,328 @@ class Follower(object):
         if hits <= 6:
             return True
         return False       
-        
+
+    @lib.api_call
+    def classify_branches(self, readings=None):
+        """Check for branches on all four sides using a single IR scan.
+
+        Same test as check_for_branch, but one read covers every side.
+
+        :param readings: IR readings to classify, read now if None.
+        :type readings: dict
+        :returns: Branch mask, OR of Front/Back/Left/Right_Branch bits.
+
+        """
+        if readings is None:
+            readings = self.ir_hub.read_all()
+        mask = 0
+        for side, bit in Follower.Branch_Bits:
+            if self.count_num_of_hits(readings[side]) <= 6:
+                mask |= bit
+        return mask
+
     @lib.api_call
     def is_intersection(self):
         """Determines whether an anomaly is a turn or an intersection.
         """
-        if (self.check_for_branch("right") \
-                or self.check_for_branch("left"))\
-            and self.check_for_branch("front"):
+        mask = self.classify_branches()
+        if mask & (Follower.Right_Branch | Follower.Left_Branch) \
+                and mask & Follower.Front_Branch:
             return True
         return False
 
     @lib.api_call
     def find_dir_of_int(self):
-        if not (
-            (self.check_for_branch("right") \
-                or self.check_for_branch("left"))\
-            and self.check_for_branch("front")):
-           return "error: not intersection"
-
-        elif self.check_for_branch("right")\
-            and self.check_for_branch("left"):
+        mask = self.classify_branches()
+        right = mask & Follower.Right_Branch
+        left = mask & Follower.Left_Branch
+        if not ((right or left) and mask & Follower.Front_Branch):
+            return "error: not intersection"
+        elif right and left:
             return "error: branches in both dirs.111"
-        
-        elif self.check_for_branch("right"):
+        elif right:
             return "right"
-
-        elif self.check_for_branch("left"):
+        elif left:
             return "left"
-  
+
     @lib.api_call
     def find_dir_of_turn(self):
         """Determines whether a turn is on the right or left
         :returns: right, left, intersection, error
         """
-        
-        if (self.check_for_branch("right") \
-            and self.check_for_branch("left")):
+        mask = self.classify_branches()
+        right = mask & Follower.Right_Branch
+        left = mask & Follower.Left_Branch
+        if right and left:
             return "error: too many intersections"
-
-        elif not self.check_for_branch("right") \
-            and not self.check_for_branch("left"):
+        elif not right and not left:
             return "error: no branches"
-
-        elif  self.check_for_branch("right"):
+        elif right:
             return "right"
-
-        elif self.check_for_branch("left"):
+        elif left:
             return "left"
-
         else:
             return "error: No condition found. Line lost."
 
     @lib.api_call
-    def is_centerred_on_line(self, side='front'):
+    def is_centerred_on_line(self, side='front', readings=None):
         """Checks to see if bot is reasonably within center line.
+
+        :param side: Array to check.
+        :param readings: Raw IR readings to check, read now if None.
         """
-        arr_block = self.ir_hub.read_all()
+        if readings is None:
+            readings = self.ir_hub.read_all()
+        arr_block = readings
         if arr_block[side][4] < self.THRESH \
             or arr_block[side][5] < self.THRESH:
             return True
         return False 
         
     @lib.api_call
-    def follow_ignoring_turns(self):
+    def cancel(self):
+        """Stop the running routine and the motors.
+
+        Routines check for cancellation at least once per control period,
+        then stop the motors and raise RoutineCancelled. The motors are
+        also stopped right away, in case no routine is running.
+
+        :returns: Description of what was cancelled.
+
+        """
+        self.stop_event.set()
+        self.driver.move(0, 0)
+        if self.routine_depth == 0:
+            return "No routine running, motors stopped"
+        return "Cancelling routine"
+
+    def reset_cancel(self):
+        """Clear an earlier cancel, so new routines can run.
+
+        Called by CtrlServer as each follower call or job starts, not as
+        routines start, so a cancel that comes in after a job starts but
+        before its first routine does isn't lost. Does nothing while a
+        routine is running, as the cancel is still meant for it.
+
+        """
+        if self.routine_depth == 0:
+            self.stop_event.clear()
+
+    @contextmanager
+    def routine(self, timeout=None):
+        """Track a cancellable routine while the with block runs.
+
+        Routines raise RoutineCancelled once cancel is called, until
+        reset_cancel is. Nested routines can't outlive the routines that
+        called them, so their deadline is the earliest of their own and
+        their caller's.
+
+        :param timeout: Max run time (secs), None for no limit.
+        :type timeout: float
+
+        """
+        outer_deadline = self.routine_deadline
+        if timeout is not None:
+            deadline = lib.monotonic() + timeout
+            if outer_deadline is None or deadline < outer_deadline:
+                self.routine_deadline = deadline
+        self.routine_depth += 1
+        try:
+            yield
+        finally:
+            self.routine_depth -= 1
+            self.routine_deadline = outer_deadline
+
+    def check_stop(self):
+        """Stop the motors and raise if the routine should stop.
+
+        :raises: RoutineCancelled if cancel was called, RoutineTimeout if
+            the routine's deadline has passed.
+
+        """
+        if self.stop_event.is_set():
+            self.driver.move(0, 0)
+            raise RoutineCancelled("Routine cancelled")
+        if self.routine_deadline is not None and \
+                lib.monotonic() > self.routine_deadline:
+            self.driver.move(0, 0)
+            raise RoutineTimeout("Routine timed out")
+
+    def pause(self, duration):
+        """Sleep, but wake up and stop as soon as the routine is stopped.
+
+        :param duration: Time to sleep (secs).
+        :type duration: float
+
+        """
+        self.stop_event.wait(duration)
+        self.check_stop()
+
+    def wait_for_snapshot(self, last=None):
+        """Wait for IR readings newer than the last ones a routine used.
+
+        When the IR sampler is running, this wakes up as soon as it
+        publishes a new frame. Otherwise, the arrays are scanned once per
+        control period. Either way, cancellation and timeouts are checked
+        at least once per control period, and the CPU is free in between.
+
+        :param last: Snapshot the caller last used, None on the first call.
+        :type last: IRSnapshot
+        :returns: Newer IRSnapshot.
+        :raises: RoutineCancelled or RoutineTimeout, see check_stop.
+
+        """
         while True:
-            # self.recover()
-            try:
-                state = self.analog_state()
-                # Inch forward to be square on int
-                # self.driver.jerk(speed=60,angle=0,duration=0.1)
-                turn_dir = self.find_dir_of_turn()
-                if turn_dir == "right" or turn_dir == "left":
-                    self.rotate_to_line(turn_dir)
-                    # self.driver.rough_rotate_90(turn_dir, r_time=0.6)
-                    # Move out of intersection
-                    # self.driver.drive(60, angle=0, duration=0.1) 
-                else:
+            self.check_stop()
+            sampler = self.ir_hub.sampler
+            if sampler is None:
+                if last is not None:
+                    self.pause(self.loop.period)
+                return self.ir_hub.get_snapshot()
+            snapshot = sampler.wait_for_snapshot(
+                0 if last is None or last.seq is None else last.seq,
+                self.loop.period)
+            if snapshot is not None:
+                self.check_stop()
+                return snapshot
+
+    @lib.api_call
+    def follow_ignoring_turns(self, timeout=None):
+        """Follow the line, taking turns, until recovery ends the run.
+
+        :param timeout: Max run time (secs), from config if None.
+        :type timeout: float
+        :raises: RoutineCancelled or RoutineTimeout if stopped first.
+
+        """
+        if timeout is None:
+            timeout = self.timeouts["follow_ignoring_turns"]
+        with self.routine(timeout):
+            while True:
+                # self.recover()
+                try:
+                    state = self.analog_state()
+                    # Inch forward to be square on int
+                    # self.driver.jerk(speed=60,angle=0,duration=0.1)
+                    turn_dir = self.find_dir_of_turn()
+                    if turn_dir == "right" or turn_dir == "left":
+                        self.rotate_to_line(turn_dir)
+                        # self.driver.rough_rotate_90(turn_dir, r_time=0.6)
+                        # Move out of intersection
+                        # self.driver.drive(60, angle=0, duration=0.1) 
+                    else:
+                        self.recover()
+                        break
+                except LineLostError:
+                    self.logger.error("Line lost, attempting to recover")
                     self.recover()
-                    break
-            except LineLostError:
-                self.logger.error("Line lost, attempting to recover")
-                self.recover()
 
 
     @lib.api_call
-    def rotate_to_line(self, direction, speed=50):
-        """Rotates in given direction until line is found."""
+    def rotate_to_line(self, direction, speed=50, timeout=None):
+        """Rotates in given direction until line is found.
+
+        :param timeout: Max run time (secs), from config if None.
+        :type timeout: float
+        :raises: RoutineCancelled or RoutineTimeout if stopped first.
+
+        """
+
+        if timeout is None:
+            timeout = self.timeouts["rotate_to_line"]
 
         # Correct speed to match direction
         if direction == "right":
             speed = -speed
 
-        self.driver.rotate(speed)
-        sleep(0.3) # allow time to leave current intersection
-         
-        while not self.is_centerred_on_line() \
-                or self.check_for_branch('back'):
-            self.logger.debug("looking for line")
-        
+        with self.routine(timeout):
+            self.driver.rotate(speed)
+            self.pause(0.3) # allow time to leave current intersection
+
+            snapshot = None
+            while True:
+                snapshot = self.wait_for_snapshot(snapshot)
+                if self.is_centerred_on_line(readings=snapshot.readings) \
+                        and not self.classify_branches(snapshot.readings) \
+                        & Follower.Back_Branch:
+                    break
+                self.logger.debug("looking for line")
+
         # throw in hard reverse to stop immediately
         self.driver.rotate(-speed)
         sleep(0.09)
         self.driver.rotate(0)
 
     @lib.api_call
-    def drive_to_line(self, speed=50, angle=0):
-        """Drives in certain direction blindly until line is found."""
+    def drive_to_line(self, speed=50, angle=0, timeout=None):
+        """Drives in certain direction blindly until line is found.
+
+        :param timeout: Max run time (secs), from config if None.
+        :type timeout: float
+        :raises: RoutineCancelled or RoutineTimeout if stopped first.
+
+        """
+
+        if timeout is None:
+            timeout = self.timeouts["drive_to_line"]
 
-        self.driver.move(speed,angle)
-        while not self.is_centerred_on_line():
-            self.logger.debug("looking for line")
+        with self.routine(timeout):
+            self.driver.move(speed,angle)
+            snapshot = None
+            while True:
+                snapshot = self.wait_for_snapshot(snapshot)
+                if self.is_centerred_on_line(readings=snapshot.readings):
+                    break
+                self.logger.debug("looking for line")
 
         self.driver.hard_stop(speed,angle)
     
     @lib.api_call
-    def recover(self):
-        """When recovery is needed, this function continually calls itself until problem is solved.
-        """
+    def recover(self, timeout=None):
+        """Take recovery actions until the problem is solved.
 
-        readings = self.ir_hub.read_all()
+        Each step classifies branches from a single IR scan, then looks up
+        what to do in Recovery_Cases. Gives up after max_recovery_steps.
 
-        # experiment with breaking any time front is detected.
+        :param timeout: Max run time (secs), from config if None.
+        :type timeout: float
+        :returns: Log message of the case recovery finished on.
+        :raises: RoutineCancelled or RoutineTimeout if stopped first.
 
-        #if self.check_for_branch('front'):
-        #    print "no need for recovery"
-        #    return
-        
-        if  not self.check_for_branch('front') \
-            and not self.check_for_branch('back') \
-            and not self.check_for_branch('left') \
-            and not self.check_for_branch('right'):
-            self.logger.debug("completely lost. Flailing") 
-            
-        elif not self.check_for_branch('front') \
-         and not self.check_for_branch('back') \
-         and not self.check_for_branch('left') \
-         and     self.check_for_branch('right'):
-            self.logger.debug("C1: right known: rotate right") 
-            self.rotate_to_line('right')
-            self.recover()
-
-        elif not self.check_for_branch('front') \
-         and not self.check_for_branch('back') \
-         and     self.check_for_branch('left') \
-         and not self.check_for_branch('right'):
-            self.logger.debug("C2: left known: rotate left")
-            self.rotate_to_line('left') 
-            self.recover()
-
-        elif not self.check_for_branch('front') \
-         and not self.check_for_branch('back') \
-         and     self.check_for_branch('left') \
-         and     self.check_for_branch('right'):
-            self.logger.debug("C3: sides known: roate right") 
-            self.rotate_to_line('right')
-            self.recover()
-
-        elif not self.check_for_branch('front') \
-         and     self.check_for_branch('back') \
-         and not self.check_for_branch('left') \
-         and not self.check_for_branch('right'):
-            self.logger.debug("C4: back known: Inch back") 
-            self.driver.drive(60,180,0.1)
-            self.recover()
-
-        elif not self.check_for_branch('front') \
-         and     self.check_for_branch('back') \
-         and not self.check_for_branch('left') \
-         and     self.check_for_branch('right'):
-            self.logger.debug("C5: back/right known: rotate right") 
-            self.rotate_to_line('right')
-
-        elif not self.check_for_branch('front') \
-         and     self.check_for_branch('back') \
-         and     self.check_for_branch('left') \
-         and not self.check_for_branch('right'):
-            self.logger.debug("C6: back/left known: rotate right") 
-            self.rotate_to_line('left')
+        """
+        if timeout is None:
+            timeout = self.timeouts["recover"]
+        with self.routine(timeout):
+            snapshot = None
+            for step in xrange(self.max_recovery_steps):
+                snapshot = self.wait_for_snapshot(snapshot)
+                mask = self.classify_branches(snapshot.readings)
+                message, action, args, again = Follower.Recovery_Cases[mask]
+                self.logger.debug(message)
+                if action is not None:
+                    getattr(self, action)(*args)
+                if not again:
+                    return message
+        self.logger.warning("Recovery gave up after {} steps".format(
+            self.max_recovery_steps))
+        return "Recovery gave up"
+
+    def inch(self, angle):
+        """Move a tiny bit in the given direction.
+
+        :raises: RoutineCancelled or RoutineTimeout, see check_stop.
 
-        # Todo: SHould this be a end condition?
-        elif not self.check_for_branch('front') \
-         and     self.check_for_branch('back') \
-         and     self.check_for_branch('left') \
-         and     self.check_for_branch('right'):
-            self.logger.debug("C7: front only known: inch fwd")
-            self.driver.rough_rotate_90('right')
-            self.driver.rough_rotate_90('right')
-            self.recover()
-
-        elif     self.check_for_branch('front') \
-         and not self.check_for_branch('back')  \
-         and not self.check_for_branch('left')  \
-         and not self.check_for_branch('right'):
-             self.logger.debug("C8: Inch forward")
-             self.driver.drive(60,0,0.1)
-             self.recover()
-
-        elif    self.check_for_branch('front') \
-         and not self.check_for_branch('back') \
-         and not self.check_for_branch('left') \
-         and     self.check_for_branch('right'):
-             #self.logger.debug("C9: front/side. inch towards")
-             #self.driver.drive(60,90,0.1)
-             #self.recover()
-             return
-
-        elif     self.check_for_branch('front') \
-         and not self.check_for_branch('back') \
-         and     self.check_for_branch('left') \
-         and not self.check_for_branch('right'):
-             #self.logger.debug("C10: shift left")
-             #self.driver.drive(60,-90,0.1)
-             #self.recover()
-             return
-        
-        elif     self.check_for_branch('front') \
-         and     self.check_for_branch('back') \
-         and     self.check_for_branch('left') \
-         and     self.check_for_branch('right'):
-             self.logger.debug("C15: Reached activity area. Take appropriate action.")
-             return
+        """
+        self.driver.move(60, angle)
+        self.pause(0.1)
+        self.driver.move(0, 0)
 
-        else:
-            self.logger.debug("Recovered successfully. Now following line - Cases 11 - 14")
-            return
-	    
+    def turn_around(self):
+        """Blindly rotate 180 degrees, like two rough_rotate_90s right.
+
+        :raises: RoutineCancelled or RoutineTimeout, see check_stop.
+
+        """
+        self.driver.rotate(-50)
+        self.pause(2)
+        self.driver.rotate(0)
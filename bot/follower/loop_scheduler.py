@@ -0,0 +1,152 @@
+"""Fixed-rate scheduler for control loops, like Follower.analog_state."""
+
+from time import sleep
+
+import bot.lib.lib as lib
+
+
+class LoopScheduler(object):
+
+    """Runs a loop at a fixed rate and keeps timing stats on it.
+
+    Deadlines are kept on a monotonic clock and advance by exactly one
+    period each tick, so time spent sleeping doesn't add up as drift.
+    A tick that starts more than a whole period after its deadline is an
+    overrun; the schedule is then resynced to now instead of firing a
+    burst of late ticks to catch up. Ticks less late than that keep the
+    schedule, so the next tick comes sooner. Ticks whose outputs are
+    ready after the next deadline are counted as missed deadlines, see
+    should_actuate.
+
+    Each tick is split into phases (read, compute, actuate). Call
+    end_phase after each one to record its duration.
+
+    """
+
+    phases = ("read", "compute", "actuate")
+
+    def __init__(self, rate=None):
+        """Build the scheduler.
+
+        :param rate: Loop frequency in Hz, read from config if None.
+        :type rate: float
+
+        """
+        self.logger = lib.get_logger()
+        loop_config = lib.get_config()["follower_loop"]
+        if rate is None:
+            rate = loop_config["rate"]
+        self.rate = float(rate)
+        self.period = 1.0 / self.rate
+        self.skip_late_actuation = loop_config["skip_late_actuation"]
+        self.hist_bin_width = loop_config["histogram_bin_ms"] / 1000.0
+        self.hist_bins = loop_config["histogram_bins"]
+        self.reset()
+
+    def reset(self):
+        """Clear stats and restart the schedule from now."""
+        self.ticks = 0
+        self.overruns = 0
+        self.missed_deadlines = 0
+        self.skipped_actuations = 0
+        self.skipped_last = False
+        self.dt = self.period
+        self.tick_start = None
+        self.phase_start = None
+        self.next_deadline = None
+        self.phase_totals = dict((phase, 0.0) for phase in self.phases)
+        self.phase_maxes = dict((phase, 0.0) for phase in self.phases)
+        # Last bin counts periods of hist_bins * hist_bin_width or longer
+        self.period_hist = [0] * (self.hist_bins + 1)
+
+    def wait_for_tick(self):
+        """Sleep until the next tick is due and start it.
+
+        :returns: Measured secs. since the previous tick started. The
+            nominal period is returned for the first tick.
+
+        """
+        now = lib.monotonic()
+        if self.next_deadline is None:
+            self.next_deadline = now
+        delay = self.next_deadline - now
+        if delay > 0:
+            sleep(delay)
+            now = lib.monotonic()
+        elif -delay > self.period:
+            # A whole period behind, so resync rather than catch up
+            self.overruns += 1
+            self.next_deadline = now
+
+        if self.tick_start is not None:
+            self.dt = now - self.tick_start
+            index = min(int(self.dt / self.hist_bin_width), self.hist_bins)
+            self.period_hist[index] += 1
+        self.tick_start = now
+        self.phase_start = now
+        self.next_deadline += self.period
+        self.ticks += 1
+        return self.dt
+
+    def end_phase(self, phase):
+        """Record the time spent in a phase of the current tick.
+
+        :param phase: One of LoopScheduler.phases.
+        :type phase: string
+
+        """
+        now = lib.monotonic()
+        duration = now - self.phase_start
+        self.phase_totals[phase] += duration
+        if duration > self.phase_maxes[phase]:
+            self.phase_maxes[phase] = duration
+        self.phase_start = now
+
+    def deadline_missed(self):
+        """Check if the current tick has run past the start of the next.
+
+        :returns: True if the next tick is already overdue.
+
+        """
+        return lib.monotonic() > self.next_deadline
+
+    def should_actuate(self):
+        """Decide if the current tick's outputs should be applied.
+
+        Outputs computed after the deadline are based on stale readings,
+        so they're skipped when skip_late_actuation is set. Two ticks are
+        never skipped back to back, so the motors keep getting commands
+        even if every tick runs late.
+
+        :returns: False if actuation should be skipped this tick.
+
+        """
+        if not self.deadline_missed():
+            self.skipped_last = False
+            return True
+        self.missed_deadlines += 1
+        if self.skip_late_actuation and not self.skipped_last:
+            self.skipped_actuations += 1
+            self.skipped_last = True
+            return False
+        self.skipped_last = False
+        return True
+
+    def get_stats(self):
+        """Get overrun counts, phase timings and the period histogram.
+
+        :returns: Dict of loop stats. Times are in secs.
+
+        """
+        ticks = max(self.ticks, 1)
+        return {"rate": self.rate,
+                "ticks": self.ticks,
+                "overruns": self.overruns,
+                "missed_deadlines": self.missed_deadlines,
+                "skipped_actuations": self.skipped_actuations,
+                "last_dt": self.dt,
+                "phase_avg": dict((phase, total / ticks) for phase, total
+                                  in self.phase_totals.iteritems()),
+                "phase_max": dict(self.phase_maxes),
+                "period_hist_bin_width": self.hist_bin_width,
+                "period_hist": list(self.period_hist)}
@@ -26,8 +26,12 @@ class PID(object):
     def pid(self, target, process_var, timestep):
         current_error = (target - process_var)
         p_error = self.kp * current_error
-        d_error = self.kd * (current_error - self.previous_error) \
-            / timestep
+        if timestep > 0:
+            d_error = self.kd * (current_error - self.previous_error) \
+                / timestep
+        else:
+            # No time has passed, so there's no rate of change to act on
+            d_error = 0
         self.integral_error = (
             current_error + self.previous_error) / 2 \
             + self.integral_error
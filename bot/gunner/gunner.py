@@ -8,6 +8,7 @@ import bot.hardware.turret as turret
 import bot.hardware.wheel_gun as wheel_gun
 import bot.hardware.ultrasonic as ultrasonic
 import bot.gunner.targeting_solver as targeting
+from bot.gunner.localizer import StreamingLocalizer
 
 
 class Gunner(object):
@@ -27,18 +28,59 @@ class Gunner(object):
         self.gun = wheel_gun.WheelGun()
         self.turret = turret.Turret()
         self.ultrasonics = ultrasonic.Ultrasonic()
+        self.localizer = StreamingLocalizer(
+            self.config['course']['default']['x_size'])
+        self.localize_timeout = self.config['localizer']['timeout']
+        self.spin_up_time = self.config['gun']['spin_up_time']
 
     @lib.api_call
     def localize(self):
         """Localize using ultrasonic sensors"""
-        dists = self.ultrasonics.read_dists()
+        estimate = self.localize_pose()
         # TODO: Handle skewed bot when not square to the course
         # (e.g. on the arc line)
-        x, y, theta = self.ratio_localizer(dists)
+        x, y, theta = estimate.x, estimate.y, estimate.theta
         self.logger.info("Localize calculated pose: ({}, {}, {})".format(
             x, y, theta))
         return x, y, theta
 
+    def localize_pose(self, timeout=None):
+        """Sample ultrasonics until the pose estimate is confident.
+
+        Frames are filtered and combined by StreamingLocalizer. Sampling
+        stops as soon as the estimate is confident, or at the timeout,
+        when the best estimate so far is used.
+
+        :param timeout: Max time to sample (secs), from config if None.
+        :type timeout: float
+        :returns: PoseEstimate of the bot's pose.
+        :raises: ValueError if no frame gave a valid pose.
+
+        """
+        if timeout is None:
+            timeout = self.localize_timeout
+        self.localizer.reset()
+        deadline = lib.monotonic() + timeout
+        seq = None
+        while True:
+            # Waits for a new frame if ultrasonics are sampled in background
+            units = self.ultrasonics.read_all_units(seq)
+            seq = units["seq"]
+            self.localizer.add(units["dists"])
+            estimate = self.localizer.estimate()
+            if self.localizer.is_confident(estimate):
+                break
+            if lib.monotonic() > deadline:
+                if estimate is None:
+                    self.logger.error("No valid pose from ultrasonics")
+                    raise ValueError("No valid pose from ultrasonics")
+                self.logger.warning(
+                    "Pose not confident after {}s, using best guess".format(
+                        timeout))
+                break
+        self.logger.debug("Pose estimate: {}".format(estimate))
+        return estimate
+
     def dumb_localizer(self, dists_from_center):
         """Localize based on range measurement from center of bot,
         assuming square"""
@@ -109,11 +151,15 @@ class Gunner(object):
     def aim(self):
         """Get location, aim turret, accelerate wheels and advance dart."""
 
-        # We need to be up to speed before reading the dart velocity
+        # We need to be up to speed before reading the dart velocity,
+        # localize while the wheels spin up
         self.gun.spin_up()
-        time.sleep(1.0)
+        spin_up_start = lib.monotonic()
 
         x_pos, y_pos, theta = self.localize()
+        spin_up_left = self.spin_up_time - (lib.monotonic() - spin_up_start)
+        if spin_up_left > 0:
+            time.sleep(spin_up_left)
         if not self.validate_pose(x_pos, y_pos, theta):
             self.logger.error("What do I do now?!")
 
@@ -0,0 +1,133 @@
+"""Streaming pose estimation from ultrasonic range frames."""
+
+from collections import namedtuple
+
+import numpy as np
+
+import bot.lib.lib as lib
+
+
+# Pose of the bot, with the covariance of (x, y, theta) and the no. of
+# frames it was computed from
+PoseEstimate = namedtuple(
+    "PoseEstimate", ["x", "y", "theta", "covariance", "samples"])
+
+
+class StreamingLocalizer(object):
+
+    """Estimates pose from a ring buffer of recent ultrasonic frames.
+
+    A single bad echo used to give a bad pose, or abort aiming. Instead,
+    each sensor's readings are compared to their median, and readings
+    more than mad_threshold scaled median absolute deviations (MADs) away
+    are rejected, along with the rest of their frame. The pose of each
+    remaining frame is computed like Gunner.ratio_localizer, all frames
+    at once, and averaged. The spread of the frame poses gives the
+    covariance of the average, so callers can stop sampling once it's
+    small enough.
+
+    """
+
+    sensors = ("front", "back", "left", "right")
+
+    # Scales MAD to a std. dev. estimate, for normally distributed noise
+    mad_to_std = 1.4826
+
+    def __init__(self, x_size):
+        """Build empty buffer and read filter settings from config.
+
+        :param x_size: Width of the course (m), see ratio_localizer.
+        :type x_size: float
+
+        """
+        self.logger = lib.get_logger()
+        loc_config = lib.get_config()["localizer"]
+        self.x_size = x_size
+        self.min_samples = loc_config["min_samples"]
+        self.mad_threshold = loc_config["mad_threshold"]
+        self.min_mad = loc_config["min_mad"]
+        self.max_std = np.array(loc_config["max_std"], dtype=float)
+        self.frames = np.empty((loc_config["buffer_size"], len(self.sensors)))
+        self.reset()
+
+    def reset(self):
+        """Forget all frames, after the bot has moved."""
+        self.next_index = 0
+        self.num_frames = 0
+
+    def add(self, dists):
+        """Add a frame of distances, replacing the oldest if full.
+
+        :param dists: Distance from center of bot (m), by sensor name.
+        :type dists: dict
+
+        """
+        self.frames[self.next_index] = [dists[name] for name in self.sensors]
+        self.next_index = (self.next_index + 1) % len(self.frames)
+        self.num_frames = min(self.num_frames + 1, len(self.frames))
+
+    def inliers(self):
+        """Get the frames with no outlier readings.
+
+        :returns: Array of frames, rows in the order of self.sensors.
+
+        """
+        frames = self.frames[:self.num_frames]
+        deviations = np.abs(frames - np.median(frames, axis=0))
+        mads = np.maximum(np.median(deviations, axis=0) * self.mad_to_std,
+                          self.min_mad)
+        # Right sensor isn't used, so its outliers don't matter
+        good = deviations[:, :3] <= self.mad_threshold * mads[:3]
+        return frames[np.all(good, axis=1)]
+
+    def poses(self, frames):
+        """Get the pose from each frame, like Gunner.ratio_localizer.
+
+        :param frames: Array of frames, rows in the order of self.sensors.
+        :returns: Nx3 array of x, y, theta, without frames where the front
+            and back sensors add up to much less than the course width.
+
+        """
+        front, back, left = frames[:, 0], frames[:, 1], frames[:, 2]
+        ratio = self.x_size / (back + front)
+        valid = ratio <= 1.1
+        ratio = ratio[valid]
+        x_pos = back[valid] * ratio
+        y_pos = left[valid] * ratio
+        # Square to the course when ratio > 1
+        theta = np.degrees(np.arccos(np.minimum(ratio, 1.0)))
+        # since the arc is well devined, assume we're always facing inward
+        theta[x_pos < self.x_size / 2.0] *= -1
+        return np.column_stack((x_pos, y_pos, theta))
+
+    def estimate(self):
+        """Estimate pose from the buffered frames.
+
+        :returns: PoseEstimate, or None if no frame gives a valid pose.
+            Covariance is None if only one frame does.
+
+        """
+        poses = self.poses(self.inliers())
+        if not len(poses):
+            return None
+        x_pos, y_pos, theta = np.mean(poses, axis=0)
+        covariance = None
+        if len(poses) > 1:
+            # Covariance of the mean, not of a single frame
+            covariance = np.cov(poses, rowvar=False) / len(poses)
+        return PoseEstimate(float(x_pos), float(y_pos), float(theta),
+                            covariance, len(poses))
+
+    def is_confident(self, estimate):
+        """Check if an estimate is good enough to aim with.
+
+        :param estimate: Estimate from estimate(), may be None.
+        :type estimate: PoseEstimate
+        :returns: True if enough frames agree closely enough.
+
+        """
+        if estimate is None or estimate.covariance is None or \
+                estimate.samples < self.min_samples:
+            return False
+        stds = np.sqrt(np.diag(estimate.covariance))
+        return bool(np.all(stds <= self.max_std))
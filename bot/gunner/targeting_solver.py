@@ -1,5 +1,8 @@
 import math
 from os import path
+from time import time
+
+import numpy as np
 
 import bot.lib.lib as lib
 
@@ -25,8 +28,22 @@ V = 7.4439  # Initial velocity of dart at launch
 targetHeight = 0.684215  # Height of the center of the target in meters
 targetX = 0.5842  # X-coordinate of the center of the target
 
+maxElevAngle = 90  # Give up searching for a solution past this angle
+
+# Elevation search, see getExactElevationAngle
+searchBatch = 16  # Angles simulated at once per search iteration
+searchTolerance = .001  # Search stops when the angle is known this closely
+rk4DeltaT = .01  # The time step of the RK4 integrator
+
+# Iterations, trajectories simulated and time taken by the last search
+lastSolveStats = {}
+
 logger = lib.get_logger()
 
+# Elevation angles precomputed by buildElevationTable, loaded on first use.
+# False if there's no table to load.
+elevationTable = None
+
 
 def getTargetDistance(Xpos, Ypos):
     """Calculate the horizontal distance to the target,
@@ -111,6 +128,149 @@ def getFiringSolution(Xpos, Ypos, offset, velocity):
     # horizontal distance to target in m
     horizDeflection = getHorizLaunchAngle(Xpos, Ypos)
     # pan angle in degrees
+    elevAngle = lookupElevationAngle(targetDistance, V)
+    if elevAngle is None:
+        # Outside the table, search for it
+        elevAngle = getExactElevationAngle(targetDistance, V)
+    # print "Vertical Angle:", elevAngle
+    # print "Horizontal Angle:", horizDeflection
+    # print "Target distance:",targetDistance
+
+    # calculate servo positions based on desired launch
+    # angle and bot orientation
+    vert_servo_angle = getServoAngle(elevAngle)
+    horiz_servo_angle = horizDeflection - offset
+
+    return vert_servo_angle, horiz_servo_angle
+
+
+def getHeightsAtDistance(V, thetas, targetDistance):
+    """Vectorized getVertLaunchAngle, for an array of elevation angles.
+    Does the exact same arithmetic, so gives the same heights"""
+    thetas = np.radians(np.asarray(thetas, dtype=float))
+    Vx = V * np.cos(thetas)
+    Vz = V * np.sin(thetas)
+    V = np.repeat(float(V), len(Vx))
+    x = np.zeros_like(Vx)
+    z = np.empty_like(Vx)
+    z.fill(z0)
+    DeltaT2 = math.pow(DeltaT, 2)
+    heights = np.empty_like(Vx)
+    active = np.ones(len(Vx), dtype=bool)
+
+    t = 0.000
+    while t <= Tmax:
+        ax = (D / m) * V * Vx
+        az = g + (D / m) * V * Vz
+        Vx = Vx - ax * DeltaT
+        Vz = Vz - az * DeltaT
+        V = np.sqrt(Vx * Vx + Vz * Vz)
+        x = x + Vx * DeltaT + .5 * ax * DeltaT2
+        z = z + Vz * DeltaT + .5 * az * DeltaT2
+
+        # Keep the height of each dart at the step it reached the target
+        arrived = active & (x >= targetDistance)
+        heights[arrived] = z[arrived]
+        active &= ~arrived
+        if not active.any():
+            break
+        t += DeltaT
+    heights[active] = z[active]
+    return heights
+
+
+def getHeightsAtDistanceRK4(V, thetas, targetDistance):
+    """Heights at the target distance for an array of elevation angles,
+    integrated with RK4 at the coarser rk4DeltaT step. The height is
+    interpolated to the exact distance, instead of taken at the first
+    step past it"""
+    thetas = np.radians(np.asarray(thetas, dtype=float))
+    # State rows are x, z, Vx, Vz
+    state = np.vstack((np.zeros_like(thetas), np.empty_like(thetas),
+                       V * np.cos(thetas), V * np.sin(thetas)))
+    state[1].fill(z0)
+    heights = np.empty_like(thetas)
+    active = np.ones(len(thetas), dtype=bool)
+
+    def derivatives(state):
+        x, z, Vx, Vz = state
+        drag = (D / m) * np.sqrt(Vx * Vx + Vz * Vz)
+        return np.vstack((Vx, Vz, -drag * Vx, -g - drag * Vz))
+
+    for step in xrange(int(round(Tmax / rk4DeltaT))):
+        k1 = derivatives(state)
+        k2 = derivatives(state + k1 * (rk4DeltaT / 2))
+        k3 = derivatives(state + k2 * (rk4DeltaT / 2))
+        k4 = derivatives(state + k3 * rk4DeltaT)
+        nextState = state + (k1 + 2 * k2 + 2 * k3 + k4) * (rk4DeltaT / 6)
+
+        arrived = active & (nextState[0] >= targetDistance)
+        if arrived.any():
+            x1, z1 = state[0, arrived], state[1, arrived]
+            x2, z2 = nextState[0, arrived], nextState[1, arrived]
+            heights[arrived] = z1 + (z2 - z1) * \
+                (targetDistance - x1) / (x2 - x1)
+            active &= ~arrived
+            if not active.any():
+                break
+        state = nextState
+    heights[active] = state[1, active]
+    return heights
+
+
+integrators = {"euler": getHeightsAtDistance, "rk4": getHeightsAtDistanceRK4}
+
+
+def getExactElevationAngle(targetDistance, V, integrator="euler"):
+    """Find the lowest elevation angle that reaches the target height.
+
+    Height at the target rises with the angle, so the search brackets
+    the angle between the minimum and maxElevAngle, simulates a batch of
+    searchBatch angles across the bracket at once and narrows it to the
+    pair the target height falls between, until it's searchTolerance
+    wide. This takes 5 batches instead of thousands of single
+    trajectories.
+
+    With the euler integrator, angles are within 0.011 degrees of the
+    original 0.01 degree step search (getLinearElevationAngle). The rk4
+    integrator stays within 0.01 degrees of the true trajectory at a 10x
+    coarser step, where euler is off by up to 0.2 degrees, so the two
+    differ by up to 0.2 degrees. Stats are kept in lastSolveStats.
+    Raises ValueError if there's no solution"""
+    startTime = time()
+    getHeights = integrators[integrator]
+    low = getMinElevationAngle(targetDistance)
+    high = float(maxElevAngle)
+    iterations = 0
+    while True:
+        iterations += 1
+        angles = np.linspace(low, high, searchBatch)
+        reached = getHeights(V, angles, targetDistance) >= targetHeight
+        if not reached.any():
+            raise ValueError("Target out of range")
+        first = int(reached.argmax())
+        if first == 0:
+            # Already reached at the bottom of the bracket
+            elevAngle = low
+            break
+        low, high = angles[first - 1], angles[first]
+        if high - low <= searchTolerance:
+            elevAngle = high
+            break
+
+    lastSolveStats.update(iterations=iterations, integrator=integrator,
+                          trajectories=iterations * searchBatch,
+                          secs=time() - startTime)
+    logger.debug("Elevation {:.3f} found in {} iterations, {:.1f}ms".format(
+        elevAngle, iterations, lastSolveStats["secs"] * 1000))
+    return float(elevAngle)
+
+
+def getLinearElevationAngle(targetDistance, V):
+    """Find the lowest elevation angle that reaches the target height,
+    by simulating trajectories from the minimum angle up, 0.01 degrees
+    at a time. The original search, kept as a reference. Raises
+    ValueError if there's no solution"""
     elevAngle = getMinElevationAngle(targetDistance)
     # lower bounds angle in degrees
     # print "Min Vert Angle: : {0:.3f}".format(elevAngle)
@@ -122,16 +282,81 @@ def getFiringSolution(Xpos, Ypos, offset, velocity):
         if z < targetHeight:
             elevAngle = elevAngle + 0.01
             # print "Elevation Angle ++: : {0:.3f}".format(elevAngle)
-    # print "Vertical Angle:", elevAngle
-    # print "Horizontal Angle:", horizDeflection
-    # print "Target distance:",targetDistance
-
-    # calculate servo positions based on desired launch
-    # angle and bot orientation
-    vert_servo_angle = getServoAngle(elevAngle)
-    horiz_servo_angle = horizDeflection - offset
-
-    return vert_servo_angle, horiz_servo_angle
+            if elevAngle > maxElevAngle:
+                raise ValueError("Target out of range")
+    return elevAngle
+
+
+def buildElevationTable(distances, velocities):
+    """Returns a table of exact elevation angles over a grid, for
+    lookupElevationAngle. Row 0 holds the velocities and column 0 the
+    distances, both evenly spaced, and the rest is the angle for each.
+    Angles with no solution are nan"""
+    table = np.empty((len(distances) + 1, len(velocities) + 1))
+    table[0, 0] = np.nan
+    table[0, 1:] = velocities
+    table[1:, 0] = distances
+    for i, distance in enumerate(distances):
+        for j, V in enumerate(velocities):
+            try:
+                table[i + 1, j + 1] = getExactElevationAngle(distance, V)
+            except ValueError:
+                table[i + 1, j + 1] = np.nan
+    return table
+
+
+def loadElevationTable(fileName=None):
+    """Memory-map the elevation table .npy file, from config if no file
+    is given. Returns False if there's no such file"""
+    global elevationTable
+    if fileName is None:
+        fileName = lib.get_config()["elevation_table"]
+    if not path.exists(fileName):
+        logger.warning(
+            "No elevation table at {}, using exact solver".format(fileName))
+        elevationTable = False
+    else:
+        elevationTable = np.load(fileName, mmap_mode="r")
+    return elevationTable
+
+
+def lookupElevationAngle(targetDistance, V, table=None):
+    """Bilinearly interpolate the elevation angle from the precomputed
+    table. Returns None if distance or velocity is outside the table,
+    or if any of the surrounding angles had no solution. With the default
+    grid, angles are within 0.15 degrees of getExactElevationAngle"""
+    if table is None:
+        table = elevationTable
+        if table is None:
+            table = loadElevationTable()
+        if table is False:
+            return None
+    distances = table[1:, 0]
+    velocities = table[0, 1:]
+
+    # Grids are evenly spaced, so cells can be found without searching
+    i, dFrac = gridCell(distances, targetDistance)
+    j, vFrac = gridCell(velocities, V)
+    if i is None or j is None:
+        return None
+    corners = table[i + 1:i + 3, j + 1:j + 3]
+    if np.isnan(corners).any():
+        return None
+    nearV = corners[0, 0] + (corners[0, 1] - corners[0, 0]) * vFrac
+    farV = corners[1, 0] + (corners[1, 1] - corners[1, 0]) * vFrac
+    return float(nearV + (farV - nearV) * dFrac)
+
+
+def gridCell(grid, value):
+    """Returns the index of the grid cell containing value and how far
+    across it value is (0 to 1), or None, None if it's off the grid"""
+    step = (grid[-1] - grid[0]) / (len(grid) - 1)
+    position = (value - grid[0]) / step
+    if not 0 <= position <= len(grid) - 1:
+        return None, None
+    # The last grid line belongs to the last cell
+    index = min(int(position), len(grid) - 2)
+    return index, position - index
 
 
 def getServoAngle(elevAngle):
@@ -141,6 +366,64 @@ def getServoAngle(elevAngle):
     servoAngle = 5 + elevAngle + 12*math.pow(log, 2.3)
     return servoAngle
 
+
+def benchmark(distances, velocities):
+    """Print solve time and iterations of each elevation search"""
+    for distance in distances:
+        for V in velocities:
+            startTime = time()
+            linear = getLinearElevationAngle(distance, V)
+            print "{:.2f}m {:.2f}m/s: linear {:.3f} in {:.1f}ms".format(
+                distance, V, linear, (time() - startTime) * 1000),
+            for integrator in sorted(integrators):
+                elevAngle = getExactElevationAngle(distance, V, integrator)
+                print "| {} {:.3f} in {:.1f}ms, {} iterations".format(
+                    integrator, elevAngle, lastSolveStats["secs"] * 1000,
+                    lastSolveStats["iterations"]),
+            print
+
+
+def main():
+    """Build the elevation table and save it for getFiringSolution"""
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Precompute elevation angles for getFiringSolution")
+    parser.add_argument(
+        "-d", "--distances", nargs=3, type=float, default=[0.5, 2.0, 31],
+        metavar=("FIRST", "LAST", "NUM"),
+        help="Distance grid in m (default: 0.5 2.0 31)")
+    parser.add_argument(
+        "-v", "--velocities", nargs=3, type=float, default=[4.0, 14.0, 41],
+        metavar=("FIRST", "LAST", "NUM"),
+        help="Dart velocity grid in m/s (default: 4.0 14.0 41)")
+    parser.add_argument(
+        "-o", "--output", default=lib.get_config()["elevation_table"],
+        help="File to save the table to (default: from config)")
+    parser.add_argument(
+        "-b", "--benchmark", action="store_true",
+        help="Time the solvers on the grid corners instead")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark([args.distances[0], args.distances[1]],
+                  [args.velocities[0], args.velocities[1]])
+        return
+
+    distances = np.linspace(args.distances[0], args.distances[1],
+                            int(args.distances[2]))
+    velocities = np.linspace(args.velocities[0], args.velocities[1],
+                             int(args.velocities[2]))
+    print "Solving {} firing solutions...".format(
+        len(distances) * len(velocities))
+    table = buildElevationTable(distances, velocities)
+    np.save(args.output, table)
+    print "Saved table to {}, {} points have no solution".format(
+        args.output, np.isnan(table[1:, 1:]).sum())
+
+
+if __name__ == "__main__":
+    main()
+
 # with open('./tests/targetting_test_input.txt') as f:
 #    for line in f:
 #        coords = line.split(",")
@@ -7,6 +7,7 @@ from i2c_device.i2c_device import I2CDevice
 import bbb.gpio as gpio_mod
 import bbb.pwm as pwm_mod
 import bot.lib.lib as lib
+import bot.simulator.recording as recording
 
 
 class ColorSensor(I2CDevice):
@@ -57,9 +58,11 @@ class ColorSensor(I2CDevice):
             self.logger.debug("Running in test mode")
             # Fake device at address "0x00"
             I2CDevice.__init__(self, 1, 0x00, config='tcs3472_i2c.yaml')
-        
 
 
+        # Record or replay readings, if configured
+        recording.attach(self, "color")
+
         # Gets base values for comparisons to future readings.
         self.get_baseline()
 
@@ -5,6 +5,7 @@ from collections import defaultdict
 import pyDMCC
 
 import bot.lib.lib as lib
+import bot.simulator.world as sim_world
 
 
 class DMCCMotorSet(dict):
@@ -23,6 +24,7 @@ class DMCCMotorSet(dict):
         self.config = lib.get_config()
         self.logger = lib.get_logger()
         self.is_testing = self.config["test_mode"]["DMCC"]
+        world = sim_world.get_world()
 
         # print "Testing: ", self.config["testing"]
         # print pyDMCC.lib._config
@@ -32,7 +34,11 @@ class DMCCMotorSet(dict):
         # approaches:
         #  - global state: shared dmccs dictionary, instantiated once
         #  - selected instantiation: only initialize the dmccs we are control
-        if not self.is_testing:
+        if world is not None:
+            self.logger.debug("Using simulated DMCCs")
+            dmccs = world.build_dmccs(motor_config)
+            self.is_testing = False
+        elif not self.is_testing:
             dmccs = pyDMCC.autodetect()
             self.logger.debug("Found %d physical DMCC boards" % len(dmccs))
         else:
@@ -45,6 +51,7 @@ class DMCCMotorSet(dict):
         self.logger.debug("DMCC Motor conf: {}".format(dmccs))
        
         self.motors = {}
+        self.board_nums = {}
         for name, conf in motor_config.items():
             if 'invert' in conf.keys():
                 invert = conf['invert']
@@ -53,17 +60,72 @@ class DMCCMotorSet(dict):
             try:
                 self.motors[name] = DMCCMotor(
                     dmccs[conf['board_num']], conf['motor_num'], invert)
+                self.board_nums[name] = conf['board_num']
             except KeyError:
                 self.logger.error(
                     "Bad motor definition for motor: '{}'".format(
                         name))
                 raise
 
+        # Write orders for set_batch, keyed by tuple of motor names
+        self.batch_plans = {}
+
         self.logger.debug("Setup {}".format(self))
 
     def __getitem__(self, index):
         return self.motors[index]
 
+    def batch_plan(self, names):
+        """Get the order to write a batch of motors in.
+
+        Motors are grouped by DMCC board, so both motors on a cape are
+        written back to back. Plans are cached per names tuple.
+
+        :param names: Names of the motors in the batch.
+        :type names: tuple
+        :returns: List of (index into names, DMCCMotor), in write order.
+
+        """
+        try:
+            return self.batch_plans[names]
+        except KeyError:
+            pass
+        order = sorted(range(len(names)), key=lambda i: (
+            self.board_nums[names[i]], self.motors[names[i]].motor_num))
+        plan = [(i, self.motors[names[i]]) for i in order]
+        self.batch_plans[names] = plan
+        return plan
+
+    def set_batch(self, names, values, mode="power", force=False):
+        """Set the power or velocity of several motors in one update.
+
+        Writes are grouped per DMCC board, and motors already set to the
+        requested value are skipped.
+
+        :param names: Names of the motors to set.
+        :type names: tuple
+        :param values: Value for each motor, in the same order as names.
+        :type values: tuple
+        :param mode: Either "power" or "velocity".
+        :type mode: string
+        :param force: Write every motor, even those that haven't changed.
+        :type force: boolean
+        :returns: Number of motors written.
+
+        """
+        writes = 0
+        for i, motor in self.batch_plan(names):
+            value = values[i]
+            if not force and motor.last_command == (mode, value):
+                continue
+            if mode == "power":
+                motor.write_power(value)
+            else:
+                motor.velocity = value
+            writes += 1
+        self.logger.debug("Batch set %s of %d motors", mode, writes)
+        return writes
+
     def __str__(self):
         return "{} for motors: {}".format(self.__class__.__name__,
                                           self.motors.keys())
@@ -85,7 +147,9 @@ class DMCCMotor(object):
         self.config = lib.get_config()
         self.logger = lib.get_logger()
 
-        self.is_testing = self.config["test_mode"]["DMCC"]
+        # Simulated motors are driven like real ones
+        self.is_testing = self.config["test_mode"]["DMCC"] and \
+            sim_world.get_world() is None
 
         self.dmcc = dmcc
         self.real_motor = dmcc.motors[motor_num]
@@ -107,6 +171,8 @@ class DMCCMotor(object):
                 = self.real_motor.velocity_pid
 
         self._power = 0  # last set power; DMCC can't read back power (yet!)
+        # Last (mode, value) written through power or velocity, uninverted
+        self.last_command = None
         if self.is_testing:
             self._position = 0  # last set position, only when testing
             self._velocity = 0  # last set velocity, only when testing
@@ -143,16 +209,31 @@ class DMCCMotor(object):
 
         """
         # NB: don't use logging that involves expensive formatting
-        value *= self.inversion_multiplier
         self.logger.debug(
             "Setting motor %d-%d power to %d",
-            self.dmcc.cape_num, self.motor_num, value)
+            self.dmcc.cape_num, self.motor_num,
+            value * self.inversion_multiplier)
+        self.write_power(value)
+
+    def write_power(self, value):
+        """Set the power level of this motor, without logging.
+
+        :param value: Desired motor power [-100,100]
+        :type value: float
+
+        """
+        command = ("power", value)
+        value *= self.inversion_multiplier
 
         # We can't query the power setting, even from a physcial DMCC,
         # so we always have to do our own bookkeeping
         self._power = value
+        # Only cache the command once it's written, so a failed write
+        # isn't skipped by set_batch when it's retried
+        self.last_command = None
         if not self.is_testing:
             self.real_motor.power = value
+        self.last_command = command
 
     @property
     def position(self):
@@ -177,6 +258,8 @@ class DMCCMotor(object):
         :returns: Boolean value indicating success.
 
         """
+        # Position control replaces any power or velocity command
+        self.last_command = None
         value *= self.inversion_multiplier
         if self.is_testing:
             self._position = value
@@ -205,7 +288,7 @@ class DMCCMotor(object):
         :returns: Boolean value indicating success.
 
         """
-
+        command = ("velocity", value)
         value *= self.inversion_multiplier
         self.logger.debug(
             "Setting motor %d-%d velociy to %d",
@@ -217,10 +300,13 @@ class DMCCMotor(object):
                 self.dmcc.cape_num, self.motor_num)
             raise RuntimeError
 
+        # Only cache the command once it's written, see write_power
+        self.last_command = None
         if self.is_testing:
             self._velocity = value
         else:
             self.real_motor.velocity = value
+        self.last_command = command
 
     def setPositionPID(self, P, I, D):
         """Set PID constants to control position."""
@@ -1,16 +1,25 @@
 """Analog IR array abstractions."""
 
+from time import time, sleep
+
 import ir
+import bot.lib.lib as lib
+import bot.simulator.world as sim_world
 
 i2c_available = False
 try:
     import smbus
-    from time import sleep
     i2c_available = True
 except ImportError:
     print "ImportError: smbus module not found; I2C communication disabled"
 
-# TODO: Try using read_i2c_block_data() and write_i2c_block_data() instead?
+# Combined (repeated-start) transfers need i2c_rdwr, which only smbus2 has
+i2c_rdwr_available = False
+try:
+    import smbus2
+    i2c_rdwr_available = True
+except ImportError:
+    pass
 
 
 def swap_bytes_uint16(value):
@@ -18,6 +27,167 @@ def swap_bytes_uint16(value):
     return ((value & 0x00ff) << 8) | ((value & 0xff00) >> 8)
 
 
+def build_backend(adc_config):
+    """Build the I2C backend used to talk to the IR ADCs.
+
+    Uses the simulated world's IR arrays when the simulator is enabled,
+    else the real I2C bus when smbus is available, else a simulated one.
+
+    :param adc_config: The ir_analog_adc_config section of the config.
+    :type adc_config: dict
+    :returns: SMBusBackend or SimulatedBackend object.
+
+    """
+    scan_mode = adc_config.get("scan_mode", "byte")
+    world = sim_world.get_world()
+    if world is not None:
+        return SimulatedBackend(scan_mode, world.i2c_latency, world)
+    if i2c_available:
+        return SMBusBackend(adc_config["i2c_bus"], scan_mode)
+    return SimulatedBackend(
+        scan_mode, adc_config.get("sim_transaction_latency", 0.0))
+
+
+class SMBusBackend(object):
+
+    """Talks to the IR ADCs over a real I2C bus.
+
+    All the usual smbus calls are passed straight through to the bus.
+    On top of that, read_channels reads every channel of an ADC using
+    one of three scan modes:
+
+    * byte: one read_byte_data per channel (one transaction each).
+    * rdwr: every command/read pair packed into a single combined
+      I2C_RDWR transfer, using repeated starts. Needs smbus2.
+    * block: one read_i2c_block_data. Only valid for ADCs that support
+      auto-increment or a scan mode, as the ADS7830 does not.
+
+    """
+
+    scan_modes = ("byte", "rdwr", "block")
+
+    def __init__(self, bus_num, scan_mode="byte"):
+        """Open the I2C bus.
+
+        :param bus_num: System I2C bus to use.
+        :type bus_num: int
+        :param scan_mode: How to read all channels, one of scan_modes.
+        :type scan_mode: string
+        :raises ValueError: If scan_mode isn't one of scan_modes.
+
+        """
+        self.logger = lib.get_logger()
+        if scan_mode not in self.scan_modes:
+            raise ValueError("Unknown IR scan mode: {}".format(scan_mode))
+        if scan_mode == "rdwr" and not i2c_rdwr_available:
+            self.logger.warning("smbus2 not found, IR scan falling back "
+                                "from rdwr to byte mode")
+            scan_mode = "byte"
+        self.scan_mode = scan_mode
+        if scan_mode == "rdwr":
+            self.bus = smbus2.SMBus(bus_num)
+        else:
+            self.bus = smbus.SMBus(bus_num)
+
+    def __getattr__(self, name):
+        """Pass any other smbus call through to the bus."""
+        return getattr(self.bus, name)
+
+    def read_channels(self, addr, cmds):
+        """Read one byte for each of the given ADC command bytes.
+
+        Note that this is on Follower's critical path. Keep it fast.
+
+        :param addr: I2C address of the ADC.
+        :type addr: int
+        :param cmds: Command bytes that select each channel.
+        :type cmds: list
+        :returns: Tuple of channel readings and no. of I2C transactions.
+
+        """
+        if self.scan_mode == "rdwr":
+            msgs = []
+            reads = []
+            for cmd in cmds:
+                read = smbus2.i2c_msg.read(addr, 1)
+                msgs.append(smbus2.i2c_msg.write(addr, [cmd]))
+                msgs.append(read)
+                reads.append(read)
+            self.bus.i2c_rdwr(*msgs)
+            return [list(read)[0] for read in reads], 1
+        elif self.scan_mode == "block":
+            return self.bus.read_i2c_block_data(addr, cmds[0], len(cmds)), 1
+        return [self.bus.read_byte_data(addr, cmd) for cmd in cmds], len(cmds)
+
+
+class SimulatedBackend(object):
+
+    """Stands in for the I2C bus when smbus isn't available.
+
+    Channel values are served from self.values, keyed by (addr, cmd), so
+    tests and simulators can set what each array sees. Unset channels
+    read as 0. Each emulated transaction sleeps for latency seconds,
+    which mimics bus time so scan modes can be compared off the bone.
+
+    Given a SimWorld, the channels of an ADC are set from what its array
+    sees in the world each time they're read.
+
+    """
+
+    def __init__(self, scan_mode="byte", latency=0.0, world=None):
+        """Build empty set of simulated channel values.
+
+        :param scan_mode: Scan mode to emulate, see SMBusBackend.
+        :type scan_mode: string
+        :param latency: Simulated duration of one I2C transaction (secs).
+        :type latency: float
+        :param world: World to read channel values from, if any.
+        :type world: bot.simulator.world.SimWorld
+
+        """
+        self.scan_mode = scan_mode
+        self.latency = latency
+        self.world = world
+        self.values = {}
+
+    def transaction(self):
+        """Account for the time taken by one I2C transaction."""
+        if self.latency:
+            sleep(self.latency)
+
+    def read_byte_data(self, addr, cmd):
+        self.transaction()
+        if self.world is not None:
+            self.values.update(self.world.ir_values(addr))
+        return self.values.get((addr, cmd), 0)
+
+    def read_byte(self, addr):
+        self.transaction()
+        return 0
+
+    def read_word_data(self, addr, register):
+        self.transaction()
+        return 0
+
+    def write_byte_data(self, addr, register, value):
+        self.transaction()
+
+    def write_byte(self, addr, value):
+        self.transaction()
+
+    def write_word_data(self, addr, register, value):
+        self.transaction()
+
+    def read_channels(self, addr, cmds):
+        """Emulate reading all channels, see SMBusBackend.read_channels."""
+        if self.scan_mode == "byte":
+            return [self.read_byte_data(addr, cmd) for cmd in cmds], len(cmds)
+        self.transaction()
+        if self.world is not None:
+            self.values.update(self.world.ir_values(addr))
+        return [self.values.get((addr, cmd), 0) for cmd in cmds], 1
+
+
 class IRAnalog(ir.IRArray):
     """Abstraction for analog IR arrays.
 
@@ -28,7 +198,7 @@ class IRAnalog(ir.IRArray):
 
     """
 
-    def __init__(self, name, read_gpio_pin):
+    def __init__(self, name, read_gpio_pin, backend=None):
         """Setup required pins and get logger/config.
 
         Note that the value read on the read_gpio_pin will depend on
@@ -44,6 +214,8 @@ class IRAnalog(ir.IRArray):
         :type name: string
         :param read_gpio_pin: Pin used by array to read an IR unit.
         :type input_adc_pin: int
+        :param backend: I2C backend shared by arrays, built if not given.
+        :type backend: SMBusBackend or SimulatedBackend
 
         """
         super(IRAnalog, self).__init__(name, read_gpio_pin)
@@ -54,10 +226,17 @@ class IRAnalog(ir.IRArray):
         # ADC configuration over I2C
         adc_config = self.config['ir_analog_adc_config']
         self.i2c_addr = adc_config['i2c_addr'][name]
-        if i2c_available:
-            # Open I2C bus
-            self.bus = smbus.SMBus(adc_config['i2c_bus'])
 
+        # Open I2C bus (or simulate it)
+        if backend is None:
+            backend = build_backend(adc_config)
+        self.bus = backend
+
+        # Stats for the most recent read_block call
+        self.scan_transactions = 0
+        self.scan_usecs = 0.0
+
+        if i2c_available:
             # Configure ADC using I2C commands
             for reg_name, reg in adc_config['i2c_registers'].iteritems():
                 if 'init' in reg and reg['init'] is not None:
@@ -82,6 +261,26 @@ class IRAnalog(ir.IRArray):
         #self.write_adc_byte(value)
         return self.bus.read_byte_data(self.i2c_addr,value)     #self.read_adc_byte()
 
+    def read_block(self, cmds):
+        """Read every given channel of this array's ADC in one scan.
+
+        How many I2C transactions this takes depends on the backend's scan
+        mode. The count and duration of the scan are kept in
+        scan_transactions and scan_usecs.
+
+        Note that this is on Follower's critical path. Keep it fast.
+
+        :param cmds: Command bytes that select each channel, in order.
+        :type cmds: list
+        :returns: List of readings (0-255), in the same order as cmds.
+
+        """
+        start_time = time()
+        readings, self.scan_transactions = self.bus.read_channels(
+            self.i2c_addr, cmds)
+        self.scan_usecs = (time() - start_time) * 1e6
+        return readings
+
     def set_adc_word(self, register, word_value):
         # TODO: Check if we need to use swap_bytes_uint16()
         self.bus.write_word_data(self.i2c_addr, register, word_value)
@@ -1,14 +1,116 @@
 """Abstraction of all line-following arrays as one unit."""
 
+import threading
+from collections import namedtuple
 from time import time, sleep
 from pprint import pprint
 
+import numpy as np
+
 import bbb.gpio as gpio_mod
 
 import bot.lib.lib as lib
+from bot.lib.latest import Latest
+import bot.simulator.recording as recording
 from . import ir_analog as ir_analog_mod
 
 
+# Immutable, timestamped IR frame published by IRSampler.
+# readings maps array name to a tuple of unit values and is never mutated.
+IRSnapshot = namedtuple("IRSnapshot", ["seq", "time", "readings"])
+
+
+class IRSampler(threading.Thread):
+
+    """Scan all IR arrays at a fixed rate on a dedicated thread.
+
+    Each scan is published as a new IRSnapshot, through a lib.latest.Latest.
+    Readers get the latest frame in O(1) without locks and without
+    touching the I2C bus. Since frames are never modified after
+    publishing, a reader can keep using the frame it holds while the
+    sampler fills the next one. This gives the same guarantees as a
+    triple buffer.
+
+    Readers that need a frame newer than one they've already seen can
+    block on wait_for_snapshot.
+
+    A scan that fails with an I2C error is logged and counted, and the
+    sampler carries on with the next period. No snapshot is published for
+    it, so readers can tell from the snapshot's age that scans are failing.
+
+    """
+
+    def __init__(self, ir_hub, rate):
+        """Build sampler thread. Call start() to begin sampling.
+
+        :param ir_hub: IRHub to scan.
+        :type ir_hub: IRHub
+        :param rate: Sampling rate (Hz).
+        :type rate: float
+
+        """
+        threading.Thread.__init__(self)
+        # Don't block the process from exiting
+        self.daemon = True
+
+        self.logger = lib.get_logger()
+        self.ir_hub = ir_hub
+        self.period = 1.0 / rate
+        self.frames = Latest()
+        self.overruns = 0
+        self.errors = 0
+        self.stop_event = threading.Event()
+
+    @property
+    def snapshot(self):
+        """Latest IRSnapshot, None before the first scan."""
+        return self.frames.snapshot
+
+    def run(self):
+        """Entry point for thread, scans until stop() is called."""
+        self.logger.info("IR sampler running every {}s".format(self.period))
+        seq = 0
+        next_time = lib.monotonic()
+        while not self.stop_event.is_set():
+            try:
+                readings = self.ir_hub.scan()
+            except IOError as e:
+                self.errors += 1
+                self.logger.error("IR scan failed: {}".format(e))
+            else:
+                seq += 1
+                self.frames.publish(IRSnapshot(
+                    seq, self.ir_hub.last_read_time,
+                    dict((name, tuple(reading))
+                         for name, reading in readings.iteritems())))
+
+            # Sleep till next period, skipping periods we're already late for
+            next_time += self.period
+            delay = next_time - lib.monotonic()
+            if delay > 0:
+                self.stop_event.wait(delay)
+            else:
+                self.overruns += 1
+                next_time = lib.monotonic()
+        self.logger.info("IR sampler stopped")
+
+    def wait_for_snapshot(self, after_seq=0, timeout=None):
+        """Wait for a snapshot newer than the given sequence number.
+
+        :param after_seq: Sequence number of last snapshot seen by caller.
+        :type after_seq: int
+        :param timeout: Max time to wait (secs), None to wait forever.
+        :type timeout: float
+        :returns: Newer IRSnapshot, or None if timeout expired first.
+
+        """
+        return self.frames.wait(after_seq, timeout)
+
+    def stop(self):
+        """Ask the sampler thread to exit after its current scan."""
+        self.stop_event.set()
+
+
 class IRHub(object):
 
     """Class for abstracting all IR arrays and working with them as a unit.
@@ -36,8 +138,16 @@ class IRHub(object):
 
     num_ir_units = 8  # Number of IR sensors on an array
 
-    def __init__(self):
-        """Build IR array abstraction objects."""
+    # Order of arrays (rows) in frames given by read_frame
+    frame_order = ("front", "back", "left", "right")
+
+    def __init__(self, backend=None):
+        """Build IR array abstraction objects.
+
+        :param backend: I2C backend for the ADCs, built from config if None.
+        :type backend: ir_analog.SMBusBackend or ir_analog.SimulatedBackend
+
+        """
         # Load config and logger
         self.logger = lib.get_logger()
         self.config = lib.get_config()
@@ -52,6 +162,16 @@ class IRHub(object):
         self._thresh = self.config["ir_thresh"]
 
         self.reg  = self.config["ir_analog_adc_config"]["i2c_registers"]
+
+        # Command bytes for every channel, in channel order, for block reads
+        self.channel_cmds = [self.reg[ch]["cmd"] for ch in sorted(self.reg)]
+
+        # All arrays share one I2C bus
+        if backend is None:
+            backend = ir_analog_mod.build_backend(
+                self.config["ir_analog_adc_config"])
+        self.backend = backend
+
         # NOTE: IR unit select lines are common
         ir_analog_input_gpios = self.config["ir_analog_input_gpios"]
         # Create IR array objects
@@ -59,7 +179,8 @@ class IRHub(object):
         self.arrays = {}
         for name, gpio in ir_analog_input_gpios.iteritems():
             try:
-                self.arrays[name] = ir_analog_mod.IRAnalog(name, gpio)
+                self.arrays[name] = ir_analog_mod.IRAnalog(
+                    name, gpio, self.backend)
             except IOError:
                 self.logger.error("Unable to create {} IR array".format(name))
                 self.arrays[name] = None
@@ -69,8 +190,20 @@ class IRHub(object):
         for array_name in self.config["ir_analog_adc_config"]["i2c_addr"]:
             self.reading[array_name] = [0] * 8
 
+        # lib.monotonic() time of the last scan
         self.last_read_time = None
 
+        # Cost of the most recent read_all scan
+        self.scan_stats = {"transactions": 0, "usecs": 0.0}
+
+        # Background sampler, only running once start_sampler is called
+        self.sampler = None
+        self.sample_rate = self.config["ir_sample_rate"]
+        self.max_age = self.config["ir_max_age"]
+
+        # Record or replay scans, if configured
+        recording.attach(self, "ir")
+
     def __str__(self):
         """Returns human-readable representation of IRHub.
 
@@ -139,21 +272,149 @@ class IRHub(object):
     def read_all(self):
         """Poll IR sensor units and return sensed information.
 
+        If the background sampler is running, the latest snapshot is
+        returned instead and the I2C bus isn't touched. The lists are
+        copies, so callers are free to modify them.
+
         Note: Caller should make a copy if a read_all_units() is executed
         while previous values are being used.
 
         Note that this is on Follower's critical path. Keep it fast.
 
         :returns: Readings from all IR sensor units managed by this object.
+        :raises: IOError if the sampler's frames are older than max_age.
 
         """
-        
+        if self.sampler is None:
+            return self.scan()
+        snapshot = self.get_snapshot()
+        return dict((name, list(reading))
+                    for name, reading in snapshot.readings.iteritems())
+
+    def scan(self):
+        """Read every IR unit of every array over the I2C bus.
+
+        Each array is read with a single block scan of its ADC (see
+        IRAnalog.read_block), instead of one transaction per channel. The
+        cost of the scan is kept in scan_stats.
+
+        Note that this is on Follower's critical path. Keep it fast.
+
+        :returns: Readings from all IR sensor units managed by this object.
+
+        """
+        start_time = lib.monotonic()
+        transactions = 0
+
         # Read every channel of every adc.
-        for arr in self.config["ir_analog_adc_config"]["i2c_addr"]:
-            self.reading[arr] = self.read_array(arr)
+        for name in self.config["ir_analog_adc_config"]["i2c_addr"]:
+            array = self.arrays.get(name)
+            if array is None:
+                # Array couldn't be built, keep last reading
+                continue
+            self.reading[name] = array.read_block(self.channel_cmds)
+            transactions += array.scan_transactions
+
+        self.last_read_time = lib.monotonic()
+        self.scan_stats = {
+            "transactions": transactions,
+            "usecs": (self.last_read_time - start_time) * 1e6}
 
         # self.logger.debug(self.reading)
         return self.reading
+
+    def get_snapshot(self):
+        """Get the latest IR frame.
+
+        Comes from the background sampler when it's running, else a scan
+        is done right now. A sampled frame older than max_age means scans
+        are failing or the sampler fell behind. In that case, waits up to
+        max_age for a new frame.
+
+        :returns: IRSnapshot of the latest readings.
+        :raises: IOError if the sampler has no frame newer than max_age.
+
+        """
+        sampler = self.sampler
+        if sampler is not None:
+            snapshot = sampler.snapshot
+            if snapshot is None or \
+                    lib.monotonic() - snapshot.time > self.max_age:
+                after_seq = snapshot.seq if snapshot is not None else 0
+                snapshot = sampler.wait_for_snapshot(after_seq, self.max_age)
+                if snapshot is None:
+                    self.logger.error("No IR frame for {}s".format(
+                        self.max_age))
+                    raise IOError("IR frames are stale")
+            return snapshot
+        readings = self.scan()
+        return IRSnapshot(None, self.last_read_time,
+                          dict((name, tuple(reading))
+                               for name, reading in readings.iteritems()))
+
+    @lib.api_call
+    def start_sampler(self, rate=None):
+        """Start scanning the IR arrays continuously on a background thread.
+
+        Once started, read_all and get_snapshot serve the latest frame
+        from the sampler, so the follower, the PubServer and any other
+        reader share one acquisition stream.
+
+        :param rate: Sampling rate (Hz), defaults to ir_sample_rate config.
+        :type rate: float
+        :returns: Description of sampler state.
+
+        """
+        if self.sampler is not None:
+            return "IR sampler is already running"
+        if rate is None:
+            rate = self.sample_rate
+        self.sampler = IRSampler(self, rate)
+        self.sampler.start()
+        return "Started IR sampler at {}Hz".format(rate)
+
+    @lib.api_call
+    def stop_sampler(self):
+        """Stop background IR sampling, go back to reading on demand.
+
+        :returns: Description of sampler state.
+
+        """
+        if self.sampler is None:
+            return "IR sampler is not running"
+        sampler = self.sampler
+        self.sampler = None
+        sampler.stop()
+        sampler.join()
+        return "Stopped IR sampler, overruns: {}".format(sampler.overruns)
+
+    @lib.api_call
+    def get_sampler_stats(self):
+        """Get state of the background IR sampler.
+
+        :returns: Dict with running flag, latest seq/time, overruns and
+            failed scans.
+
+        """
+        sampler = self.sampler
+        if sampler is None:
+            return {"running": False}
+        snapshot = sampler.snapshot
+        return {"running": True,
+                "period": sampler.period,
+                "seq": snapshot.seq if snapshot is not None else 0,
+                "time": snapshot.time if snapshot is not None else None,
+                "overruns": sampler.overruns,
+                "errors": sampler.errors}
+
+    @lib.api_call
+    def get_scan_stats(self):
+        """Get the cost of the most recent read_all scan.
+
+        :returns: Dict with no. of I2C transactions and duration (usecs).
+
+        """
+        return self.scan_stats
         
     @lib.api_call
     def read_all_loop(self):
@@ -197,6 +458,21 @@ class IRHub(object):
 
     thresh = property(get_thresh, set_thresh)
 
+    def read_frame(self):
+        """Get the latest readings as one 4x8 block.
+
+        Rows are arrays, in frame_order. Columns are IR units. This lets
+        consumers work on all IR units at once with NumPy.
+
+        Note that this is on Follower's critical path. Keep it fast.
+
+        :returns: uint8 NumPy array of readings (0-255).
+
+        """
+        readings = self.get_snapshot().readings
+        return np.array([readings[name] for name in self.frame_order],
+                        dtype=np.uint8)
+
     @lib.api_call
     def read_binary(self, white_on_black=True):
         """Convert 0-255 values to binary.
@@ -205,21 +481,30 @@ class IRHub(object):
 
         Note that this is on Follower's critical path. Keep it fast.
 
-        TODO: Make faster with numpy?
-
         :param white_on_black: Sets background color and line color.
         :type white_on_black: boolean
         :returns: IR readings, converted to white/black binary.
 
         """
-        readings = self.read_all()
-        for name, reading in readings.iteritems():
-            for i in range(len(reading)):
-                if white_on_black:
-                    readings[name][i] = 0 if reading[i] > self._thresh else 1
-                else:
-                    readings[name][i] = 0 if reading[i] < self._thresh else 1
-        return readings
+        binary = self.read_binary_frame(white_on_black).tolist()
+        return dict(zip(self.frame_order, binary))
+
+    def read_binary_frame(self, white_on_black=True):
+        """Convert 0-255 values to binary, as one 4x8 block.
+
+        Same as read_binary, but gives a frame like read_frame.
+
+        :param white_on_black: Sets background color and line color.
+        :type white_on_black: boolean
+        :returns: uint8 NumPy array of IR readings, 1 for line and 0 not.
+
+        """
+        frame = self.read_frame()
+        if white_on_black:
+            binary = frame <= self._thresh
+        else:
+            binary = frame >= self._thresh
+        return binary.astype(np.uint8)
 
     @lib.api_call
     def read_cached(self, max_staleness=1):
@@ -227,14 +512,15 @@ class IRHub(object):
 
         :param max_staleness: Return cache if it's fresher than this (secs).
         :type max_staleness: float
-        :returns: Dict with IR data, read time and flag if read was required.
+        :returns: Dict with IR data, read time (lib.monotonic()) and flag
+            if read was required.
 
         """
         if self.last_read_time is None:
             # Handles when read_all hasn't been called
             self.read_all()
             fresh = True
-        elif time() - self.last_read_time <= max_staleness:
+        elif lib.monotonic() - self.last_read_time <= max_staleness:
             fresh = False
         else:
             self.read_all()
@@ -3,8 +3,15 @@
 import sys
 import mmap
 import struct
+import threading
+from collections import namedtuple
+
+import numpy as np
 
 import bot.lib.lib as lib
+from bot.lib.latest import Latest
+import bot.simulator.recording as recording
+import bot.simulator.world as sim_world
 try:
     import pypruss
 except ImportError:
@@ -39,10 +46,113 @@ except ImportError:
     # sys.modules['pypruss'] = pypruss
 
 
+# Immutable frame of pulse times published by PRUWaiter. times maps sensor
+# name to pulse time (usecs), time is lib.monotonic() at the interrupt.
+UltrasonicSnapshot = namedtuple("UltrasonicSnapshot", ["seq", "time", "times"])
+
+
+class PRUWaiter(threading.Thread):
+
+    """Wait for PRU interrupts on a dedicated thread, publishing each frame.
+
+    The PRU fires the sensors one after another, writing each pulse time to
+    its shared memory, then raises an interrupt once all four are written.
+    Copying the times right after the interrupt gives a consistent frame,
+    before the PRU starts overwriting them with the next cycle.
+
+    The PRU also raises a duplicate interrupt for each frame. Interrupts
+    that come sooner than duplicate_interval after the previous one are
+    counted and dropped, instead of being published as a new frame. The
+    time between frames is tracked, so callers can see the PRU's cadence
+    and tell when it has stalled.
+
+    Frames are published through a lib.latest.Latest, so readers get the
+    latest frame in O(1) without locks or waiting for an interrupt.
+
+    """
+
+    # Weight of the newest interval in the smoothed frame period
+    period_weight = 0.2
+
+    def __init__(self, ultrasonic, duplicate_interval):
+        """Build waiter thread. Call start() to begin waiting.
+
+        :param ultrasonic: Ultrasonic to read frames from.
+        :type ultrasonic: Ultrasonic
+        :param duplicate_interval: Interrupts closer than this (secs) to
+            the previous one are duplicates.
+        :type duplicate_interval: float
+
+        """
+        threading.Thread.__init__(self, name="PRUWaiter")
+        # Don't block the process from exiting
+        self.daemon = True
+
+        self.logger = lib.get_logger()
+        self.ultrasonic = ultrasonic
+        self.duplicate_interval = duplicate_interval
+        self.frames = Latest()
+        self.period = None
+        self.max_period = 0.0
+        self.duplicates = 0
+        self.stop_event = threading.Event()
+
+    @property
+    def snapshot(self):
+        """Latest UltrasonicSnapshot, None before the first frame."""
+        return self.frames.snapshot
+
+    def run(self):
+        """Entry point for thread, waits for frames until stop() is called."""
+        self.logger.info("PRU waiter running")
+        seq = 0
+        last_time = None
+        while not self.stop_event.is_set():
+            self.ultrasonic.wait_for_interrupt()
+            now = lib.monotonic()
+            if last_time is not None:
+                interval = now - last_time
+                if interval < self.duplicate_interval:
+                    self.duplicates += 1
+                    continue
+                if self.period is None:
+                    self.period = interval
+                else:
+                    self.period += \
+                        self.period_weight * (interval - self.period)
+                self.max_period = max(self.max_period, interval)
+            last_time = now
+
+            seq += 1
+            self.frames.publish(UltrasonicSnapshot(
+                seq, now, self.ultrasonic.read_mem()))
+        self.logger.info("PRU waiter stopped")
+
+    def wait_for_snapshot(self, after_seq=0, timeout=None):
+        """Wait for a snapshot newer than the given sequence number.
+
+        :param after_seq: Sequence number of last snapshot seen by caller.
+        :type after_seq: int
+        :param timeout: Max time to wait (secs), None to wait forever.
+        :type timeout: float
+        :returns: Newer UltrasonicSnapshot, or None if timeout expired first.
+
+        """
+        return self.frames.wait(after_seq, timeout)
+
+    def stop(self):
+        """Ask the waiter thread to exit after the next interrupt."""
+        self.stop_event.set()
+
+
 class Ultrasonic(dict):
 
     """Class for abstracting all ultrasonics, working with them as a unit."""
 
+    # Approx. pulse time (usecs) per unit of distance
+    usecs_per_meter = 5877.0
+    usecs_per_inch = 149.3
+
     def __init__(self):
         """Build ultrasonic abstraction objects and logger."""
 
@@ -58,78 +168,268 @@ class Ultrasonic(dict):
 
         us_config = self.config['ultrasonics']
 
-        try:
-            with open("/dev/mem", "r+b") as f:
-                # TODO: replace 32 with len(sensors) * 4 * 2 ?
-                self.pru_mem = mmap.mmap(f.fileno(), 32, offset=PRU_ADDR)
-        except IOError as e:
-            self.logger.warning("Could not open /dev/mem: {}".format(e))
-            self.pru_mem = struct.pack('IIIIIIII', 1, 2, 3, 4, 5, 6, 7, 8)
+        world = sim_world.get_world()
+        if world is not None:
+            # PRU firing at the walls of the simulated course
+            self.pru = world.pru
+            self.pru_mem = self.pru.mem
+        else:
+            self.pru = pypruss
+            try:
+                with open("/dev/mem", "r+b") as f:
+                    # TODO: replace 32 with len(sensors) * 4 * 2 ?
+                    self.pru_mem = mmap.mmap(f.fileno(), 32, offset=PRU_ADDR)
+            except IOError as e:
+                self.logger.warning("Could not open /dev/mem: {}".format(e))
+                self.pru_mem = struct.pack(
+                    'IIIIIIII', 1, 2, 3, 4, 5, 6, 7, 8)
 
         # Initialize the PRU driver (not sure what this does?)
-        pypruss.init()
+        self.pru.init()
         try:
-            pypruss.open(self.PRU_EVOUT_0)
+            self.pru.open(self.PRU_EVOUT_0)
         except SystemError as e:
             self.logger.error("Could not open PRU: {}".format(e))
             self.logger.error("Is the PRU module (uio_pruss) loaded?")
 
-        pypruss.pruintc_init()  # Init the interrupt controller
+        self.pru.pruintc_init()  # Init the interrupt controller
         self.logger.debug("Loading PRU program: {}".format(
             us_config['pru_file']))
-        pypruss.exec_program(us_config['pru_num'], us_config['pru_file'])
+        self.pru.exec_program(us_config['pru_num'], us_config['pru_file'])
         self.sensors = us_config['sensors']
 
+        # Sensor geometry, in the order sensors are laid out in PRU memory.
+        # Readings are converted for all sensors at once with these.
+        self.sensor_names = sorted(
+            self.sensors, key=lambda name: self.sensors[name]['offset'])
+        self.sensor_offsets = [
+            self.sensors[name]['offset'] for name in self.sensor_names]
+        self.origins = np.array(
+            [self.sensors[name]['xy'] for name in self.sensor_names],
+            dtype=float)
+        self.directions = np.array(
+            [self.sensors[name]['dir'] for name in self.sensor_names],
+            dtype=float)
+        # Distance from center of bot to each sensor, along its direction
+        self.center_offsets = np.sum(self.origins * self.directions, axis=1)
+
+        # Background interrupt waiter, only running once start_waiter is
+        # called. Until then, every read waits for the PRU.
+        self.waiter = None
+        self.max_age = us_config['max_age']
+        self.duplicate_interval = us_config['duplicate_interval']
+
+        # Record or replay frames, if configured
+        recording.attach(self, "ultrasonic")
+
     @lib.api_call
     def read_dists(self):
         """Convert the distance from the sensor to distance from center """
-        meters = self.read_meters()
-        dists = {}
-        for sensor in meters:
-            dists[sensor] = meters[sensor] \
-                + self.sensors[sensor]['xy'][0] \
-                * self.sensors[sensor]['dir'][0] \
-                + self.sensors[sensor]['xy'][1] \
-                * self.sensors[sensor]['dir'][1]
+        dists = self.read_all_units()["dists"]
         self.logger.debug("Dists: {}".format(dists))
         return dists
 
     @lib.api_call
     def read_meters(self):
-        times = self.read_times()
-        # approx 5877 microseconds per meter
-        meters = {sensor: times[sensor]/5877.0 for sensor, t in times.items()}
+        meters = self.read_all_units()["meters"]
         self.logger.debug("Meters: {}".format(meters))
         return meters
 
     @lib.api_call
     def read_inches(self):
-        times = self.read_times()
-        # approx 149.3 microseconds per inch
-        inches = {sensor: times[sensor]/149.3 for sensor, t in times.items()}
+        inches = self.read_all_units()["inches"]
         self.logger.debug("Inches: {}".format(inches))
         return inches
 
+    @lib.api_call
+    def read_all_units(self, after_seq=None):
+        """Get one frame of readings, in every unit.
+
+        All units come from a single acquisition, so callers that need
+        more than one don't wait for the PRU again, or get a mix of frames.
+
+        :param after_seq: If the waiter is running, wait for a frame newer
+            than this seq, so consecutive callers get distinct frames.
+            None for the latest frame. Ignored if it isn't running.
+        :type after_seq: int
+        :returns: Dict with seq and time of the frame (seq is None without
+            the waiter) and dicts by sensor name of pulse times (usecs),
+            meters, inches and distance from center of bot (meters).
+        :raises: IOError if the waiter's frames are too old.
+
+        """
+        if self.waiter is None:
+            snapshot = UltrasonicSnapshot(
+                None, lib.monotonic(), self.read_times())
+        elif after_seq is None or \
+                (self.waiter.snapshot is not None and
+                 self.waiter.snapshot.seq > after_seq):
+            snapshot = self.get_snapshot()
+        else:
+            snapshot = self.wait_for_snapshot(after_seq)
+            if snapshot is None:
+                raise IOError("No new ultrasonic frame in {}s".format(
+                    self.max_age))
+        return self.convert_times(snapshot)
+
+    def convert_times(self, snapshot):
+        """Convert a frame of pulse times to all units, for all sensors.
+
+        :param snapshot: Frame to convert.
+        :type snapshot: UltrasonicSnapshot
+        :returns: Dict of units, see read_all_units.
+
+        """
+        times = np.array([snapshot.times[name] for name in self.sensor_names],
+                         dtype=float)
+        meters = times / self.usecs_per_meter
+        inches = times / self.usecs_per_inch
+        dists = meters + self.center_offsets
+        names = self.sensor_names
+        return {"seq": snapshot.seq,
+                "time": snapshot.time,
+                "times": dict(snapshot.times),
+                "meters": dict(zip(names, meters.tolist())),
+                "inches": dict(zip(names, inches.tolist())),
+                "dists": dict(zip(names, dists.tolist()))}
+
     def read_times(self):
         """Get readings from all ultrasonic sensors, as a pulse time.
 
+        If the background waiter is running, the times of the latest frame
+        are returned without waiting, see get_snapshot. Consecutive calls
+        may then get the same frame, use wait_for_snapshot to get distinct
+        ones. Otherwise, this waits for the PRU to finish a frame.
+
         :returns: Readings from all ultrasonic sensors
+        :raises: IOError if the waiter's frames are too old.
 
         """
-        self.logger.debug("Waiting for PRU interrupt")
-        pypruss.wait_for_event(self.PRU_EVOUT_0)
-        self.logger.debug("Received PRU interrupt")
-        pypruss.clear_event(self.PRU_EVOUT_0, self.PRU0_ARM_INTERRUPT)
-        times = {}
-        inches = {}
-        for i in self.sensors:
-            times[i] = struct.unpack_from(
-                'I', self.pru_mem, self.sensors[i]['offset'])[0]
-            self.logger.debug("Sensor: %s = %d", i, times[i])
+        if self.waiter is not None:
+            return dict(self.get_snapshot().times)
+
+        self.wait_for_interrupt()
+        times = self.read_mem()
 
         self.logger.debug("Waiting for duplicate PRU interrupt")
-        pypruss.wait_for_event(self.PRU_EVOUT_0)
-        self.logger.debug("Received (expected) duplicated PRU interrupt")
-        pypruss.clear_event(self.PRU_EVOUT_0, self.PRU0_ARM_INTERRUPT)
+        self.wait_for_interrupt()
         self.logger.debug("Times: {}".format(times))
         return times
+
+    def wait_for_interrupt(self):
+        """Block until the PRU raises its interrupt, then clear it."""
+        self.logger.debug("Waiting for PRU interrupt")
+        self.pru.wait_for_event(self.PRU_EVOUT_0)
+        self.logger.debug("Received PRU interrupt")
+        self.pru.clear_event(self.PRU_EVOUT_0, self.PRU0_ARM_INTERRUPT)
+
+    def read_mem(self):
+        """Read the pulse times the PRU last wrote to its shared memory.
+
+        Only consistent right after an interrupt, later reads may mix
+        sensors from two frames.
+
+        :returns: Pulse time (usecs) of each sensor, by name.
+
+        """
+        pru_mem = self.pru_mem
+        return dict((name, struct.unpack_from('I', pru_mem, offset)[0])
+                    for name, offset in zip(self.sensor_names,
+                                            self.sensor_offsets))
+
+    def get_snapshot(self):
+        """Get the latest frame from the background waiter, without waiting.
+
+        A frame older than max_age means the PRU has stalled or the waiter
+        fell behind. In that case, waits up to max_age for a new frame.
+
+        :returns: UltrasonicSnapshot no older than max_age.
+        :raises: IOError if the waiter isn't running, or no new frame came.
+
+        """
+        waiter = self.waiter
+        if waiter is None:
+            raise IOError("Ultrasonic waiter is not running")
+        snapshot = waiter.snapshot
+        if snapshot is None or \
+                lib.monotonic() - snapshot.time > self.max_age:
+            after_seq = snapshot.seq if snapshot is not None else 0
+            snapshot = waiter.wait_for_snapshot(after_seq, self.max_age)
+            if snapshot is None:
+                self.logger.error("No ultrasonic frame for {}s".format(
+                    self.max_age))
+                raise IOError("Ultrasonic frames are stale")
+        return snapshot
+
+    def wait_for_snapshot(self, after_seq=0, timeout=None):
+        """Wait for a frame newer than the given one from the waiter.
+
+        :param after_seq: Sequence number of last snapshot seen by caller.
+        :type after_seq: int
+        :param timeout: Max time to wait (secs), max_age if None.
+        :type timeout: float
+        :returns: Newer UltrasonicSnapshot, or None if timeout expired first.
+        :raises: IOError if the waiter isn't running.
+
+        """
+        waiter = self.waiter
+        if waiter is None:
+            raise IOError("Ultrasonic waiter is not running")
+        if timeout is None:
+            timeout = self.max_age
+        return waiter.wait_for_snapshot(after_seq, timeout)
+
+    @lib.api_call
+    def start_waiter(self):
+        """Start waiting for PRU interrupts on a background thread.
+
+        Once started, reads return the latest frame in O(1) instead of
+        waiting for the PRU, which takes one to two frame periods.
+
+        :returns: Description of waiter state.
+
+        """
+        if self.waiter is not None:
+            return "Ultrasonic waiter is already running"
+        self.waiter = PRUWaiter(self, self.duplicate_interval)
+        self.waiter.start()
+        return "Started ultrasonic waiter"
+
+    @lib.api_call
+    def stop_waiter(self):
+        """Stop the background waiter, go back to waiting on each read.
+
+        The thread exits after the next interrupt, as waiting for one
+        can't be interrupted.
+
+        :returns: Description of waiter state.
+
+        """
+        if self.waiter is None:
+            return "Ultrasonic waiter is not running"
+        waiter = self.waiter
+        self.waiter = None
+        waiter.stop()
+        return "Stopped ultrasonic waiter, duplicates: {}".format(
+            waiter.duplicates)
+
+    @lib.api_call
+    def get_waiter_stats(self):
+        """Get state of the background waiter and the PRU's cadence.
+
+        :returns: Dict with running flag, latest seq, age of the latest
+            frame, smoothed and max period between frames, and no. of
+            duplicate interrupts dropped.
+
+        """
+        waiter = self.waiter
+        if waiter is None:
+            return {"running": False}
+        snapshot = waiter.snapshot
+        return {"running": True,
+                "seq": snapshot.seq if snapshot is not None else 0,
+                "age": lib.monotonic() - snapshot.time
+                if snapshot is not None else None,
+                "period": waiter.period,
+                "max_period": waiter.max_period,
+                "duplicates": waiter.duplicates}
@@ -0,0 +1,46 @@
+"""Publishing the newest of a stream of snapshots to other threads.
+
+Background readers (IRSampler, PRUWaiter, FrameGrabber) publish each new
+value as an immutable snapshot with a sequence number. Publishing is a
+single reference assignment, which is atomic under the GIL, so readers
+get the latest snapshot in O(1) without locks, and can keep using the one
+they hold while newer ones come in. Readers that need a snapshot newer
+than one they've already seen can block until it arrives.
+
+"""
+
+import threading
+
+
+class Latest(object):
+
+    """Holds the newest of a stream of snapshots that have a seq."""
+
+    def __init__(self):
+        self.snapshot = None
+        self.new_snapshot = threading.Condition()
+
+    def publish(self, snapshot):
+        """Replace the latest snapshot and wake up waiting readers."""
+        self.snapshot = snapshot
+        with self.new_snapshot:
+            self.new_snapshot.notify_all()
+
+    def wait(self, after_seq=0, timeout=None):
+        """Wait for a snapshot newer than the given sequence number.
+
+        :param after_seq: Sequence number of last snapshot seen by caller.
+        :type after_seq: int
+        :param timeout: Max time to wait (secs), None to wait forever.
+        :type timeout: float
+        :returns: Newer snapshot, or None if timeout expired first.
+
+        """
+        with self.new_snapshot:
+            snapshot = self.snapshot
+            if snapshot is None or snapshot.seq <= after_seq:
+                self.new_snapshot.wait(timeout)
+                snapshot = self.snapshot
+        if snapshot is None or snapshot.seq <= after_seq:
+            return None
+        return snapshot
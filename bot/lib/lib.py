@@ -2,6 +2,9 @@
 
 from os import path
 import logging.handlers
+import ctypes
+import ctypes.util
+from time import time
 
 try:
     import yaml
@@ -18,6 +21,20 @@ _logger = None
 default_config = "bot/config.yaml"
 
 
+# Monotonic clock (time.monotonic is Python 3 only)
+class _Timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+_CLOCK_MONOTONIC = 1
+try:
+    _librt = ctypes.CDLL(ctypes.util.find_library("rt") or "libc.so.6",
+                         use_errno=True)
+    _clock_gettime = _librt.clock_gettime
+    _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+except (OSError, AttributeError):
+    _clock_gettime = None
+
+
 # Types
 class Enum(tuple):
     """Simple enumeration type based on tuple with integer values."""
@@ -198,6 +215,23 @@ def get_logger():
     return logger
 
 
+def monotonic():
+    """Get seconds from a clock that never jumps, for timing and deadlines.
+
+    Uses clock_gettime(CLOCK_MONOTONIC). Falls back to time.time if that
+    isn't available (non-Linux dev boxes).
+
+    :returns: Seconds since an arbitrary, fixed point.
+
+    """
+    if _clock_gettime is None:
+        return time()
+    ts = _Timespec()
+    if _clock_gettime(_CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+        return time()
+    return ts.tv_sec + ts.tv_nsec * 1e-9
+
+
 def api_call(f):
     """Decorator used to register a method so that it becomes callable through
     the API.
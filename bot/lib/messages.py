@@ -11,7 +11,12 @@ bot servers and clients.
 Note that only messages intended to be sent over REQ/REP sockets, like
 the ones used by CtrlClient/CtrlServer, have message specs. PUB/SUB
 sockets are one-way, and since topic matching is required to be
-prefixed-based, PubServer always uses the format "{topic} {data}".
+prefixed-based, PubServer always sends the topic as the first frame of a
+multipart message, see lib.telemetry.
+
+How these messages are encoded on the wire (JSON or compact binary frames)
+is handled by lib.wire. When adding a message, also add it to
+wire.msg_fields.
 
 """
 
@@ -102,6 +107,111 @@ def call_reply(msg, call_return):
     return {"type": "call_reply", "msg": msg, "call_return": call_return}
 
 
+def batch_req(calls, stop_on_error=True):
+    """Construct message used when sending several API calls at once.
+
+    CtrlServer runs the calls in order, in one round trip.
+
+    :param calls: call_req messages to run, in order.
+    :type calls: list
+    :param stop_on_error: Don't run the calls after one that fails.
+    :type stop_on_error: boolean
+    :returns: Constructed batch_req dict, ready to be sent over the wire.
+
+    """
+    return {"type": "batch_req", "calls": calls,
+            "stop_on_error": stop_on_error}
+
+
+def batch_reply(replies):
+    """Construct message used by CtrlServer when replying to batch_reqs.
+
+    :param replies: call_reply or error message of each call that was run,
+        in order. Shorter than the batch if it stopped on an error.
+    :type replies: list
+    :returns: Constructed batch_reply dict, ready to be sent over the wire.
+
+    """
+    return {"type": "batch_reply", "replies": replies}
+
+
+def job_req(obj_name, method, params):
+    """Construct message used to start an API call as a background job.
+
+    Only handled by CtrlServer in router mode. The reply gives a job ID,
+    used to poll or cancel the job with job_status_req and job_cancel_req.
+
+    :param obj_name: Name of API-exported system that owns the given method.
+    :type obj_name: string
+    :param method: API-exported method to call on the given object.
+    :type method: string
+    :param params: Params to pass to the given method.
+    :type params: dict
+    :returns: Constructed job_req dict, ready to be sent over the wire.
+
+    """
+    return {
+        "type": "job_req",
+        "obj_name": obj_name,
+        "method": method,
+        "params": params
+    }
+
+
+def job_reply(job_id):
+    """Construct message used by CtrlServer when replying to job_reqs.
+
+    :param job_id: ID of the started job.
+    :type job_id: int
+    :returns: Constructed job_reply dict, ready to be sent over the wire.
+
+    """
+    return {"type": "job_reply", "job_id": job_id}
+
+
+def job_status_req(job_id):
+    """Construct message used to ask for the status of a job.
+
+    :param job_id: ID of the job, from a job_reply.
+    :type job_id: int
+    :returns: Constructed job_status_req dict, ready to be sent over the wire.
+
+    """
+    return {"type": "job_status_req", "job_id": job_id}
+
+
+def job_cancel_req(job_id):
+    """Construct message used to cancel a job.
+
+    Queued jobs are dropped. Running jobs are asked to stop, which only
+    methods that check for cancellation will do.
+
+    :param job_id: ID of the job, from a job_reply.
+    :type job_id: int
+    :returns: Constructed job_cancel_req dict, ready to be sent over the wire.
+
+    """
+    return {"type": "job_cancel_req", "job_id": job_id}
+
+
+def job_status_reply(job_id, state, reply):
+    """Construct message used when replying to job_status/job_cancel_reqs.
+
+    :param job_id: ID of the job.
+    :type job_id: int
+    :param state: One of queued, running, cancelling, cancelled or done.
+    :type state: string
+    :param reply: call_reply or error message of the job once it's done,
+        else None.
+    :type reply: dict
+    :returns: Constructed job_status_reply dict, ready to be sent over the
+        wire.
+
+    """
+    return {"type": "job_status_reply", "job_id": job_id, "state": state,
+            "reply": reply}
+
+
 def exit_req():
     """Construct message used when asking CtrlServer to exit.
 
@@ -118,3 +228,27 @@ def exit_reply():
 
     """
     return {"type": "exit_reply"}
+
+
+def hello_req(encodings):
+    """Construct message used to pick the encoding of later messages.
+
+    Always sent as JSON, so any server can read it.
+
+    :param encodings: Encodings the client supports, in order of preference.
+    :type encodings: list
+    :returns: Constructed hello_req dict, ready to be sent over the wire.
+
+    """
+    return {"type": "hello_req", "encodings": encodings}
+
+
+def hello_reply(encoding):
+    """Construct message used when replying to a hello_req message.
+
+    :param encoding: Encoding picked by the server.
+    :type encoding: string
+    :returns: Constructed hello_reply dict, ready to be sent over the wire.
+
+    """
+    return {"type": "hello_reply", "encoding": encoding}
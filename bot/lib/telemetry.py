@@ -0,0 +1,104 @@
+"""Encoding of the telemetry published by PubServer.
+
+Each published topic is a ZMQ multipart message of three frames:
+
+- topic: Topic name. ZMQ matches subscriptions against this frame.
+- header: Sequence no. of the topic (uint32), monotonic time the value
+  was sampled at (double, see lib.monotonic) and payload kind (byte).
+- payload: The value. NumPy arrays are sent as their raw buffer, with
+  their dtype (length-prefixed dtype.str) and shape appended to the
+  header, so IR frames and motor vectors need no formatting on the bot
+  and can be decoded without copying. Arrays of Python objects have no
+  raw buffer to send, so they're sent like other values. Other values
+  are packed like lib.wire message fields.
+
+"""
+
+from struct import Struct, error as StructError
+
+import numpy as np
+
+import wire
+
+
+# Payload kinds
+VALUE, ARRAY = 0, 1
+
+header_struct = Struct("<IdB")
+dtype_len_struct = Struct("<B")
+dims_struct = Struct("<B")
+dim_struct = Struct("<I")
+
+
+def pack_frames(topic, seq, timestamp, value):
+    """Build the frames of a telemetry message.
+
+    :param topic: Topic name.
+    :type topic: string
+    :param seq: Sequence no. of this message of the topic.
+    :type seq: int
+    :param timestamp: Monotonic time the value was sampled at.
+    :type timestamp: float
+    :param value: Value to publish.
+    :returns: List of frames, for send_multipart.
+
+    """
+    if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+        value = np.ascontiguousarray(value)
+        dtype_str = value.dtype.str
+        header = header_struct.pack(seq, timestamp, ARRAY) + \
+            dtype_len_struct.pack(len(dtype_str)) + dtype_str + \
+            dims_struct.pack(value.ndim) + \
+            "".join(dim_struct.pack(dim) for dim in value.shape)
+        # Zero-copy: ZMQ sends straight from the array's buffer
+        return [topic, header, value]
+    parts = []
+    try:
+        wire.pack_value(value, parts)
+    except TypeError:
+        # Send anything else as it used to be sent, as a string
+        parts = []
+        wire.pack_value(str(value), parts)
+    return [topic, header_struct.pack(seq, timestamp, VALUE), "".join(parts)]
+
+
+def unpack_frames(frames):
+    """Decode the frames of a telemetry message.
+
+    Arrays are read-only views of the received payload, not copies.
+
+    :param frames: Frames from recv_multipart, as strings or zmq.Frames.
+    :type frames: list
+    :returns: Tuple of topic, sequence no., timestamp and value.
+    :raises: wire.WireError if the frames can't be decoded.
+
+    """
+    try:
+        topic, header, payload = frames
+    except ValueError:
+        raise wire.WireError("Expected 3 frames, got {}".format(len(frames)))
+    topic = getattr(topic, "bytes", topic)
+    header = getattr(header, "bytes", header)
+    try:
+        seq, timestamp, kind = header_struct.unpack_from(header)
+        if kind == ARRAY:
+            offset = header_struct.size
+            # dtype.str, like "|u1", "<f8" or "|S12"
+            dtype_len, = dtype_len_struct.unpack_from(header, offset)
+            offset += dtype_len_struct.size
+            dtype = np.dtype(header[offset:offset + dtype_len])
+            offset += dtype_len
+            ndim, = dims_struct.unpack_from(header, offset)
+            offset += dims_struct.size
+            shape = tuple(dim_struct.unpack_from(header, offset + i * 4)[0]
+                          for i in range(ndim))
+            # zmq.Frames expose their buffer, so this doesn't copy
+            value = np.frombuffer(payload, dtype=dtype).reshape(shape)
+        elif kind == VALUE:
+            payload = getattr(payload, "bytes", payload)
+            value, end = wire.unpack_value(payload, 0)
+        else:
+            raise ValueError("Unknown payload kind {}".format(kind))
+    except (KeyError, IndexError, ValueError, TypeError, StructError) as e:
+        raise wire.WireError("Bad telemetry for {}: {}".format(topic, e))
+    return topic, seq, timestamp, value
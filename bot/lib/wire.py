@@ -0,0 +1,287 @@
+"""Encodings used to put lib.messages messages on the wire.
+
+Two encodings are supported:
+
+- json: The original encoding, readable and used by the CLI.
+- bin: Compact struct-packed frames, for high-rate clients like the pilot.
+
+A bin frame starts with one byte giving the message type (bin_base +
+index into msg_fields), followed by the values of that message's fields
+in a fixed order, so keys and type names aren't sent. For example, a
+ping_req is a single byte. Values are tagged with one byte, followed by
+their packed data.
+
+The first byte of a JSON message is always "{" or whitespace, which is
+below bin_base, so receivers can tell the encodings apart per message.
+CtrlServer replies in the encoding of each request. Clients pick their
+encoding with a hello_req, see CtrlClient.negotiate.
+
+"""
+
+from struct import Struct, error as StructError
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+
+# Supported encodings, in order of preference
+encodings = ("bin", "json")
+
+# Fields of each message type, in the order they're packed in bin frames.
+# Must stay in sync with lib.messages. Only append, as the index of each
+# type is its type byte.
+msg_fields = (
+    ("error", ("msg",)),
+    ("ping_req", ()),
+    ("ping_reply", ()),
+    ("list_req", ()),
+    ("list_reply", ("objects",)),
+    ("call_req", ("obj_name", "method", "params")),
+    ("call_reply", ("msg", "call_return")),
+    ("exit_req", ()),
+    ("exit_reply", ()),
+    ("hello_req", ("encodings",)),
+    ("hello_reply", ("encoding",)),
+    ("batch_req", ("calls", "stop_on_error")),
+    ("batch_reply", ("replies",)),
+    ("job_req", ("obj_name", "method", "params")),
+    ("job_reply", ("job_id",)),
+    ("job_status_req", ("job_id",)),
+    ("job_cancel_req", ("job_id",)),
+    ("job_status_reply", ("job_id", "state", "reply")))
+
+# First type byte of bin frames
+bin_base = 0x80
+
+msg_type_bytes = dict((name, chr(bin_base + i))
+                      for i, (name, fields) in enumerate(msg_fields))
+msg_fields_by_type = dict(msg_fields)
+
+# Value tags
+NONE, TRUE, FALSE, INT, FLOAT, STR, UNICODE, LIST, DICT = "NTFidsulm"
+
+# Tag and packed data of fixed-size values, packed in one call
+int_struct = Struct("<cq")
+float_struct = Struct("<cd")
+len_struct = Struct("<cI")
+len_size = len_struct.size - 1
+
+
+class WireError(ValueError):
+
+    """Raised when a message can't be encoded or decoded."""
+
+    pass
+
+
+def dumps(msg, encoding="json"):
+    """Encode a message from lib.messages for sending.
+
+    :param msg: Message to encode.
+    :type msg: dict
+    :param encoding: One of wire.encodings.
+    :type encoding: string
+    :returns: Encoded message.
+    :raises: WireError if the message can't be encoded.
+
+    """
+    if encoding == "json":
+        try:
+            return json.dumps(msg)
+        except TypeError as e:
+            raise WireError(str(e))
+    try:
+        msg_type = msg["type"]
+        parts = [msg_type_bytes[msg_type]]
+        for field in msg_fields_by_type[msg_type]:
+            pack_value(msg[field], parts)
+    except (KeyError, TypeError) as e:
+        raise WireError("Can't pack message: {}".format(e))
+    return "".join(parts)
+
+
+def loads(data):
+    """Decode a received message, in either encoding.
+
+    :param data: Received message.
+    :type data: string
+    :returns: Tuple of decoded message dict and the encoding it used.
+    :raises: WireError if the message can't be decoded.
+
+    """
+    if not data:
+        raise WireError("Empty message")
+    type_index = ord(data[0]) - bin_base
+    if type_index < 0:
+        try:
+            return json.loads(data), "json"
+        except ValueError as e:
+            raise WireError("Not a JSON message: {}".format(e))
+    try:
+        msg_type, fields = msg_fields[type_index]
+        msg = {"type": msg_type}
+        offset = 1
+        for field in fields:
+            msg[field], offset = unpackers[data[offset]](data, offset + 1)
+    except (IndexError, KeyError, ValueError, StructError) as e:
+        raise WireError("Bad bin message: {}".format(e))
+    if offset != len(data):
+        raise WireError("Bad bin message: trailing data")
+    return msg, "bin"
+
+
+def pack_value(value, parts):
+    """Pack a value onto a list of strings to be joined.
+
+    Handles the same types as JSON. Tuples are sent as lists.
+
+    :param value: Value to pack.
+    :param parts: List the packed value is appended to.
+    :type parts: list
+    :raises: TypeError if value has an unsupported type.
+
+    """
+    try:
+        packer = packers[type(value)]
+    except KeyError:
+        packer = subclass_packer(value)
+    packer(value, parts)
+
+
+def pack_none(value, parts):
+    parts.append(NONE)
+
+
+def pack_bool(value, parts):
+    parts.append(TRUE if value else FALSE)
+
+
+def pack_str(value, parts):
+    parts.append(len_struct.pack(STR, len(value)))
+    parts.append(value)
+
+
+def pack_unicode(value, parts):
+    value = value.encode("utf-8")
+    parts.append(len_struct.pack(UNICODE, len(value)))
+    parts.append(value)
+
+
+def pack_int(value, parts):
+    try:
+        parts.append(int_struct.pack(INT, value))
+    except StructError:
+        # Out of int64 range, rare enough to send as a float
+        parts.append(float_struct.pack(FLOAT, value))
+
+
+def pack_float(value, parts):
+    parts.append(float_struct.pack(FLOAT, value))
+
+
+def pack_list(value, parts):
+    parts.append(len_struct.pack(LIST, len(value)))
+    for item in value:
+        pack_value(item, parts)
+
+
+def pack_dict(value, parts):
+    parts.append(len_struct.pack(DICT, len(value)))
+    for key, item in value.iteritems():
+        pack_value(key, parts)
+        pack_value(item, parts)
+
+
+# Packers by exact type, checked first as that's faster than isinstance
+packers = {type(None): pack_none, bool: pack_bool, str: pack_str,
+           unicode: pack_unicode, int: pack_int, long: pack_int,
+           float: pack_float, list: pack_list, tuple: pack_list,
+           dict: pack_dict}
+
+
+def subclass_packer(value):
+    """Find the packer for a subclass of a supported type, like numpy's.
+
+    :param value: Value to pack.
+    :returns: Function to pack the value with.
+    :raises: TypeError if value has an unsupported type.
+
+    """
+    for value_type, packer in ((bool, pack_bool), (str, pack_str),
+                               (unicode, pack_unicode),
+                               ((int, long), pack_int), (float, pack_float),
+                               ((list, tuple), pack_list), (dict, pack_dict)):
+        if isinstance(value, value_type):
+            return packer
+    raise TypeError("{!r} can't be packed".format(value))
+
+
+def unpack_value(data, offset):
+    """Unpack a value packed by pack_value.
+
+    :param data: Packed data.
+    :type data: string
+    :param offset: Index of the value's tag in data.
+    :type offset: int
+    :returns: Tuple of the value and the offset just past it.
+    :raises: KeyError for unknown tags, IndexError or struct.error for
+        short data.
+
+    """
+    return unpackers[data[offset]](data, offset + 1)
+
+
+def unpack_str(data, offset):
+    length, = len_unpack(data, offset)
+    offset += len_size
+    end = offset + length
+    if end > len(data):
+        raise IndexError("String runs past end of message")
+    return data[offset:end], end
+
+
+def unpack_unicode(data, offset):
+    value, offset = unpack_str(data, offset)
+    return value.decode("utf-8"), offset
+
+
+def unpack_int(data, offset):
+    return int_unpack(data, offset)[0], offset + 8
+
+
+def unpack_float(data, offset):
+    return float_unpack(data, offset)[0], offset + 8
+
+
+def unpack_list(data, offset):
+    length, = len_unpack(data, offset)
+    offset += len_size
+    value = []
+    for i in xrange(length):
+        item, offset = unpackers[data[offset]](data, offset + 1)
+        value.append(item)
+    return value, offset
+
+
+def unpack_dict(data, offset):
+    length, = len_unpack(data, offset)
+    offset += len_size
+    value = {}
+    for i in xrange(length):
+        key, offset = unpackers[data[offset]](data, offset + 1)
+        value[key], offset = unpackers[data[offset]](data, offset + 1)
+    return value, offset
+
+
+# Unpack data after the tag, without it
+int_unpack = Struct("<q").unpack_from
+float_unpack = Struct("<d").unpack_from
+len_unpack = Struct("<I").unpack_from
+
+unpackers = {NONE: lambda data, offset: (None, offset),
+             TRUE: lambda data, offset: (True, offset),
+             FALSE: lambda data, offset: (False, offset),
+             STR: unpack_str, UNICODE: unpack_unicode, INT: unpack_int,
+             FLOAT: unpack_float, LIST: unpack_list, DICT: unpack_dict}
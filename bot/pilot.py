@@ -2,6 +2,7 @@
 
 import sys
 import time
+from contextlib import contextmanager
 
 import lib.lib as lib
 import client.ctrl_client as ctrl_client_mod
@@ -25,7 +26,8 @@ class Pilot:
 
         # Build control client
         try:
-            self.ctrl_client = ctrl_client_mod.CtrlClient(ctrl_addr)
+            self.ctrl_client = ctrl_client_mod.CtrlClient(
+                ctrl_addr, encoding="bin")
         except Exception, e:
             self.logger.error("Couldn't build CtrlClient; ctrl_addr: {},"
                               " error: {}".format(ctrl_addr, e))
@@ -53,6 +55,19 @@ class Pilot:
         else:
             return result['call_return']
 
+    @contextmanager
+    def batch(self, stop_on_error=True):
+        """Send the calls made in a with block in one round trip.
+
+        Failed calls are logged, and have None in batch.results.
+
+        """
+        with self.ctrl_client.batch(stop_on_error) as batch:
+            yield batch
+        for reply in batch.replies:
+            if reply['type'] == 'error':
+                self.logger.error("API call error: {}".format(reply['msg']))
+
     def bail(self, msg):
         """Log error message and exit cleanly, stopping all systems.
 
@@ -132,11 +147,15 @@ class Pilot:
 
         for activity in self.acts:
 
-            # Follow to intersection.
-            self.follow_ignoring_turns()
-            
-            # keep track of direction of branch for returning to main path.
-            act_dir = self.find_dir_of_int() 
+            # Follow to intersection, and keep track of direction of
+            # branch for returning to main path. Look for the branch even
+            # if following failed (e.g. timed out), like separate calls.
+            with self.batch(stop_on_error=False) as batch:
+                batch.call('follower', 'follow_ignoring_turns')
+                batch.call('follower', 'find_dir_of_int')
+            act_dir = batch.results[1]
+            if act_dir is None:
+                self.bail("No direction of intersection")
             
             self.rotate_to_line(act_dir)
 
@@ -154,11 +173,12 @@ class Pilot:
                 self.solve_activity(activity)
             
             # Leave box and return to path.
-            self.move(40, 180)
-            time.sleep(self.ITEM_BACKUP_TIME)
-            self.move(0, 0)
-
-            self.rotate_90('right')
+            with self.batch() as batch:
+                batch.call('driver', 'drive',
+                           {'speed': 40, 'angle': 180,
+                            'duration': self.ITEM_BACKUP_TIME})
+                batch.call('driver', 'rough_rotate_90',
+                           {'direction': 'right'})
             time.sleep(0.5)
             self.rotate_to_line('right')
             
@@ -3,8 +3,11 @@
 
 import sys
 import os
-from inspect import getmembers, ismethod
-from simplejson.decoder import JSONDecodeError
+from inspect import getmembers, ismethod, getargspec
+from itertools import count
+from collections import deque
+import threading
+import Queue
 import zmq
 import signal
 
@@ -15,6 +18,7 @@ import bot.lib.lib as lib
 from bot.follower.follower import Follower
 import pub_server as pub_server_mod
 import bot.lib.messages as msgs
+import bot.lib.wire as wire
 from bot.activity_solver.etch_a_sketch import etch_a_sketch
 from bot.activity_solver.simon_solver import SimonPlayer
 
@@ -39,6 +43,148 @@ def is_api_method(obj, name):
     return (ismethod(method) and hasattr(method, "__api_call"))
 
 
+class ApiMethod(object):
+
+    """Registry entry of an API-exported method, with its call stats."""
+
+    def __init__(self, func):
+        """Read the argspec of an exported method.
+
+        :param func: Bound method flagged with @lib.api_call.
+        :type func: instancemethod
+
+        """
+        self.func = func
+        spec = getargspec(func)
+        # Drop self, it's already bound
+        self.args = spec.args[1:]
+        num_defaults = len(spec.defaults) if spec.defaults else 0
+        self.required = self.args[:len(self.args) - num_defaults]
+        self.takes_kwargs = spec.keywords is not None
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def check_params(self, params):
+        """Check that params match the method's argspec.
+
+        :param params: Keyword params the method will be called with.
+        :type params: dict
+        :returns: Description of the mismatch, or None if params are valid.
+
+        """
+        missing = [arg for arg in self.required if arg not in params]
+        if missing:
+            return "missing {}".format(", ".join(missing))
+        if not self.takes_kwargs:
+            unexpected = [param for param in params
+                          if param not in self.args]
+            if unexpected:
+                return "unexpected {}".format(", ".join(unexpected))
+        return None
+
+
+class Job(object):
+
+    """An API call (or batch) run by a JobWorker in router mode."""
+
+    def __init__(self, job_id, system, msg, identity=None, encoding="json"):
+        """Build a queued job.
+
+        :param job_id: Unique ID of the job.
+        :type job_id: int
+        :param system: Name of the system whose worker runs the job.
+        :type system: string
+        :param msg: call_req or batch_req message to run.
+        :type msg: dict
+        :param identity: ROUTER identity of the client waiting for the
+            reply, or None if the client polls with job_status_req.
+        :type identity: string
+        :param encoding: Encoding of the reply sent to identity.
+        :type encoding: string
+
+        """
+        self.id = job_id
+        self.system = system
+        self.msg = msg
+        self.identity = identity
+        self.encoding = encoding
+        self.state = "queued"
+        self.reply = None
+        # Set when the job is asked to stop
+        self.cancel_event = threading.Event()
+        # Set once the reply is sent to identity, if cancelled while queued
+        self.reply_sent = False
+
+
+class JobWorker(threading.Thread):
+
+    """Runs the jobs of one system, in order.
+
+    Each system gets its own worker, so a long call on one (like
+    follower.follow_ignoring_turns) doesn't hold up calls to another.
+    Replies to waiting clients are pushed to CtrlServer over an inproc
+    socket, as ZMQ sockets can't be shared between threads.
+
+    """
+
+    def __init__(self, server, system):
+        """Build the worker and its queue.
+
+        :param server: Server that owns the systems and jobs.
+        :type server: CtrlServer
+        :param system: Name of the system this worker runs jobs for.
+        :type system: string
+
+        """
+        threading.Thread.__init__(self, name="JobWorker-" + system)
+        self.daemon = True
+        self.server = server
+        self.queue = Queue.Queue()
+
+    def run(self):
+        """Run queued jobs until given None."""
+        reply_sock = self.server.context.socket(zmq.PUSH)
+        # Don't hold up context.term() with replies nobody will read
+        reply_sock.setsockopt(zmq.LINGER, 0)
+        reply_sock.connect(self.server.job_reply_addr)
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            with self.server.jobs_lock:
+                if job.state != "queued":
+                    # Cancelled while waiting, reply if cancel_job couldn't
+                    if job.identity is not None and not job.reply_sent:
+                        job.reply_sent = True
+                        self.send_reply(reply_sock, job, job.reply)
+                    continue
+                self.server.reset_cancel(job.system)
+                job.state = "running"
+            if job.msg["type"] == "batch_req":
+                reply = self.server.call_batch(
+                    job.msg["calls"], job.msg.get("stop_on_error", True))
+            else:
+                reply = self.server.call_method(
+                    job.msg["obj_name"], job.msg["method"],
+                    job.msg["params"])
+            self.server.finish_job(job, reply)
+            if job.identity is not None:
+                self.send_reply(reply_sock, job, reply)
+        reply_sock.close()
+
+    def send_reply(self, reply_sock, job, reply):
+        """Push a job's reply to CtrlServer, to forward to its client."""
+        try:
+            reply_sock.send_multipart(
+                [job.identity, "", self.server.encode(reply, job.encoding)],
+                zmq.NOBLOCK)
+        except zmq.Again:
+            # Server has shut down, nobody's left to reply to
+            pass
+
+
 class CtrlServer(object):
 
     """Exports bot control via ZMQ.
@@ -62,6 +208,17 @@ class CtrlServer(object):
 
     The messages that CtrlServer accepts and responds with are fully
     specified in lib.messages. Make any changes to messages there.
+    Messages may be JSON or compact binary frames (see lib.wire), and
+    each reply uses the encoding of its request.
+
+    CtrlServer runs in one of two modes, set by ctrl_server_mode in the
+    config. In rep mode, a single REP socket handles one message at a
+    time. In router mode, a ROUTER socket accepts messages from many
+    clients at once. API calls are handed to a JobWorker per system, and
+    clients get their replies when the calls finish, while pings, lists,
+    job messages and priority calls (like ctrl.stop_full) are answered
+    right away, even while long calls run. Clients can also start calls
+    as background jobs, with job_req, and poll or cancel them later.
 
     CtrlServer can be instructed (via the API) to spawn a new thread
     for a PubServer. When that happens, CtrlServer passes its systems
@@ -70,13 +227,28 @@ class CtrlServer(object):
 
     """
 
-    def __init__(self, testing=None, config_file="bot/config.yaml"):
-        """Build ZMQ REP socket and instantiate bot systems.
+    # API calls answered right away in router mode, never queued
+    priority_calls = set([("ctrl", "stop_full"), ("follower", "cancel")])
+
+    # Systems whose queued jobs stop_full cancels, batches may drive too
+    motion_systems = set(["follower", "driver", "batch"])
+
+    # Finished jobs kept for job_status_reqs
+    max_finished_jobs = 100
+
+    # Max time (secs) to wait for each JobWorker to exit on clean up
+    worker_join_timeout = 2.0
+
+    def __init__(self, testing=None, config_file="bot/config.yaml",
+                 mode=None):
+        """Build ZMQ REP or ROUTER socket and instantiate bot systems.
 
         :param testing: True if running on simulated HW, False if on bot.
         :type testing: boolean
         :param config_file: Name of file to read configuration from.
         :type config_file: string
+        :param mode: Either "rep" or "router", read from config if None.
+        :type mode: string
 
         """
         # Register signal handler, shut down cleanly (think motors)
@@ -100,8 +272,14 @@ class CtrlServer(object):
             lib.set_testing(False)
 
         # Build socket to listen for requests
+        if mode is None:
+            mode = self.config["ctrl_server_mode"]
+        self.mode = mode
         self.context = zmq.Context()
-        self.ctrl_sock = self.context.socket(zmq.REP)
+        if self.mode == "router":
+            self.ctrl_sock = self.context.socket(zmq.ROUTER)
+        else:
+            self.ctrl_sock = self.context.socket(zmq.REP)
         self.server_bind_addr = "{protocol}://{host}:{port}".format(
             protocol=self.config["server_protocol"],
             host=self.config["server_bind_host"],
@@ -114,11 +292,29 @@ class CtrlServer(object):
             sys.exit(1)
 
         self.systems = self.assign_subsystems()
+        self.build_registry()
         self.logger.info("Control server initialized")
 
         # Don't spawn pub_server until told to
         self.pub_server = None
 
+        # Encoding of the message being handled, used for its reply
+        self.msg_encoding = "json"
+        # ROUTER identity of the client that sent it, in router mode
+        self.msg_identity = None
+
+        # Jobs, by ID, and the workers that run them, by system name
+        self.jobs = {}
+        self.finished_jobs = deque()
+        self.jobs_lock = threading.Lock()
+        self.job_ids = count(1)
+        self.workers = {}
+        self.job_reply_addr = "inproc://ctrl_job_replies"
+        # Receives replies from JobWorkers, bound by listen_router
+        self.job_reply_sock = None
+        # Thread running listen_router, the only one using ctrl_sock
+        self.listener_thread = None
+
     def signal_handler(self, signal, frame):
         self.logger.info("Caught SIGINT (Ctrl+C), closing cleanly")
         self.clean_up()
@@ -152,33 +348,133 @@ class CtrlServer(object):
         self.logger.debug("Systems: {}".format(systems))
         return systems
 
+    def build_registry(self):
+        """Index the API-exported methods of every subsystem.
+
+        Introspection is done once here, rather than on every list_req
+        and call_req. Sets self.registry, mapping (system name, method
+        name) to ApiMethod, and self.list_reply, the precomputed reply to
+        list_reqs.
+
+        """
+        self.registry = {}
+        callables = {}
+        for name, obj in self.systems.items():
+            methods = []
+            # Filter out methods which are not explicitly flagged for export
+            for member, value in getmembers(obj):
+                if is_api_method(obj, member):
+                    self.registry[(name, member)] = ApiMethod(value)
+                    methods.append(member)
+            callables[name] = methods
+        self.list_reply = msgs.list_reply(callables)
+        self.logger.debug("Registered %d API methods", len(self.registry))
+
     def listen(self):
         """Perpetually listen for messages, pass them to generic handler."""
         self.logger.info("Control server: {}".format(self.server_bind_addr))
+        if self.mode == "router":
+            return self.listen_router()
         while True:
             try:
-                msg = self.ctrl_sock.recv_json()
-                reply = self.handle_msg(msg)
-                self.logger.debug("Sending: {}".format(reply))
-                self.ctrl_sock.send_json(reply)
-            except JSONDecodeError:
-                err_msg = "Not a JSON message!"
-                self.logger.warning(err_msg)
-                self.ctrl_sock.send_json(msgs.error(err_msg))
+                try:
+                    msg, self.msg_encoding = wire.loads(
+                        self.ctrl_sock.recv())
+                except wire.WireError as e:
+                    self.logger.warning("Bad message: %s", e)
+                    self.msg_encoding = "json"
+                    reply = msgs.error(str(e))
+                else:
+                    reply = self.handle_msg(msg)
+                self.send_reply(reply)
             except KeyboardInterrupt:
                 self.logger.info("Exiting control server. Bye!")
                 self.clean_up()
                 sys.exit(0)
 
+    def listen_router(self):
+        """Listen for messages from many clients, in router mode.
+
+        Messages are handled as they come in. API calls are queued for
+        their system's JobWorker, and replies from workers are forwarded
+        to their clients.
+
+        """
+        self.listener_thread = threading.current_thread()
+        job_reply_sock = self.job_reply_sock = self.context.socket(zmq.PULL)
+        job_reply_sock.setsockopt(zmq.LINGER, 0)
+        job_reply_sock.bind(self.job_reply_addr)
+        poller = zmq.Poller()
+        poller.register(self.ctrl_sock, zmq.POLLIN)
+        poller.register(job_reply_sock, zmq.POLLIN)
+        while True:
+            try:
+                events = dict(poller.poll())
+                if job_reply_sock in events:
+                    self.ctrl_sock.send_multipart(
+                        job_reply_sock.recv_multipart())
+                if self.ctrl_sock not in events:
+                    continue
+                frames = self.ctrl_sock.recv_multipart()
+                # REQ clients send [identity, "", msg]
+                self.msg_identity = frames[0]
+                try:
+                    msg, self.msg_encoding = wire.loads(frames[-1])
+                except wire.WireError as e:
+                    self.logger.warning("Bad message: %s", e)
+                    self.msg_encoding = "json"
+                    reply = msgs.error(str(e))
+                else:
+                    reply = self.handle_msg(msg)
+                if reply is not None:
+                    self.send_reply(reply)
+            except KeyboardInterrupt:
+                self.logger.info("Exiting control server. Bye!")
+                self.clean_up()
+                sys.exit(0)
+
+    def encode(self, reply, encoding):
+        """Encode a reply, or an error if the reply can't be encoded.
+
+        :param reply: Reply message dict, from lib.messages.
+        :type reply: dict
+        :param encoding: Encoding to use, see lib.wire.
+        :type encoding: string
+        :returns: Encoded reply.
+
+        """
+        # NB: don't format messages unless they're actually logged
+        self.logger.debug("Sending: %s", reply)
+        try:
+            return wire.dumps(reply, encoding)
+        except wire.WireError as e:
+            err_msg = "Can't encode reply: {}".format(e)
+            self.logger.warning(err_msg)
+            return wire.dumps(msgs.error(err_msg), encoding)
+
+    def send_reply(self, reply):
+        """Send a reply, in the encoding of the message being handled.
+
+        :param reply: Reply message dict, from lib.messages.
+        :type reply: dict
+
+        """
+        data = self.encode(reply, self.msg_encoding)
+        if self.mode == "router":
+            self.ctrl_sock.send_multipart([self.msg_identity, "", data])
+        else:
+            self.ctrl_sock.send(data)
+
     def handle_msg(self, msg):
         """Generic message handler. Hands-off based on type of message.
 
         :param msg: Message, received via ZMQ from client, to handle.
         :type msg: dict
         :returns: An appropriate message reply dict, from lib.messages.
+            None in router mode if the reply will be sent by a JobWorker.
 
         """
-        self.logger.debug("Received: {}".format(msg))
+        self.logger.debug("Received: %s", msg)
 
         try:
             msg_type = msg["type"]
@@ -187,6 +483,8 @@ class CtrlServer(object):
 
         if msg_type == "ping_req":
             reply = msgs.ping_reply()
+        elif msg_type == "hello_req":
+            reply = self.negotiate(msg.get("encodings", []))
         elif msg_type == "list_req":
             reply = self.list_callables()
         elif msg_type == "call_req":
@@ -194,15 +492,54 @@ class CtrlServer(object):
                 obj_name = msg["obj_name"]
                 method = msg["method"]
                 params = msg["params"]
-                reply = self.call_method(obj_name, method, params)
             except KeyError as e:
                 return msgs.error(e)
+            if (obj_name, method) not in self.priority_calls:
+                if self.mode == "router" and obj_name in self.systems:
+                    self.start_job(obj_name, msg, self.msg_identity)
+                    return None
+                self.reset_cancel(obj_name)
+            reply = self.call_method(obj_name, method, params)
+        elif msg_type == "batch_req":
+            try:
+                calls = msg["calls"]
+                stop_on_error = msg.get("stop_on_error", True)
+            except KeyError as e:
+                return msgs.error(e)
+            if self.mode == "router":
+                # Batches may span systems, so they get a worker of their own
+                self.start_job("batch", msg, self.msg_identity)
+                return None
+            self.reset_cancel("batch")
+            reply = self.call_batch(calls, stop_on_error)
+        elif msg_type == "job_req":
+            if self.mode != "router":
+                return msgs.error("Jobs need ctrl_server_mode: router")
+            try:
+                call = msgs.call_req(
+                    msg["obj_name"], msg["method"], msg["params"])
+            except KeyError as e:
+                return msgs.error(e)
+            if call["obj_name"] not in self.systems:
+                return msgs.error(
+                    "Invalid object: '{}'".format(call["obj_name"]))
+            job = self.start_job(call["obj_name"], call)
+            reply = msgs.job_reply(job.id)
+        elif msg_type == "job_status_req":
+            try:
+                reply = self.job_status(msg["job_id"])
+            except KeyError as e:
+                return msgs.error("Unknown job: {}".format(e))
+        elif msg_type == "job_cancel_req":
+            try:
+                reply = self.cancel_job(msg["job_id"])
+            except KeyError as e:
+                return msgs.error("Unknown job: {}".format(e))
         elif msg_type == "exit_req":
             self.logger.info("Received message to die. Bye!")
             reply = msgs.exit_reply()
             # Need to actually send reply here as we're about to exit
-            self.logger.debug("Sending: {}".format(reply))
-            self.ctrl_sock.send_json(reply)
+            self.send_reply(reply)
             self.clean_up()
             sys.exit(0)
         else:
@@ -211,32 +548,144 @@ class CtrlServer(object):
             reply = msgs.error(err_msg)
         return reply
 
+    def negotiate(self, encodings):
+        """Pick the encoding a client should use for later messages.
+
+        :param encodings: Encodings the client supports, by preference.
+        :type encodings: list
+        :returns: hello_reply message with the picked encoding.
+
+        """
+        for encoding in encodings:
+            if encoding in wire.encodings:
+                self.logger.debug("Client will use encoding %s", encoding)
+                return msgs.hello_reply(encoding)
+        return msgs.hello_reply("json")
+
+    def start_job(self, system, msg, identity=None):
+        """Queue a call_req or batch_req for a system's JobWorker.
+
+        :param system: Name of the system whose worker runs the job.
+        :type system: string
+        :param msg: call_req or batch_req message to run.
+        :type msg: dict
+        :param identity: ROUTER identity of the client to reply to when the
+            job is done, or None if it'll poll with job_status_req.
+        :type identity: string
+        :returns: The queued Job.
+
+        """
+        job = Job(next(self.job_ids), system, msg, identity,
+                  self.msg_encoding)
+        with self.jobs_lock:
+            self.jobs[job.id] = job
+        try:
+            worker = self.workers[system]
+        except KeyError:
+            worker = self.workers[system] = JobWorker(self, system)
+            worker.start()
+        worker.queue.put(job)
+        self.logger.debug("Queued job %d for %s", job.id, system)
+        return job
+
+    def finish_job(self, job, reply):
+        """Record the reply of a job, forget the oldest finished jobs.
+
+        :param job: Job that finished.
+        :type job: Job
+        :param reply: call_reply, batch_reply or error message of the job.
+        :type reply: dict
+
+        """
+        with self.jobs_lock:
+            job.reply = reply
+            job.state = "cancelled" if job.cancel_event.is_set() else "done"
+            self.finished_jobs.append(job.id)
+            while len(self.finished_jobs) > self.max_finished_jobs:
+                self.jobs.pop(self.finished_jobs.popleft(), None)
+
+    def job_status(self, job_id):
+        """Get the state of a job, and its reply if it's finished.
+
+        :param job_id: ID of the job.
+        :type job_id: int
+        :returns: job_status_reply message.
+        :raises: KeyError if there's no such job (or it's been forgotten).
+
+        """
+        with self.jobs_lock:
+            job = self.jobs[job_id]
+            return msgs.job_status_reply(job.id, job.state, job.reply)
+
+    def reset_cancel(self, system):
+        """Clear an earlier cancel of the follower, as a call starts.
+
+        :param system: Name of the system called, "batch" for batches.
+        :type system: string
+
+        """
+        if system in ("follower", "batch"):
+            self.follower.reset_cancel()
+
+    def cancel_job(self, job_id):
+        """Cancel a queued job, or ask a running one to stop.
+
+        Running jobs only stop if their method checks for cancellation,
+        so their state is cancelling until they return. Systems with a
+        cancel method (like Follower) have it called to stop the job.
+        A client waiting on a queued job gets its reply right away, or
+        from the job's worker if this isn't called by the listener.
+
+        :param job_id: ID of the job.
+        :type job_id: int
+        :returns: job_status_reply message, with the state after cancelling.
+        :raises: KeyError if there's no such job (or it's been forgotten).
+
+        """
+        with self.jobs_lock:
+            job = self.jobs[job_id]
+            job.cancel_event.set()
+            send_reply = False
+            if job.state == "queued":
+                job.state = "cancelled"
+                job.reply = msgs.error("Job {} cancelled".format(job_id))
+                self.finished_jobs.append(job.id)
+                if job.identity is not None and \
+                        threading.current_thread() is self.listener_thread:
+                    send_reply = job.reply_sent = True
+            elif job.state == "running":
+                job.state = "cancelling"
+                cancel = getattr(self.systems.get(job.system), "cancel", None)
+                if cancel is not None:
+                    cancel()
+            reply = msgs.job_status_reply(job.id, job.state, job.reply)
+        if send_reply:
+            # Client is still waiting on the reply to its call
+            self.ctrl_sock.send_multipart(
+                [job.identity, "", self.encode(job.reply, job.encoding)])
+        self.logger.info("Cancel job %d: %s", job_id, job.state)
+        return reply
+
     def list_callables(self):
-        """Build list of callable methods on each exported subsystem object.
+        """Get the callable methods on each exported subsystem object.
 
-        Uses introspection to create a list of callable methods for each
-        registered subsystem object. Only methods which are flagged using the
-        @lib.api_call decorator will be included.
+        Only methods which are flagged using the @lib.api_call decorator
+        are included. The reply is built once, by build_registry.
 
         :returns: list_reply message with callable objects and their methods.
 
         """
         self.logger.debug("List of callable API objects requested")
-        # Dict of subsystem object names to their callable methods.
-        callables = {}
-        for name, obj in self.systems.items():
-            methods = []
-            # Filter out methods which are not explicitly flagged for export
-            for member in getmembers(obj):
-                if is_api_method(obj, member[0]):
-                    methods.append(member[0])
-            callables[name] = methods
-        return msgs.list_reply(callables)
+        return self.list_reply
 
     def call_method(self, name, method, params):
         """Call a previously registered subsystem method by name. Only
         methods tagged with the @api_call decorator can be called.
 
+        Params are checked against the method's argspec before calling,
+        so TypeErrors raised by the method itself are reported as
+        exceptions, not as invalid params.
+
         :param name: Assigned name of the registered subsystem.
         :type name: string
         :param method: Subsystem method to be called.
@@ -246,35 +695,68 @@ class CtrlServer(object):
         :returns: call_reply or error message dict to be sent to caller.
 
         """
-        self.logger.debug("API call: {}.{}({})".format(name, method, params))
-        if name in self.systems:
-            obj = self.systems[name]
-            if is_api_method(obj, method):
-                try:
-                    # Calls given obj.method, unpacking and passing params dict
-                    call_return = getattr(obj, method)(**params)
-                    msg = "Called {}.{}".format(name, method)
-                    self.logger.debug(msg + ",returned:{}".format(call_return))
-                    return msgs.call_reply(msg, call_return)
-                except TypeError:
-                    # Raised when we have a mismatch of the method's kwargs
-                    # TODO: Return argspec here?
-                    err_msg = "Invalid params for {}.{}".format(name, method)
-                    self.logger.warning(err_msg)
-                    return msgs.error(err_msg)
-                except Exception as e:
-                    # Catch exception raised by called method, notify client
-                    err_msg = "Exception: '{}'".format(str(e))
-                    self.logger.warning(err_msg)
-                    return msgs.error(err_msg)
-            else:
+        self.logger.debug("API call: %s.%s(%s)", name, method, params)
+        try:
+            api_method = self.registry[(name, method)]
+        except KeyError:
+            if name in self.systems:
                 err_msg = "Invalid method: '{}.{}'".format(name, method)
-                self.logger.warning(err_msg)
-                return msgs.error(err_msg)
-        else:
-            err_msg = "Invalid object: '{}'".format(name)
+            else:
+                err_msg = "Invalid object: '{}'".format(name)
+            self.logger.warning(err_msg)
+            return msgs.error(err_msg)
+
+        mismatch = api_method.check_params(params)
+        if mismatch is not None:
+            # TODO: Return argspec here?
+            err_msg = "Invalid params for {}.{}: {}".format(
+                name, method, mismatch)
+            self.logger.warning(err_msg)
+            return msgs.error(err_msg)
+
+        start_time = lib.monotonic()
+        try:
+            # Calls given obj.method, unpacking and passing params dict
+            call_return = api_method.func(**params)
+        except Exception as e:
+            # Catch exception raised by called method, notify client
+            api_method.errors += 1
+            err_msg = "Exception: '{}'".format(str(e))
             self.logger.warning(err_msg)
             return msgs.error(err_msg)
+        finally:
+            call_time = lib.monotonic() - start_time
+            api_method.calls += 1
+            api_method.total_time += call_time
+            if call_time > api_method.max_time:
+                api_method.max_time = call_time
+        msg = "Called {}.{}".format(name, method)
+        self.logger.debug("%s, returned: %s", msg, call_return)
+        return msgs.call_reply(msg, call_return)
+
+    def call_batch(self, calls, stop_on_error=True):
+        """Call several subsystem methods in order, see call_method.
+
+        :param calls: call_req messages to run, in order.
+        :type calls: list
+        :param stop_on_error: Don't run the calls after one that fails.
+        :type stop_on_error: boolean
+        :returns: batch_reply with a call_reply or error for each call run.
+
+        """
+        replies = []
+        for call in calls:
+            try:
+                if call["type"] != "call_req":
+                    raise KeyError("type")
+                reply = self.call_method(
+                    call["obj_name"], call["method"], call["params"])
+            except (KeyError, TypeError) as e:
+                reply = msgs.error("Bad call_req in batch: {}".format(e))
+            replies.append(reply)
+            if stop_on_error and reply["type"] == "error":
+                break
+        return msgs.batch_reply(replies)
 
     @lib.api_call
     def echo(self, msg=None):
@@ -291,6 +773,30 @@ class CtrlServer(object):
         """Raise a test exception which will be returned to the caller."""
         raise Exception("Exception test")
 
+    @lib.api_call
+    def get_call_stats(self, reset=False):
+        """Get call counts and latencies of the API methods called so far.
+
+        :param reset: Clear the stats after reading them.
+        :type reset: boolean
+        :returns: Dict of "system.method" to dict of calls, errors and
+            avg/max call times in milliseconds.
+
+        """
+        stats = {}
+        for (name, method), api_method in self.registry.iteritems():
+            if api_method.calls == 0:
+                continue
+            stats["{}.{}".format(name, method)] = {
+                "calls": api_method.calls,
+                "errors": api_method.errors,
+                "avg_ms": api_method.total_time * 1000 / api_method.calls,
+                "max_ms": api_method.max_time * 1000}
+            if reset:
+                api_method.calls = api_method.errors = 0
+                api_method.total_time = api_method.max_time = 0.0
+        return stats
+
     @lib.api_call
     def spawn_pub_server(self):
         """Spawn publisher thread."""
@@ -307,16 +813,60 @@ class CtrlServer(object):
             self.logger.warning(err_msg)
             return err_msg
 
+    @lib.api_call
+    def get_pub_stats(self):
+        """Get publish counts, overruns and sampler reads of PubServer.
+
+        :returns: Dict of stats, see PubServer.get_stats.
+
+        """
+        if self.pub_server is None:
+            raise Exception("PubServer isn't running")
+        return self.pub_server.get_stats()
+
     @lib.api_call
     def stop_full(self):
-        """Stop all drive and gun motors, set turret to safe state."""
+        """Stop all drive and gun motors, set turret to safe state.
+
+        Queued jobs of the motion systems are cancelled, and follower
+        routines are stopped, or they'd start the motors again.
+
+        """
+        with self.jobs_lock:
+            queued = [job.id for job in self.jobs.itervalues()
+                      if job.state == "queued" and
+                      job.system in self.motion_systems]
+        for job_id in queued:
+            self.cancel_job(job_id)
+        self.systems["follower"].cancel()
         self.systems["driver"].move(0, 0)
 
     def clean_up(self):
-        """Tear down ZMQ socket."""
+        """Stop JobWorkers and tear down ZMQ sockets.
+
+        Workers are stopped and joined first, as context.term() waits for
+        every socket to be closed, including their reply sockets. If a
+        worker is still running a job that can't be cancelled, the
+        context is left open rather than waiting on it forever. Workers
+        are daemon threads, so they don't keep the process alive.
+
+        """
         self.stop_full()
+        for worker in self.workers.values():
+            worker.queue.put(None)
+        busy_workers = []
+        for worker in self.workers.values():
+            worker.join(self.worker_join_timeout)
+            if worker.is_alive():
+                busy_workers.append(worker.name)
+        if self.job_reply_sock is not None:
+            self.job_reply_sock.close()
         self.ctrl_sock.close()
-        self.context.term()
+        if busy_workers:
+            self.logger.warning("Not terminating ZMQ context, {} still "
+                                "running".format(", ".join(busy_workers)))
+        else:
+            self.context.term()
 
 
 if __name__ == "__main__":
@@ -3,7 +3,10 @@
 import sys
 import os
 import threading
-from time import sleep
+from heapq import heappush, heappop
+from operator import itemgetter
+
+import numpy as np
 
 try:
     import zmq
@@ -12,16 +15,264 @@ except ImportError:
     raise
 
 import bot.lib.lib as lib
+import bot.lib.telemetry as telemetry
+
+
+class TopicScheduler(object):
+
+    """Decide which topics to publish when, and sample them.
+
+    Keeps the subscriptions, the heap of due times, the shared samplers
+    and the publish stats of PubServer, see its docs. It doesn't touch
+    ZMQ, PubServer feeds it subscription messages and sends what it
+    publishes.
+
+    """
+
+    def __init__(self, samplers, topics, pub_topics):
+        """Build the schedule, with nothing subscribed.
+
+        :param samplers: Mapping of sampler names to functions that read
+            bot state.
+        :type samplers: dict
+        :param topics: Mapping of topic names to (sampler name, function
+            that gets the topic's value from the sample or None if it's
+            the whole sample).
+        :type topics: dict
+        :param pub_topics: Schedule settings by topic prefix, like the
+            pub_topics config.
+        :type pub_topics: dict
+
+        """
+        self.logger = lib.get_logger()
+        self.samplers = samplers
+        self.topics = topics
+        self.pub_topics = pub_topics
+        # Source of the times topics are scheduled and sampled at
+        self.clock = lib.monotonic
+
+        # Schedule settings of each topic, see PubServer docs
+        self.settings = dict((topic_name, self.topic_settings(topic_name))
+                             for topic_name in self.topics)
+
+        # Last (time, value) read by each sampler
+        self.samples = {}
+        # Sequence no. of the next message of each topic
+        self.seqs = dict((topic_name, 0) for topic_name in self.topics)
+
+        # Topic prefixes with at least one subscriber
+        self.subscriptions = set()
+        # Heap of (due time, topic name) and due time of each subscribed
+        # topic. Heap entries that don't match are stale and skipped.
+        self.schedule = []
+        self.due_times = {}
+
+        self.stats = dict((topic_name, {"published": 0, "overruns": 0,
+                                        "max_late": 0.0})
+                          for topic_name in self.topics)
+        self.sampler_reads = dict((name, 0) for name in self.samplers)
+
+    def topic_settings(self, topic_name):
+        """Get the period, jitter and max_age settings of a topic.
+
+        Settings come from the longest pub_topics key that's a prefix of
+        the topic name, with anything not given there from the default.
+
+        :param topic_name: Topic to get settings for.
+        :type topic_name: string
+        :returns: Dict with period, jitter and max_age (secs.)
+
+        """
+        settings = dict(self.pub_topics["default"])
+        matches = [prefix for prefix in self.pub_topics
+                   if prefix != "default" and topic_name.startswith(prefix)]
+        if matches:
+            settings.update(self.pub_topics[max(matches, key=len)])
+        return settings
+
+    def next_due(self):
+        """Get the earliest scheduled topic, dropping stale heap entries.
+
+        :returns: Tuple of due time and topic name, or None if nothing is
+            scheduled.
+
+        """
+        while self.schedule:
+            due_time, topic_name = self.schedule[0]
+            if self.due_times.get(topic_name) == due_time:
+                return due_time, topic_name
+            heappop(self.schedule)
+        return None
+
+    def time_to_next_pub(self, max_delay):
+        """Get the time until the next topic needs to be published.
+
+        :param max_delay: Longest time to return, in secs.
+        :type max_delay: float
+        :returns: Secs. until next publish, at most max_delay.
+
+        """
+        entry = self.next_due()
+        if entry is None:
+            return max_delay
+        delay = entry[0] - self.settings[entry[1]]["jitter"] - self.clock()
+        return min(max(delay, 0), max_delay)
+
+    def subscription_changed(self, event):
+        """Apply a subscribe or unsubscribe message from an XPUB socket.
+
+        XPUB gives one message when a prefix gets its first subscriber,
+        and one when its last subscriber leaves. Call update_active_topics
+        once a batch of messages has been applied.
+
+        :param event: Message, a 1 (subscribe) or 0 (unsubscribe) byte
+            followed by the topic prefix.
+        :type event: string
+        :returns: True if the message changed the subscriptions.
+
+        """
+        if not event:
+            return False
+        prefix = event[1:]
+        if event[0] == "\x01":
+            self.logger.debug("Subscribed: '%s'", prefix)
+            self.subscriptions.add(prefix)
+        else:
+            self.logger.debug("Unsubscribed: '%s'", prefix)
+            self.subscriptions.discard(prefix)
+        return True
+
+    def update_active_topics(self):
+        """Schedule the topics that match a subscription, drop the rest."""
+        now = self.clock()
+        due_times = {}
+        for topic_name in self.topics:
+            if any(topic_name.startswith(prefix)
+                   for prefix in self.subscriptions):
+                if topic_name in self.due_times:
+                    due_times[topic_name] = self.due_times[topic_name]
+                else:
+                    # Newly subscribed topics go out right away
+                    due_times[topic_name] = now
+                    heappush(self.schedule, (now, topic_name))
+        self.due_times = due_times
+        self.logger.debug("Publishing topics: %s", due_times.keys())
+
+    def publish_due(self, send):
+        """Publish the subscribed topics that are due, reschedule them.
+
+        :param send: Function to send a topic with, given the topic name,
+            sequence no., sample time and value.
+        :type send: callable
+
+        """
+        now = self.clock()
+        while True:
+            entry = self.next_due()
+            if entry is None:
+                return
+            due_time, topic_name = entry
+            settings = self.settings[topic_name]
+            if due_time - settings["jitter"] > now:
+                return
+            heappop(self.schedule)
+
+            self.publish(topic_name, send)
+            late = self.clock() - due_time
+            stats = self.stats[topic_name]
+            if late > stats["max_late"]:
+                stats["max_late"] = late
+            if late > settings["jitter"]:
+                stats["overruns"] += 1
+
+            due_time += settings["period"]
+            if due_time < now:
+                # Fell a whole period behind, don't publish a burst
+                due_time = now + settings["period"]
+            self.due_times[topic_name] = due_time
+            heappush(self.schedule, (due_time, topic_name))
+
+    def sample(self, sampler_name, max_age):
+        """Read a sampler, or reuse its last sample if fresh enough.
+
+        :param sampler_name: Sampler to read.
+        :type sampler_name: string
+        :param max_age: Oldest sample to reuse, in secs.
+        :type max_age: float
+        :returns: Tuple of time of the sample and sampled value.
+
+        """
+        now = self.clock()
+        try:
+            sample = self.samples[sampler_name]
+            if now - sample[0] <= max_age:
+                return sample
+        except KeyError:
+            pass
+        sample = (now, self.samplers[sampler_name]())
+        self.samples[sampler_name] = sample
+        self.sampler_reads[sampler_name] += 1
+        return sample
+
+    def publish(self, topic_name, send):
+        """Sample a topic and send its value.
+
+        :param topic_name: Topic to publish.
+        :type topic_name: string
+        :param send: Function to send the topic with, see publish_due.
+        :type send: callable
+
+        """
+        sampler_name, extract = self.topics[topic_name]
+        sample_time, value = self.sample(
+            sampler_name, self.settings[topic_name]["max_age"])
+        if extract is not None:
+            value = extract(value)
+        seq = self.seqs[topic_name]
+        self.seqs[topic_name] = (seq + 1) & 0xFFFFFFFF
+        send(topic_name, seq, sample_time, value)
+        self.stats[topic_name]["published"] += 1
+
+    def get_stats(self):
+        """Get publish counts, overruns and sampler reads.
+
+        :returns: Dict with per-topic stats (published, overruns and
+            max_late in secs.) and reads of each sampler.
+
+        """
+        return {"topics": dict((topic_name, dict(stats)) for topic_name, stats
+                               in self.stats.iteritems()),
+                "sampler_reads": dict(self.sampler_reads)}
 
 
 class PubServer(threading.Thread):
 
     """Publish information about the state of the bot.
 
-    Note that with ZMQ (libzmq) >= 3.0, only topics that are actually
-    subscribed to will be published. In other words, topic filtering
-    happens here, at the publisher. This saves bot resources, so it's
-    strongly suggested that ZMQ >= 3.0 is used.
+    PubServer uses an XPUB socket, which passes on the subscribe and
+    unsubscribe messages of its clients. Only topics that match a live
+    subscription (by prefix, as ZMQ does) are sampled and published, so
+    topics nobody is listening to cost the bot nothing. This needs ZMQ
+    (libzmq) >= 3.0.
+
+    Topics are published on their own schedule, kept in a heap ordered by
+    due time. pub_topics in the config gives each topic (by longest
+    matching prefix) a period, a jitter budget and a max-age:
+
+    - period: Secs. between publishes of the topic.
+    - jitter: Secs. a publish may be early, so topics due close together
+      go out in one wakeup, or late. Publishing later than that is an
+      overrun, counted in get_stats.
+    - max_age: Oldest sample of a shared sampler the topic will publish.
+
+    Topics that come from the same expensive read share a sampler. For
+    example, the four drive_motor_vel_* topics read every drive motor's
+    velocity once, and reuse that sample while it's within max_age.
+
+    Each topic is sent as multipart frames (topic, header, payload) with a
+    per-topic sequence no. and the monotonic time it was sampled at, see
+    lib.telemetry. IR frames and motor vectors go out as NumPy buffers.
+    SubClient decodes them.
 
     The PubServer is a thread, and is meant to be spawned by CtrlServer.
 
@@ -34,11 +285,14 @@ class PubServer(threading.Thread):
     Using ir_cached is an alternative, as it will returned cached IR
     values if the are fresher than some given staleness (defaults to
     one second). This could still cause problems, but it's less likely.
+    Better still, start the IR sampler (ir_hub start_sampler). Then the
+    "ir" topic and the follower share the sampler's acquisition stream,
+    and publishing never touches the I2C bus.
 
     """
 
-    # How often topics are published, in seconds.
-    pub_delay = 1
+    # Longest time to wait for subscription changes, in seconds.
+    max_poll_delay = 1
 
     def __init__(self, systems):
         """Override Thread.__init__, build ZMQ PUB socket.
@@ -62,69 +316,118 @@ class PubServer(threading.Thread):
 
         # Build ZMQ publisher socket
         self.context = zmq.Context()
-        self.pub_sock = self.context.socket(zmq.PUB)
+        self.pub_sock = self.context.socket(zmq.XPUB)
         self.pub_addr = "{protocol}://{host}:{port}".format(
             protocol=self.config["server_protocol"],
             host=self.config["server_bind_host"],
             port=self.config["pub_server_port"])
         self.pub_sock.bind(self.pub_addr)
 
-        # Mapping of published topics to methods that give their value
-        # I know some of these lines are too long. Fuck it, it's clean code.
-        self.topics = {
-            "drive_motor_detail_br": self.driver.motors["back_right"].__str__,
-            "drive_motor_detail_fr": self.driver.motors["front_right"].__str__,
-            "drive_motor_detail_bl": self.driver.motors["back_left"].__str__,
-            "drive_motor_detail_fl": self.driver.motors["front_left"].__str__,
-            "drive_motor_vel_br":
-                self.driver.motors["back_right"].get_velocity,
-            "drive_motor_vel_fr":
-                self.driver.motors["front_right"].get_velocity,
-            "drive_motor_vel_bl":
-                self.driver.motors["back_left"].get_velocity,
-            "drive_motor_vel_fl":
-                self.driver.motors["front_left"].get_velocity,
-            "drive_motor_speed_br":
-                self.driver.motors["back_right"].get_speed,
-            "drive_motor_speed_fr":
-                self.driver.motors["front_right"].get_speed,
-            "drive_motor_speed_bl":
-                self.driver.motors["back_left"].get_speed,
-            "drive_motor_speed_fl":
-                self.driver.motors["front_left"].get_speed,
-            "drive_motor_dir_br":
-                self.driver.motors["back_right"].get_direction,
-            "drive_motor_dir_fr":
-                self.driver.motors["front_right"].get_direction,
-            "drive_motor_dir_bl":
-                self.driver.motors["back_left"].get_direction,
-            "drive_motor_dir_fl":
-                self.driver.motors["front_left"].get_direction,
+        # Mapping of sampler names to methods that read bot state
+        motors = self.driver.motors
+        self.samplers = {
+            "drive_motor_detail_br": motors["back_right"].__str__,
+            "drive_motor_detail_fr": motors["front_right"].__str__,
+            "drive_motor_detail_bl": motors["back_left"].__str__,
+            "drive_motor_detail_fl": motors["front_left"].__str__,
+            # Reads every drive motor's velocity from the DMCCs at once
+            "drive_motor_vel": lambda: dict(
+                (wheel, motors[name].velocity) for wheel, name in (
+                    ("br", "back_right"), ("fr", "front_right"),
+                    ("bl", "back_left"), ("fl", "front_left"))),
+            "drive_motor_speed_br": motors["back_right"].get_speed,
+            "drive_motor_speed_fr": motors["front_right"].get_speed,
+            "drive_motor_speed_bl": motors["back_left"].get_speed,
+            "drive_motor_speed_fl": motors["front_left"].get_speed,
+            "drive_motor_dir_br": motors["back_right"].get_direction,
+            "drive_motor_dir_fr": motors["front_right"].get_direction,
+            "drive_motor_dir_bl": motors["back_left"].get_direction,
+            "drive_motor_dir_fl": motors["front_left"].get_direction,
             "turret_detail": self.gunner.turret.__str__,
             "turret_yaw": self.gunner.turret.get_yaw,
             "turret_pitch": self.gunner.turret.get_pitch,
             # May tieup IRs, bad if line following
             "ir": self.ir_hub.read_all,
+            "ir_frame": self.ir_hub.read_frame,  # 4x8 uint8 array
             "ir_cached": self.ir_hub.read_cached  # May give slightly old data
         }
 
+        # Mapping of published topics to (sampler name, function that gets
+        # the topic's value from the sample or None if it's the whole sample)
+        self.topics = {}
+        for sampler_name in self.samplers:
+            self.topics[sampler_name] = (sampler_name, None)
+        del self.topics["drive_motor_vel"]
+        for wheel in ("br", "fr", "bl", "fl"):
+            self.topics["drive_motor_vel_" + wheel] = \
+                ("drive_motor_vel", itemgetter(wheel))
+        # All four, as a vector in MecDriver.set_wheels order
+        self.topics["drive_motors_vel"] = ("drive_motor_vel", self.vel_vector)
+
+        # Subscriptions, schedule, shared samples and stats
+        self.scheduler = TopicScheduler(
+            self.samplers, self.topics, self.config["pub_topics"])
+
+    @staticmethod
+    def vel_vector(vels):
+        """Get drive motor velocities as an array, in set_wheels order.
+
+        :param vels: Sample of the drive_motor_vel sampler.
+        :type vels: dict
+        :returns: Float array of front_left, front_right, back_left and
+            back_right velocities.
+
+        """
+        return np.array([vels[wheel] for wheel in ("fl", "fr", "bl", "br")],
+                        dtype=float)
+
     def run(self):
-        """Entry point for thread, just publishes topics.
+        """Entry point for thread, publishes subscribed topics.
 
         Note that this overrides Thread.run and is the entry point when
         starting this thread.
 
         """
         while True:
-            # Publish topics
-            sleep(self.pub_delay)
-            self.publish()
-
-    def publish(self):
-        """Publish information about bot."""
-        for topic_name, topic_val in self.topics.iteritems():
-            # FIXME: This always calls every function.
-            # ZMQ will drop any topics that no clients are subscribed to, but
-            # the idea is to prevent these calls from being made in the first
-            # place, which is not happening (painfully obvious now).
-            self.pub_sock.send("{} {}".format(topic_name, topic_val()))
+            self.handle_subscriptions(
+                self.scheduler.time_to_next_pub(self.max_poll_delay))
+            self.scheduler.publish_due(self.send)
+
+    def handle_subscriptions(self, timeout):
+        """Wait for and apply subscribe and unsubscribe messages.
+
+        :param timeout: Longest time to wait for a message, in seconds.
+        :type timeout: float
+
+        """
+        changed = False
+        while self.pub_sock.poll(timeout * 1000):
+            # Only wait for the first message, then drain what's queued
+            timeout = 0
+            if self.scheduler.subscription_changed(self.pub_sock.recv()):
+                changed = True
+        if changed:
+            self.scheduler.update_active_topics()
+
+    def send(self, topic_name, seq, sample_time, value):
+        """Send a sampled topic as multipart frames, see lib.telemetry.
+
+        :param topic_name: Topic to send.
+        :type topic_name: string
+        :param seq: Sequence no. of the message.
+        :type seq: int
+        :param sample_time: Monotonic time the value was sampled at.
+        :type sample_time: float
+        :param value: Value of the topic.
+
+        """
+        self.pub_sock.send_multipart(telemetry.pack_frames(
+            topic_name, seq, sample_time, value), copy=False)
+
+    def get_stats(self):
+        """Get publish counts, overruns and sampler reads.
+
+        :returns: Dict of stats, see TopicScheduler.get_stats.
+
+        """
+        return self.scheduler.get_stats()
@@ -0,0 +1,144 @@
+"""Runs the control loops headless on the simulated course.
+
+Times Follower.analog_state, Follower.recover and Gunner.aim against a
+SimWorld, and reports their loop rates and how the bot moved, so changes
+to the loops can be checked for throughput without the bot.
+
+The loops are tuned for the bot's real speed, so they only track the
+line as they would on the course at a time_scale of 1. Higher scales
+finish sooner, but are for measuring loop timings, not line following.
+--loop_rate runs analog_state faster than its config rate, to find the
+highest rate it keeps up with.
+
+--replay serves the sensors from a log recorded on the course instead,
+see bot/simulator/recording.py, while the motors still drive the world.
+Routines see the same readings as they did on the course, so they
+should make the same decisions, and their loop timings can be compared
+against real field data.
+
+Usage: python -m bot.simulator.benchmark [--time_scale N] [--loop_rate HZ]
+    [--replay LOG] [--replay_speed N] [routine ...]
+"""
+
+import argparse
+from pprint import pprint
+
+import bot.lib.lib as lib
+import bot.simulator.recording as recording
+import bot.simulator.world as sim_world
+from bot.follower.loop_scheduler import LoopScheduler
+
+
+# Pose to aim from, where Gunner.localize gives (0.6, 1.2, 0.0)
+aim_pose = (0.6, 1.2257, 0.0)
+
+
+def build_world(time_scale=None):
+    """Build a world from config and make hardware built after use it.
+
+    :param time_scale: Simulated secs per real sec, from config if None.
+    :type time_scale: float
+    :returns: The installed SimWorld.
+
+    """
+    sim_config = dict(lib.get_config()["simulator"])
+    if time_scale is not None:
+        sim_config["time_scale"] = time_scale
+    world = sim_world.SimWorld(sim_config)
+    sim_world.install(world)
+    return world
+
+
+def run_routine(world, routine, pose=None):
+    """Run a routine from the given pose and time it.
+
+    :param world: World the routine's hardware was built on.
+    :type world: SimWorld
+    :param routine: Function to run, without args.
+    :type routine: callable
+    :param pose: Pose to start from, the start_pose config if None.
+    :type pose: tuple
+    :returns: Dict of result, real and simulated secs taken, distance
+        moved and final pose.
+
+    """
+    world.reset(pose)
+    replayer = recording.get_replayer()
+    if replayer is not None:
+        replayer.start()
+    start_time = lib.monotonic()
+    try:
+        result = routine()
+    except Exception as e:
+        result = "{}: {}".format(e.__class__.__name__, e)
+    secs = lib.monotonic() - start_time
+    pose = world.pose
+    return {"result": result,
+            "secs": secs,
+            "sim_secs": world.now(),
+            "distance": world.distance,
+            "pose": pose}
+
+
+def run_follow(world, loop_rate=None):
+    """Follow the line from the start pose till the follower stops.
+
+    :param loop_rate: Rate of analog_state (Hz), from config if None.
+    :type loop_rate: float
+
+    """
+    import bot.follower.follower as follower_mod
+    follower = follower_mod.Follower()
+    if loop_rate is not None:
+        follower.loop = LoopScheduler(loop_rate)
+    stats = run_routine(world, follower.analog_state)
+    loop_stats = follower.get_loop_stats()
+    stats["loop_rate"] = loop_stats["ticks"] / stats["secs"]
+    stats["loop"] = loop_stats
+    return stats
+
+
+def run_recover(world, loop_rate=None):
+    """Recover from the start pose."""
+    import bot.follower.follower as follower_mod
+    follower = follower_mod.Follower()
+    return run_routine(world, follower.recover)
+
+
+def run_aim(world, loop_rate=None):
+    """Localize and aim from inside the firing box."""
+    import bot.gunner.gunner as gunner_mod
+    gunner = gunner_mod.Gunner()
+    return run_routine(world, gunner.aim, aim_pose)
+
+
+routines = {"follow": run_follow, "recover": run_recover, "aim": run_aim}
+
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(
+        description="Benchmark control loops on the simulated course")
+    argParser.add_argument(
+        'routines', nargs='*', default=["follow", "recover", "aim"],
+        choices=sorted(routines), help="routines to run")
+    argParser.add_argument(
+        '--time_scale', type=float, default=None,
+        help="simulated secs per real sec")
+    argParser.add_argument(
+        '--loop_rate', type=float, default=None,
+        help="rate of the follower's analog_state loop (Hz)")
+    argParser.add_argument(
+        '--replay', default=None,
+        help="sensor log to read the sensors from")
+    argParser.add_argument(
+        '--replay_speed', type=float, default=1.0,
+        help="times faster than real time to replay the log")
+    options = argParser.parse_args()
+
+    world = build_world(options.time_scale)
+    if options.replay is not None:
+        recording.install(
+            replayer=recording.Replayer(options.replay, options.replay_speed))
+    for name in options.routines:
+        print "{}:".format(name)
+        pprint(routines[name](world, options.loop_rate))
@@ -0,0 +1,157 @@
+"""Simulated DMCC boards and PRU, driven by a SimWorld.
+
+They have the same interface as the pyDMCC and pypruss objects the
+hardware classes use, so DMCCMotorSet and Ultrasonic work unchanged on
+top of them. See SimWorld for how they're plugged in.
+
+"""
+
+import struct
+from time import sleep
+
+
+class SimMotor(object):
+
+    """Stands in for a pyDMCC.Motor driving one wheel of a SimWorld.
+
+    Motors reach their speed instantly, with velocity proportional to
+    power. Setting a velocity sets the matching power. Position and the
+    PIDs are kept so they can be read back, but aren't modelled. Motors
+    that aren't on a wheel, like the gun's, spin without moving the bot.
+
+    """
+
+    def __init__(self, world, wheel, sign, latency=0.0, max_velocity=0):
+        """Build motor, stopped.
+
+        :param world: World the wheel is part of.
+        :type world: SimWorld
+        :param wheel: Name of the wheel, see MecDriver.wheel_names, or
+            None if the motor doesn't drive the bot.
+        :type wheel: string
+        :param sign: -1 if the motor is mounted inverted, else 1.
+        :type sign: int
+        :param latency: Simulated duration of one I2C write (secs).
+        :type latency: float
+        :param max_velocity: Velocity read back at power 100.
+        :type max_velocity: float
+
+        """
+        self.world = world
+        self.wheel = wheel
+        self.sign = sign
+        self.latency = latency
+        self.max_velocity = max_velocity
+        self._power = 0
+        self.position = 0
+        self.position_pid = (0, 0, 0)
+        self.velocity_pid = (0, 0, 0)
+
+    @property
+    def power(self):
+        return self._power
+
+    @power.setter
+    def power(self, value):
+        if self.latency:
+            sleep(self.latency)
+        self._power = value
+        if self.wheel is not None:
+            self.world.set_wheel(self.wheel, value * self.sign)
+
+    @property
+    def velocity(self):
+        return self._power * self.max_velocity / 100.0
+
+    @velocity.setter
+    def velocity(self, value):
+        self.power = value * 100.0 / self.max_velocity
+
+
+class SimDMCC(object):
+
+    """Stands in for a pyDMCC.DMCC board with two motors."""
+
+    def __init__(self, cape_num, motors):
+        """Build board.
+
+        :param cape_num: Board number, see dmcc_drive_motors config.
+        :type cape_num: int
+        :param motors: SimMotor for each motor_num (1 and 2).
+        :type motors: dict
+
+        """
+        self.cape_num = cape_num
+        self.motors = motors
+
+    def voltage(self):
+        """Motor supply voltage (volts), always full."""
+        return 12.0
+
+
+class SimPRU(object):
+
+    """Stands in for the pypruss module running the ultrasonic firmware.
+
+    Like the firmware, every frame_period (simulated secs) the pulse time
+    of each sensor is written to mem, then the interrupt is raised twice.
+    wait_for_event sleeps until the next interrupt is due.
+
+    """
+
+    # Longest pulse time the firmware measures (usecs)
+    max_pulse = 25000
+
+    def __init__(self, world, sensors, frame_period):
+        """Build PRU, with its shared memory zeroed.
+
+        :param world: World to measure ranges in.
+        :type world: SimWorld
+        :param sensors: The sensors entry of the ultrasonics config.
+        :type sensors: dict
+        :param frame_period: Time to fire all sensors (simulated secs).
+        :type frame_period: float
+
+        """
+        self.world = world
+        self.sensors = sensors
+        self.frame_period = frame_period
+        self.mem = bytearray(8 * len(sensors))
+        self.next_frame = None
+        self.duplicate_pending = False
+
+    def init(self):
+        pass
+
+    def open(self, event):
+        pass
+
+    def pruintc_init(self):
+        pass
+
+    def exec_program(self, pru_num, pru_file):
+        """Start firing sensors, the first frame is a period from now."""
+        self.next_frame = self.world.now() + self.frame_period
+
+    def wait_for_event(self, event):
+        """Sleep till the next interrupt, writing a frame if it's due."""
+        if self.duplicate_pending:
+            self.duplicate_pending = False
+            return
+        if self.next_frame is None:
+            self.exec_program(None, None)
+        self.world.sleep_until(self.next_frame)
+        self.next_frame += self.frame_period
+        self.write_frame()
+        self.duplicate_pending = True
+
+    def clear_event(self, event, interrupt):
+        pass
+
+    def write_frame(self):
+        """Write the pulse time of every sensor, at the current pose."""
+        ranges = self.world.ranges(self.sensors)
+        for name, sensor in self.sensors.iteritems():
+            pulse = min(int(ranges[name] * self.world.usecs_per_meter),
+                        self.max_pulse)
+            struct.pack_into('I', self.mem, sensor['offset'], pulse)
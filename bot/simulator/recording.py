@@ -0,0 +1,408 @@
+"""Record sensor readings to a log file, and replay them later.
+
+A Recorder appends each IR scan, color sensor read and ultrasonic frame
+to a compact binary log, with the time it was read. A Replayer serves
+the readings of a log back through the same objects, at the speed they
+were recorded at or faster, so runs on the course can be repeated off
+the bone, e.g. to benchmark the follower against real field data.
+
+Hardware classes call attach() when they're built, which hooks them up
+to the recorder or replayer set in the recording config, if any.
+
+The log starts with magic. Each record after that is a stream id byte,
+the time read (lib.monotonic(), a little-endian double) and the stream's
+fixed-size values, see streams. The file is grown in chunks and written
+through mmap, so appending is a copy into memory. The unused end of the
+last chunk is zeros, and a zero stream id marks the end of the records,
+so logs of runs that didn't close their recorder can still be read.
+
+"""
+
+import atexit
+import mmap
+import threading
+from bisect import bisect_right
+from collections import namedtuple
+from struct import Struct
+from time import sleep
+
+import numpy as np
+
+import bot.lib.lib as lib
+
+
+magic = "BOTLOG1\n"
+
+# Record layout of each stream, the values follow the id and time
+Stream = namedtuple("Stream", ["id", "name", "struct"])
+streams = (
+    # IR scan, 8 units of each array in IRHub.frame_order
+    Stream(1, "ir", Struct("<Bd32B")),
+    # ColorSensor.read_data: valid, clear, red, green, blue
+    Stream(2, "color", Struct("<Bd5d")),
+    # Ultrasonic pulse times (usecs), in Ultrasonic.sensor_names order
+    Stream(3, "ultrasonic", Struct("<Bd4I")))
+streams_by_name = dict((stream.name, stream) for stream in streams)
+streams_by_id = dict((stream.id, stream) for stream in streams)
+
+# Recorder and replayer used by attach, see get_recorder and get_replayer
+_recorder = None
+_replayer = None
+
+
+def get_recorder():
+    """Get the recorder hardware should record to, if any.
+
+    Opens the recording config's record_path the first time. It's closed
+    when the process exits.
+
+    :returns: Recorder, or None to not record.
+
+    """
+    global _recorder
+    if _recorder is None:
+        rec_config = lib.get_config().get("recording")
+        if rec_config is not None and rec_config["record_path"]:
+            _recorder = Recorder(rec_config["record_path"])
+            atexit.register(_recorder.close)
+    return _recorder
+
+
+def get_replayer():
+    """Get the replayer hardware should read from, if any.
+
+    Loads the recording config's replay_path the first time, and starts
+    replaying it from then.
+
+    :returns: Replayer, or None to read the sensors.
+
+    """
+    global _replayer
+    if _replayer is None:
+        rec_config = lib.get_config().get("recording")
+        if rec_config is not None and rec_config["replay_path"]:
+            _replayer = Replayer(rec_config["replay_path"],
+                                 rec_config["replay_speed"])
+    return _replayer
+
+
+def install(recorder=None, replayer=None):
+    """Set the recorder and replayer used by hardware built from now on.
+
+    :param recorder: Recorder to use, or None to go back to config.
+    :type recorder: Recorder
+    :param replayer: Replayer to use, or None to go back to config.
+    :type replayer: Replayer
+
+    """
+    global _recorder, _replayer
+    _recorder = recorder
+    _replayer = replayer
+
+
+def attach(device, stream_name):
+    """Hook a sensor up to the configured replayer and recorder.
+
+    :param device: IRHub, ColorSensor or Ultrasonic.
+    :param stream_name: Name of the device's stream, see streams.
+    :type stream_name: string
+
+    """
+    replayer = get_replayer()
+    if replayer is not None:
+        replayer.replay(device, stream_name)
+    recorder = get_recorder()
+    if recorder is not None:
+        recorder.record(device, stream_name)
+
+
+class Recorder(object):
+
+    """Appends timestamped sensor readings to a log file.
+
+    Safe to use from several threads, e.g. the IR sampler and the PRU
+    waiter.
+
+    """
+
+    # Bytes the file is grown by when full
+    chunk_size = 1 << 20
+
+    def __init__(self, path):
+        """Create the log file, replacing any existing one.
+
+        :param path: Path of the log file.
+        :type path: string
+
+        """
+        self.logger = lib.get_logger()
+        self.path = path
+        self.file = open(path, "w+b")
+        self.file.truncate(self.chunk_size)
+        self.mem = mmap.mmap(self.file.fileno(), self.chunk_size)
+        self.mem[:len(magic)] = magic
+        self.offset = len(magic)
+        self.counts = dict((stream.name, 0) for stream in streams)
+        self.lock = threading.Lock()
+        self.logger.info("Recording sensors to {}".format(path))
+
+    def append(self, stream_name, values, read_time=None):
+        """Append a record to the log.
+
+        :param stream_name: Name of the stream, see streams.
+        :type stream_name: string
+        :param values: Values of the record, see the stream's struct.
+        :type values: sequence
+        :param read_time: When the values were read, now if None.
+        :type read_time: float
+
+        """
+        if read_time is None:
+            read_time = lib.monotonic()
+        stream = streams_by_name[stream_name]
+        record = stream.struct.pack(stream.id, read_time, *values)
+        with self.lock:
+            if self.mem is None:
+                return
+            end = self.offset + len(record)
+            if end > len(self.mem):
+                self.mem.resize(len(self.mem) + self.chunk_size)
+            self.mem[self.offset:end] = record
+            self.offset = end
+            self.counts[stream_name] += 1
+
+    def close(self):
+        """Flush the log and trim its unused end."""
+        with self.lock:
+            if self.mem is None:
+                return
+            self.mem.flush()
+            self.mem.close()
+            self.mem = None
+            self.file.truncate(self.offset)
+            self.file.close()
+        self.logger.info("Recorded {} to {}".format(self.counts, self.path))
+
+    def record(self, device, stream_name):
+        """Record every reading the device takes from now on.
+
+        Hooks the method each reading goes through: IRHub.scan (used by
+        read_all, read_frame and the IR sampler), ColorSensor.read_data
+        and Ultrasonic.read_mem (used by read_times and the PRU waiter).
+
+        :param device: IRHub, ColorSensor or Ultrasonic.
+        :param stream_name: Name of the device's stream, see streams.
+        :type stream_name: string
+
+        """
+        getattr(self, "record_" + stream_name)(device)
+
+    def record_ir(self, ir_hub):
+        scan = ir_hub.scan
+
+        def recorded_scan():
+            readings = scan()
+            self.append("ir", [value for name in ir_hub.frame_order
+                               for value in readings[name]])
+            return readings
+        ir_hub.scan = recorded_scan
+
+    def record_color(self, color_sensor):
+        read_data = color_sensor.read_data
+
+        def recorded_read_data(*args, **kwargs):
+            data = read_data(*args, **kwargs)
+            self.append("color", data)
+            return data
+        color_sensor.read_data = recorded_read_data
+
+    def record_ultrasonic(self, ultrasonic):
+        read_mem = ultrasonic.read_mem
+
+        def recorded_read_mem():
+            times = read_mem()
+            self.append("ultrasonic",
+                        [times[name] for name in ultrasonic.sensor_names])
+            return times
+        ultrasonic.read_mem = recorded_read_mem
+
+
+def read_log(path):
+    """Read every record of a log file.
+
+    :param path: Path of the log file.
+    :type path: string
+    :returns: Dict of (times, values) arrays by stream name. times are as
+        recorded, values has a row per record.
+    :raises: ValueError if the file isn't a log.
+
+    """
+    records = dict((stream.name, []) for stream in streams)
+    with open(path, "rb") as log_file:
+        data = log_file.read()
+    if not data.startswith(magic):
+        raise ValueError("{} is not a sensor log".format(path))
+    offset = len(magic)
+    while offset < len(data):
+        stream = streams_by_id.get(ord(data[offset]))
+        if stream is None:
+            # Zeros past the end of the records
+            break
+        if offset + stream.struct.size > len(data):
+            break
+        records[stream.name].append(stream.struct.unpack_from(data, offset))
+        offset += stream.struct.size
+
+    logs = {}
+    for name, rows in records.iteritems():
+        struct = streams_by_name[name].struct
+        num_fields = len(struct.unpack("\0" * struct.size))
+        rows = np.array(rows, dtype=float).reshape(len(rows), num_fields)
+        logs[name] = (rows[:, 1], rows[:, 2:])
+    return logs
+
+
+class Replayer(object):
+
+    """Serves the readings of a log back through the sensor objects.
+
+    The log's clock starts at its first record when the replayer is
+    built or restarted, and runs speed times faster than real time. Each
+    read gets the latest reading recorded at or before the log's current
+    time.
+    Ultrasonic frames are served one by one, each when it was recorded,
+    like the PRU. Once a stream runs out, its last reading is repeated.
+
+    """
+
+    def __init__(self, path, speed=1.0):
+        """Load a log and start replaying it.
+
+        :param path: Path of the log file.
+        :type path: string
+        :param speed: Times faster than real time to replay.
+        :type speed: float
+
+        """
+        self.logger = lib.get_logger()
+        self.speed = float(speed)
+        self.logs = read_log(path)
+        self.times = dict((name, log[0].tolist())
+                          for name, log in self.logs.iteritems())
+        starts = [times[0] for times in self.times.itervalues() if times]
+        if not starts:
+            raise ValueError("{} has no records".format(path))
+        self.log_start = min(starts)
+        self.ends = dict((name, times[-1]) for name, times
+                         in self.times.iteritems() if times)
+        self.logger.info("Replaying {} at {}x: {}".format(
+            path, self.speed, dict((name, len(times)) for name, times
+                                   in self.times.iteritems())))
+        self.start()
+
+    def start(self):
+        """Restart replaying from the first record."""
+        self.real_start = lib.monotonic()
+
+    def now(self):
+        """Get the current time of the log's clock."""
+        return self.log_start + \
+            (lib.monotonic() - self.real_start) * self.speed
+
+    def finished(self):
+        """Check if every record has been replayed."""
+        return self.now() >= max(self.ends.itervalues())
+
+    def latest(self, stream_name):
+        """Get the latest reading recorded at or before now.
+
+        :param stream_name: Name of the stream, see streams.
+        :type stream_name: string
+        :returns: Array of the reading's values.
+        :raises: ValueError if the stream has no records.
+
+        """
+        times = self.times[stream_name]
+        if not times:
+            raise ValueError("No {} records to replay".format(stream_name))
+        index = max(bisect_right(times, self.now()) - 1, 0)
+        return self.logs[stream_name][1][index]
+
+    def wait_for(self, stream_name, index):
+        """Sleep until a record is due, then get it.
+
+        Past the end of the stream, the last record is repeated at the
+        stream's median period.
+
+        :param stream_name: Name of the stream, see streams.
+        :type stream_name: string
+        :param index: Index of the record.
+        :type index: int
+        :returns: Array of the record's values.
+
+        """
+        times = self.times[stream_name]
+        if not times:
+            raise ValueError("No {} records to replay".format(stream_name))
+        if index < len(times):
+            due = times[index]
+        else:
+            period = np.median(np.diff(times)) if len(times) > 1 else 0.1
+            due = times[-1] + (index - len(times) + 1) * period
+            index = len(times) - 1
+        delay = (due - self.now()) / self.speed
+        if delay > 0:
+            sleep(delay)
+        return self.logs[stream_name][1][index]
+
+    def replay(self, device, stream_name):
+        """Serve the device's readings from the log from now on.
+
+        :param device: IRHub, ColorSensor or Ultrasonic.
+        :param stream_name: Name of the device's stream, see streams.
+        :type stream_name: string
+
+        """
+        getattr(self, "replay_" + stream_name)(device)
+
+    def replay_ir(self, ir_hub):
+        num_units = len(ir_hub.reading.values()[0])
+
+        def replayed_scan():
+            frame = self.latest("ir").astype(int).reshape(-1, num_units)
+            ir_hub.reading = dict(zip(ir_hub.frame_order, frame.tolist()))
+            ir_hub.last_read_time = lib.monotonic()
+            ir_hub.scan_stats = {"transactions": 0, "usecs": 0.0}
+            return ir_hub.reading
+        ir_hub.scan = replayed_scan
+
+    def replay_color(self, color_sensor):
+        def replayed_read_data(*args, **kwargs):
+            valid, c, r, g, b = self.latest("color").tolist()
+            return int(valid), c, r, g, b
+        color_sensor.read_data = replayed_read_data
+
+    def replay_ultrasonic(self, ultrasonic):
+        # Frames are served in order, each at its recorded time, starting
+        # from the latest one due at the first wait. Each is followed by a
+        # duplicate interrupt, like the PRU's.
+        state = {"index": None, "frame": None, "duplicate": False}
+
+        def replayed_wait_for_interrupt():
+            if state["duplicate"]:
+                state["duplicate"] = False
+                return
+            if state["index"] is None:
+                state["index"] = max(bisect_right(
+                    self.times["ultrasonic"], self.now()) - 1, 0)
+            state["frame"] = self.wait_for("ultrasonic", state["index"])
+            state["index"] += 1
+            state["duplicate"] = True
+
+        def replayed_read_mem():
+            frame = state["frame"]
+            if frame is None:
+                frame = self.latest("ultrasonic")
+            return dict(zip(ultrasonic.sensor_names, frame.astype(int)))
+        ultrasonic.wait_for_interrupt = replayed_wait_for_interrupt
+        ultrasonic.read_mem = replayed_read_mem
@@ -0,0 +1,356 @@
+"""Simulated course and mecanum bot, for running the control loops headless.
+
+SimWorld models the bot's pose on the course, the lines it follows and
+the course walls. Wheel powers written to its simulated DMCCs move the
+bot with mecanum kinematics. The IR arrays see the lines under each unit
+and the ultrasonics measure the range to the walls, both at the pose at
+the time they're read.
+
+When the simulator is enabled in config, or a world is installed with
+install(), DMCCMotorSet, the IR backends and Ultrasonic talk to the
+world instead of the hardware, through the same interfaces. Bus
+latencies are simulated with sleeps.
+
+The world's clock runs time_scale times faster than real time, so with a
+time_scale over 1 the bot covers the course faster than real time. The
+control loops still run at their real rates, measuring the same loop
+timings they would on the bone, but see time_scale times more motion
+per tick.
+
+"""
+
+import threading
+from math import ceil, sin, cos, radians, degrees
+from time import sleep
+
+import numpy as np
+
+import bot.lib.lib as lib
+from bot.simulator.devices import SimMotor, SimDMCC, SimPRU
+
+
+# World used by the hardware classes, see get_world
+_world = None
+
+
+def get_world():
+    """Get the simulated world hardware should use, if any.
+
+    Builds one from config the first time, if the simulator is enabled.
+
+    :returns: SimWorld, or None to use real hardware.
+
+    """
+    global _world
+    if _world is None:
+        sim_config = lib.get_config().get("simulator")
+        if sim_config is not None and sim_config["enabled"]:
+            _world = SimWorld()
+    return _world
+
+
+def install(world):
+    """Set the world used by hardware built from now on.
+
+    :param world: World to use, or None to go back to config.
+    :type world: SimWorld
+
+    """
+    global _world
+    _world = world
+
+
+class SimWorld(object):
+
+    """Pose of a mecanum bot on a course of lines, moved by its wheels.
+
+    Poses are (x, y, heading) in course coordinates. x and y are in
+    meters from a corner of the course, heading is the direction the bot
+    faces, in degrees counterclockwise from the x axis. Sensor positions
+    and directions are given relative to the bot like the ultrasonics
+    config: x to the right, y forward.
+
+    """
+
+    # Approx. ultrasonic pulse time (usecs) per meter, see Ultrasonic
+    usecs_per_meter = 5877.0
+
+    # Order of arrays (rows) in frames, see IRHub.frame_order
+    ir_arrays = ("front", "back", "left", "right")
+
+    # Direction of each IR array from the center of the bot
+    ir_directions = {"front": (0.0, 1.0), "back": (0.0, -1.0),
+                     "left": (-1.0, 0.0), "right": (1.0, 0.0)}
+
+    def __init__(self, sim_config=None):
+        """Build course, bot and simulated devices from config.
+
+        :param sim_config: Simulator config, the simulator section of the
+            config if None.
+        :type sim_config: dict
+
+        """
+        self.logger = lib.get_logger()
+        self.config = lib.get_config()
+        if sim_config is None:
+            sim_config = self.config["simulator"]
+        self.time_scale = float(sim_config["time_scale"])
+        self.step = sim_config["step"]
+
+        course = self.config["course"]["default"]
+        self.x_size = course["x_size"]
+        self.y_size = course["y_size"]
+        # Line segments, as rows of x1, y1, x2, y2
+        self.lines = np.array(sim_config["lines"], dtype=float)
+        self.line_width = sim_config["line_width"]
+        self.start_pose = tuple(sim_config["start_pose"])
+
+        # Mecanum kinematics
+        self.max_wheel_speed = sim_config["max_wheel_speed"]
+        self.wheel_lever = sim_config["wheel_lever"]
+        self.wheels = dict((name, 0.0) for name in
+                           ("front_left", "front_right", "back_left",
+                            "back_right"))
+
+        # IR arrays
+        ir_config = sim_config["ir"]
+        self.ir_line_value = ir_config["line_value"]
+        self.ir_floor_value = ir_config["floor_value"]
+        self.ir_spot_radius = ir_config["spot_radius"]
+        self.ir_units = self.build_ir_units(
+            ir_config["array_offset"], ir_config["unit_spacing"],
+            self.config["irs_per_array"])
+        adc_config = self.config["ir_analog_adc_config"]
+        self.ir_addrs = dict((addr, name) for name, addr
+                             in adc_config["i2c_addr"].iteritems())
+        registers = adc_config["i2c_registers"]
+        self.ir_cmds = [registers[ch]["cmd"] for ch in sorted(registers)]
+        self.i2c_latency = sim_config["i2c_latency"]
+
+        # Devices
+        self.dmcc_latency = sim_config["dmcc_latency"]
+        self.motor_max_velocity = sim_config["motor_max_velocity"]
+        self.pru = SimPRU(self, self.config["ultrasonics"]["sensors"],
+                          sim_config["us_frame_period"])
+
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, pose=None):
+        """Stop the bot and put it at the given pose.
+
+        :param pose: Tuple of x, y (meters) and heading (degrees), the
+            start_pose config if None.
+        :type pose: tuple
+
+        """
+        if pose is None:
+            pose = self.start_pose
+        with self.lock:
+            self.x, self.y, self.heading = map(float, pose)
+            for name in self.wheels:
+                self.wheels[name] = 0.0
+            self.distance = 0.0
+            self.real_start = lib.monotonic()
+            self.sim_time = 0.0
+        # Restart the PRU's frames on the new clock, rather than waiting
+        # till the old clock's next frame comes around
+        self.pru.next_frame = None
+        self.pru.duplicate_pending = False
+
+    def now(self):
+        """Get the simulated time (secs since reset)."""
+        return (lib.monotonic() - self.real_start) * self.time_scale
+
+    def sleep_until(self, sim_time):
+        """Sleep in real time until the given simulated time."""
+        delay = (sim_time - self.now()) / self.time_scale
+        if delay > 0:
+            sleep(delay)
+
+    @property
+    def pose(self):
+        """Current pose of the bot, as a tuple of x, y and heading."""
+        with self.lock:
+            self.update()
+            return self.x, self.y, self.heading
+
+    def update(self):
+        """Move the bot up to now, with the wheel powers since last update.
+
+        Must hold self.lock.
+
+        """
+        now = self.now()
+        elapsed = now - self.sim_time
+        self.sim_time = now
+        if elapsed <= 0:
+            return
+        wheels = self.wheels
+        speed = self.max_wheel_speed / 100.0
+        forward = (wheels["front_left"] + wheels["front_right"] +
+                   wheels["back_left"] + wheels["back_right"]) * speed / 4
+        right = (-wheels["front_left"] + wheels["front_right"] +
+                 wheels["back_left"] - wheels["back_right"]) * speed / 4
+        turn = (-wheels["front_left"] + wheels["front_right"] -
+                wheels["back_left"] + wheels["back_right"]) * speed / \
+            (4 * self.wheel_lever)
+        if forward == right == turn == 0:
+            return
+
+        steps = int(ceil(elapsed / self.step))
+        dt = elapsed / steps
+        heading = radians(self.heading)
+        for i in xrange(steps):
+            # Integrate at the middle of each step's turn
+            mid = heading + turn * dt / 2
+            self.x += (forward * cos(mid) + right * sin(mid)) * dt
+            self.y += (forward * sin(mid) - right * cos(mid)) * dt
+            heading += turn * dt
+        self.heading = degrees(heading) % 360
+        self.distance += np.hypot(forward, right) * elapsed
+
+    def set_wheel(self, wheel, power):
+        """Set the power of a wheel, positive drives the bot forward.
+
+        :param wheel: Name of the wheel, see MecDriver.wheel_names.
+        :type wheel: string
+        :param power: Wheel power [-100, 100].
+        :type power: float
+
+        """
+        with self.lock:
+            self.update()
+            self.wheels[wheel] = float(power)
+
+    def to_course(self, points):
+        """Convert points relative to the bot to course coordinates.
+
+        Must hold self.lock.
+
+        :param points: Nx2 array of x (right) and y (forward), in meters.
+        :returns: Nx2 array of course x and y.
+
+        """
+        heading = radians(self.heading)
+        forward = np.array([cos(heading), sin(heading)])
+        right = np.array([sin(heading), -cos(heading)])
+        return np.array([self.x, self.y]) + \
+            points[:, :1] * right + points[:, 1:] * forward
+
+    def build_ir_units(self, offset, spacing, num_units):
+        """Get the position of every IR unit, relative to the bot.
+
+        Units are numbered from the right to the left of each array, as
+        seen looking out from the bot, which is how the follower reads
+        them.
+
+        :returns: Dict of num_units x 2 array of unit positions, by array.
+
+        """
+        lateral = (np.arange(num_units) - (num_units - 1) / 2.0) * spacing
+        units = {}
+        for name, (dir_x, dir_y) in self.ir_directions.iteritems():
+            # Left of an array, looking out from the bot
+            left_x, left_y = -dir_y, dir_x
+            units[name] = np.column_stack((
+                offset * dir_x + lateral * left_x,
+                offset * dir_y + lateral * left_y))
+        return units
+
+    def line_distances(self, points):
+        """Get the distance from each point to the nearest line.
+
+        :param points: Nx2 array of course coordinates.
+        :returns: Array of N distances (meters).
+
+        """
+        starts = self.lines[:, :2]
+        vectors = self.lines[:, 2:] - starts
+        lengths = np.maximum((vectors ** 2).sum(axis=1), 1e-12)
+        # Points by lines by xy, offset from the start of each line
+        offsets = points[:, np.newaxis, :] - starts[np.newaxis, :, :]
+        along = np.clip((offsets * vectors).sum(axis=2) / lengths, 0, 1)
+        nearest = offsets - along[:, :, np.newaxis] * vectors
+        return np.sqrt((nearest ** 2).sum(axis=2)).min(axis=1)
+
+    def ir_readings(self, name):
+        """Get what each unit of an IR array reads, at the current pose.
+
+        Units fully over a line read line_value, units clear of any line
+        read floor_value, and units over an edge read in between.
+
+        :param name: Name of the array.
+        :type name: string
+        :returns: List of readings (0-255), by unit.
+
+        """
+        with self.lock:
+            self.update()
+            points = self.to_course(self.ir_units[name])
+        distances = self.line_distances(points)
+        coverage = np.clip(
+            (self.line_width / 2 + self.ir_spot_radius - distances) /
+            (2 * self.ir_spot_radius), 0, 1)
+        readings = self.ir_floor_value + \
+            (self.ir_line_value - self.ir_floor_value) * coverage
+        return readings.astype(int).tolist()
+
+    def ir_values(self, addr):
+        """Get the ADC channel values of an IR array, at the current pose.
+
+        :param addr: I2C address of the array's ADC.
+        :type addr: int
+        :returns: Dict of (addr, cmd) to reading, see SimulatedBackend.
+
+        """
+        readings = self.ir_readings(self.ir_addrs[addr])
+        return dict(((addr, cmd), reading)
+                    for cmd, reading in zip(self.ir_cmds, readings))
+
+    def ranges(self, sensors):
+        """Get the range to the course walls of each ultrasonic sensor.
+
+        :param sensors: The sensors entry of the ultrasonics config.
+        :type sensors: dict
+        :returns: Dict of range from each sensor (meters), by name.
+
+        """
+        names = list(sensors)
+        origins = np.array([sensors[name]["xy"] for name in names],
+                           dtype=float)
+        directions = np.array([sensors[name]["dir"] for name in names],
+                              dtype=float)
+        with self.lock:
+            self.update()
+            starts = self.to_course(origins)
+            ends = self.to_course(origins + directions)
+        directions = ends - starts
+        # Range to the far wall along each axis, ignoring parallel ones
+        with np.errstate(divide="ignore", invalid="ignore"):
+            walls = np.where(directions > 0,
+                             np.array([self.x_size, self.y_size]), 0.0)
+            ranges = (walls - starts) / directions
+        ranges[~np.isfinite(ranges) | (ranges < 0)] = np.inf
+        return dict(zip(names, np.maximum(ranges.min(axis=1), 0.0)))
+
+    def build_dmccs(self, motor_config):
+        """Build a SimDMCC for each board in a motor config.
+
+        Motors named after a drive wheel drive that wheel of the bot.
+        Others, like the gun's, don't move the bot.
+
+        :param motor_config: Motor config, like dmcc_drive_motors.
+        :type motor_config: dict
+        :returns: Dict of SimDMCC, by board_num.
+
+        """
+        boards = {}
+        for name, conf in motor_config.iteritems():
+            wheel = name if name in self.wheels else None
+            sign = -1 if conf.get("invert", False) else 1
+            boards.setdefault(conf["board_num"], {})[conf["motor_num"]] = \
+                SimMotor(self, wheel, sign, self.dmcc_latency,
+                         self.motor_max_velocity)
+        return dict((board_num, SimDMCC(board_num, motors))
+                    for board_num, motors in boards.iteritems())
@@ -0,0 +1,146 @@
+"""Replays recorded frames through each TargetLocator detection mode.
+
+Reports the frame rate of each mode, how often each finds the target and
+how often fast mode agrees with robust mode, so changes to detection can
+be checked against real camera footage without the bot.
+
+Usage: python -m bot.vision.benchmark <video file or image directory>
+"""
+
+import os
+import argparse
+from time import time
+
+import numpy as np
+import cv2
+
+from bot.vision.targeting import TargetLocator
+
+
+image_exts = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+def load_frames(source, max_frames=None):
+    """Load recorded frames from a video file or a directory of images.
+
+    :param source: Video file, or directory of images (read in name order).
+    :type source: string
+    :param max_frames: Max no. of frames to load, None for all.
+    :type max_frames: int
+    :returns: List of BGR frames.
+
+    """
+    if os.path.isdir(source):
+        names = sorted(name for name in os.listdir(source)
+                       if os.path.splitext(name)[1].lower() in image_exts)
+        return [cv2.imread(os.path.join(source, name))
+                for name in names[:max_frames]]
+
+    frames = []
+    capture = cv2.VideoCapture(source)
+    while max_frames is None or len(frames) < max_frames:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+def run_mode(frames, mode):
+    """Detect the target in each frame with the given mode.
+
+    :param frames: BGR frames, all the same size.
+    :type frames: list
+    :param mode: One of TargetLocator.modes.
+    :type mode: string
+    :returns: List of locations (None where not found), and secs taken.
+
+    """
+    locator = TargetLocator(None, mode)
+    height, width = frames[0].shape[:2]
+    locator.offset = np.float32([width / 2.0, height / 2.0])
+
+    locations = []
+    start_time = time()
+    for frame in frames:
+        location = locator.process_frame(frame)
+        locations.append(None if location is None else location.copy())
+    secs = time() - start_time
+    stats = locator.get_stats()
+    print "{:>6}: {:.2f}ms avg, {:.2f}ms max, {} buffer bytes allocated".\
+        format(mode, stats["avg_ms"], stats["max_ms"],
+               stats["bytes_allocated"])
+    return locations, secs
+
+
+def compare(fast, robust, tolerance):
+    """Compare the locations found by each mode, frame by frame.
+
+    :param fast: Locations found by fast mode.
+    :param robust: Locations found by robust mode.
+    :param tolerance: Max distance (pixels) between agreeing locations.
+    :returns: Dict of agreement stats.
+
+    """
+    agreed = 0
+    distances = []
+    for fast_loc, robust_loc in zip(fast, robust):
+        if fast_loc is None or robust_loc is None:
+            if fast_loc is None and robust_loc is None:
+                agreed += 1
+            continue
+        distance = np.linalg.norm(fast_loc - robust_loc)
+        distances.append(distance)
+        if distance <= tolerance:
+            agreed += 1
+    return {"agreement": agreed / float(len(fast)),
+            "both_found": len(distances),
+            "mean_distance": np.mean(distances) if distances else 0.0,
+            "max_distance": np.max(distances) if distances else 0.0}
+
+
+def run_benchmark(frames, tolerance=5.0):
+    """Replay frames through each mode and print fps and agreement.
+
+    :param frames: BGR frames, all the same size.
+    :type frames: list
+    :param tolerance: Max distance (pixels) between agreeing locations.
+    :type tolerance: float
+    :returns: Dict of stats.
+
+    """
+    results = {}
+    for mode in TargetLocator.modes:
+        locations, secs = run_mode(frames, mode)
+        found = sum(1 for location in locations if location is not None)
+        results[mode] = locations
+        print "{:>6}: {:7.1f} fps, found target in {}/{} frames".format(
+            mode, len(frames) / secs, found, len(frames))
+
+    stats = compare(results["fast"], results["robust"], tolerance)
+    print ("Agreement: {:.1%} (within {}px), both found: {}, "
+           "distance mean: {:.2f}px, max: {:.2f}px").format(
+        stats["agreement"], tolerance, stats["both_found"],
+        stats["mean_distance"], stats["max_distance"])
+    return stats
+
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(
+        description="Benchmark TargetLocator modes on recorded frames")
+    argParser.add_argument(
+        'source', help="recorded video file or directory of images")
+    argParser.add_argument(
+        '--max_frames', type=int, default=None, help="no. of frames to use")
+    argParser.add_argument(
+        '--tolerance', type=float, default=5.0,
+        help="max distance (pixels) between agreeing locations")
+    options = argParser.parse_args()
+
+    frames = load_frames(options.source, options.max_frames)
+    if not frames:
+        argParser.error("No frames in {}".format(options.source))
+    print "Replaying {} frames of {}x{}".format(
+        len(frames), frames[0].shape[1], frames[0].shape[0])
+    run_benchmark(frames, options.tolerance)
@@ -0,0 +1,145 @@
+"""Background camera capture and detection threads.
+
+Camera drivers queue frames, so a reader that falls behind gets stale
+images. FrameGrabber reads frames continuously on its own thread and
+keeps only the newest one. DetectionWorker runs detection on each new
+frame on another thread, so capturing the next frame overlaps with
+processing the current one.
+
+Both publish each new value through a lib.latest.Latest, so readers get
+the latest in O(1) without locks, and can block until a newer one
+arrives.
+
+"""
+
+import threading
+from collections import namedtuple
+
+import bot.lib.lib as lib
+from bot.lib.latest import Latest
+
+
+# Frame read by FrameGrabber, time is lib.monotonic() when it was read
+FrameSnapshot = namedtuple("FrameSnapshot", ["seq", "time", "frame"])
+
+# Detection result, with the seq and time of the frame it came from
+Detection = namedtuple("Detection", ["seq", "time", "result"])
+
+
+class FrameGrabber(threading.Thread):
+
+    """Read camera frames continuously, keeping only the newest.
+
+    Each frame is read into a new array and never modified after it's
+    published, so readers can keep using a frame while newer ones come in.
+
+    """
+
+    retry_delay = 0.01  # secs to wait after a failed read
+
+    def __init__(self, capture):
+        """Build grabber thread. Call start() to begin capturing.
+
+        :param capture: Opened video capture. Only this thread may read
+            from it while the grabber is running.
+        :type capture: cv2.VideoCapture
+
+        """
+        threading.Thread.__init__(self, name="FrameGrabber")
+        # Don't block the process from exiting
+        self.daemon = True
+
+        self.logger = lib.get_logger()
+        self.capture = capture
+        self.frames = Latest()
+        self.frames_read = 0
+        self.read_failures = 0
+        self.stop_event = threading.Event()
+
+    def run(self):
+        """Entry point for thread, reads frames until stop() is called."""
+        self.logger.info("Frame grabber running")
+        while not self.stop_event.is_set():
+            ok, frame = self.capture.read()
+            if not ok:
+                self.read_failures += 1
+                self.stop_event.wait(self.retry_delay)
+                continue
+            self.frames_read += 1
+            self.frames.publish(
+                FrameSnapshot(self.frames_read, lib.monotonic(), frame))
+        self.logger.info("Frame grabber stopped")
+
+    def get_frame(self):
+        """Get the newest frame, or None if none has been read yet."""
+        return self.frames.snapshot
+
+    def wait_for_frame(self, after_seq=0, timeout=None):
+        """Wait for a frame newer than the given sequence number.
+
+        :returns: Newer FrameSnapshot, or None if timeout expired first.
+
+        """
+        return self.frames.wait(after_seq, timeout)
+
+    def stop(self):
+        """Ask the grabber thread to exit after its current read."""
+        self.stop_event.set()
+
+
+class DetectionWorker(threading.Thread):
+
+    """Run detection on each new frame from a FrameGrabber.
+
+    Frames that arrive while a detection is running are skipped, so
+    results are always for the newest frame available.
+
+    """
+
+    poll_timeout = 0.1  # secs between checks for stop() while idle
+
+    def __init__(self, grabber, detect):
+        """Build worker thread. Call start() to begin detecting.
+
+        :param grabber: Source of frames.
+        :type grabber: FrameGrabber
+        :param detect: Function called with each frame, returns a result.
+            Only this thread may call it while the worker is running.
+        :type detect: callable
+
+        """
+        threading.Thread.__init__(self, name="DetectionWorker")
+        self.daemon = True
+
+        self.logger = lib.get_logger()
+        self.grabber = grabber
+        self.detect = detect
+        self.detections = Latest()
+        self.frames_processed = 0
+        self.stop_event = threading.Event()
+
+    def run(self):
+        """Entry point for thread, detects until stop() is called."""
+        last_seq = 0
+        while not self.stop_event.is_set():
+            snapshot = self.grabber.wait_for_frame(last_seq,
+                                                   self.poll_timeout)
+            if snapshot is None:
+                continue
+            last_seq = snapshot.seq
+            result = self.detect(snapshot.frame)
+            self.frames_processed += 1
+            self.detections.publish(
+                Detection(snapshot.seq, snapshot.time, result))
+
+    def wait_for_detection(self, after_seq=0, timeout=None):
+        """Wait for a detection on a frame newer than the given one.
+
+        :returns: Newer Detection, or None if timeout expired first.
+
+        """
+        return self.detections.wait(after_seq, timeout)
+
+    def stop(self):
+        """Ask the worker thread to exit after its current detection."""
+        self.stop_event.set()
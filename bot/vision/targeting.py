@@ -8,11 +8,12 @@ Can open a window to display detected target; this is disabled by default.
 
 import sys
 import argparse
+from time import time
 import numpy as np
 import cv2
-import cv
 
 import bot.lib.lib as lib
+from bot.vision.camera import FrameGrabber, DetectionWorker
 
 
 # TODO: Remove these parameter definitions as they are already in cv2 or cv2.cv
@@ -72,6 +73,40 @@ def angle_cos(p0, p1, p2):
     return abs(np.dot(d1, d2) / np.sqrt(np.dot(d1, d1) * np.dot(d2, d2)))
 
 
+def square_quads(quads, min_area, max_cos=0.1):
+    """Pick out the quadrilaterals that look like squares, all at once.
+
+    Applies the same tests as TargetLocator.find_squares (area, convexity
+    and corner angles, see angle_cos), vectorized over all candidates.
+
+    :param quads: Nx4x2 array of quad vertices, in contour order.
+    :param min_area: Minimum pixel area of a square.
+    :param max_cos: Maximum cosine of any corner angle.
+    :returns: Boolean array, True for each quad that looks like a square.
+
+    """
+    pts = quads.astype('float')
+    nxt = np.roll(pts, -1, axis=1)  # vertex i+1
+    nxt2 = np.roll(pts, -2, axis=1)  # vertex i+2
+
+    # Shoelace formula, same as cv2.contourArea for a polygon
+    area = np.abs(np.sum(
+        pts[:, :, 0] * nxt[:, :, 1] - nxt[:, :, 0] * pts[:, :, 1],
+        axis=1)) / 2
+
+    # Edges into and out of each corner (at vertex i+1)
+    d1, d2 = pts - nxt, nxt2 - nxt
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cos = np.abs(np.sum(d1 * d2, axis=2)) / np.sqrt(
+            np.sum(d1 * d1, axis=2) * np.sum(d2 * d2, axis=2))
+    # Convex if every corner turns the same way
+    cross = d1[:, :, 0] * d2[:, :, 1] - d1[:, :, 1] * d2[:, :, 0]
+    convex = np.all(cross > 0, axis=1) | np.all(cross < 0, axis=1)
+
+    # Degenerate corners have nan cosines, which fail the comparison
+    return (area > min_area) & convex & (np.max(cos, axis=1) < max_cos)
+
+
 class TargetLocator(object):
     """A visual target locator for IEEE SECon 2014 hardware comp."""
 
@@ -79,9 +114,15 @@ class TargetLocator(object):
     default_width, default_height = (320, 240)  # default image size
     default_auto_exposure = 5.0  # NOTE: needs to be calibrated
 
+    # Detection modes:
+    # - fast: find squares in the red mask, with one contour extraction
+    # - robust: find squares in every color plane at many thresholds
+    modes = ("fast", "robust")
+    default_mode = "robust"
+
     min_contour_area = 1000  # minimum pixel area contours to be considered
 
-    def __init__(self, device=default_device):
+    def __init__(self, device=default_device, mode=default_mode):
         # * Load system configuration
         self.config = lib.get_config()
 
@@ -97,10 +138,42 @@ class TargetLocator(object):
         self.auto_exposure = 1.0
 
         # ** Image processing
+        self.mode = None
+        self.set_mode(mode)
         self.imageIn = None  # input image
         self.res = None  # result/output image (TODO: use separate imageOut)
         self.squares = []  # list of squares found
 
+        # *** Red color ranges in HSV, as (lower, upper) bounds
+        # Working ranges: [0 64 55]-[12 255 255] and [169 64 55]-[179 255 255]
+        # See wiki to see what the values mean.
+        # Basically, changing the first element changes the RED limit
+        # If red values look unsatisfactory, there are two thing you could do:
+        # 1. Extend RED range.
+        #   Increase the first element of the first range's upper bound
+        #   (the default is 12) or (and) decrease first element of the
+        #   second range's lower bound.
+        # 2. To compensate for lighting effect, decrease the last element of
+        #   both lower bounds.
+        self.red_ranges = [
+            (np.array(lower, dtype=np.uint8), np.array(upper, dtype=np.uint8))
+            for lower, upper in self.config["target_locator"]["red_ranges"]]
+
+        # *** Buffers, allocated once per frame size by allocate_buffers
+        self.frame = None  # last camera frame, the next is read into it
+        self.hsv = None
+        self.range_mask = None  # pixels in one red range
+        self.red_mask = None  # pixels in any red range
+        self.mask = None  # red mask, morphology-closed
+        self.contour_input = None  # copy of mask, findContours modifies it
+        self.blurred = None
+
+        # *** Stats, see get_stats
+        self.frames_processed = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.bytes_allocated = 0  # by allocate_buffers
+
         # *** Morphology kernel
         self.kernel_rect = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
         self.kernel_fat_cross = np.uint8([
@@ -123,6 +196,12 @@ class TargetLocator(object):
         self.kernel = self.kernel_inv_cross  # pick kernel that works best
         self.logger.debug("Morph. kernel: {}".format(self.kernel))
 
+        # ** Capture threads, see start_capture_threads
+        self.grabber = None
+        self.detector = None
+        self.last_detection_seq = 0  # frame no. of last detection used
+        self.detection_timeout = 1.0  # max secs to wait for a detection
+
         # ** Misc
         self.do_cast_contours = (cv2.__version__ == "2.4.3")  # bug workaround
         self.refinement_skip_samples = 5  # no. of camera samples to skip
@@ -132,7 +211,9 @@ class TargetLocator(object):
         # ** Final output
         self.location = None  # target location
 
-        # Open default input device (camera)
+        # Open default input device (camera), unless frames will be given
+        if device is None:
+            return
         if self.open_device(device):
             self.logger.info("Opened device: {}".format(device))
         else:
@@ -143,37 +224,74 @@ class TargetLocator(object):
         self.set_auto_exposure()  # use defaults
 
     def open_device(self, device=0):
-        # Open input device [API: cv]
-        self.capture = cv.CaptureFromCAM(device)  # NOTE: won't work with files
+        # Open input device (camera no. or recorded video file) [API: cv2]
+        self.capture = cv2.VideoCapture(device)
+        if not self.capture.isOpened():
+            self.capture = None
         return self.capture is not None
 
     def close_device(self):
+        if self.capture is not None:
+            self.capture.release()
         self.capture = None
-        # del self.capture  # NOTE: is this required?
 
     def get_frame_size(self):
         return self.width, self.height  # NOTE: query device?
 
     def set_frame_size(self, width=default_width, height=default_height):
-        # Set camera frame size [API: cv]
+        # Set camera frame size [API: cv2]
         if self.capture is not None:
             self.width = width
             self.height = height
-            cv.SetCaptureProperty(
-                self.capture, CV_CAP_PROP_FRAME_WIDTH, self.width)
-            cv.SetCaptureProperty(
-                self.capture, CV_CAP_PROP_FRAME_HEIGHT, self.height)
+            self.capture.set(CV_CAP_PROP_FRAME_WIDTH, self.width)
+            self.capture.set(CV_CAP_PROP_FRAME_HEIGHT, self.height)
             self.offset = np.float32([self.width / 2.0, self.height / 2.0])
 
+    def get_mode(self):
+        return self.mode
+
+    def set_mode(self, mode=default_mode):
+        """Set detection mode, one of TargetLocator.modes."""
+        if mode not in self.modes:
+            raise ValueError("Unknown detection mode: {}".format(mode))
+        self.mode = mode
+
     def get_auto_exposure(self):
         return self.auto_exposure  # NOTE: query device?
 
     def set_auto_exposure(self, value=default_auto_exposure):
-        # Set camera's auto-exposure value [API: cv]
+        # Set camera's auto-exposure value [API: cv2]
         if self.capture is not None:
             self.auto_exposure = value
-            cv.SetCaptureProperty(
-                self.capture, CV_CAP_PROP_AUTO_EXPOSURE, self.auto_exposure)
+            self.capture.set(CV_CAP_PROP_AUTO_EXPOSURE, self.auto_exposure)
+
+    def start_capture_threads(self):
+        """Capture and detect continuously on background threads.
+
+        Once started, find_target returns the detection on the newest
+        frame instead of reading the camera itself, so frames are never
+        stale and the next frame is captured while one is processed.
+
+        """
+        if self.capture is None or self.grabber is not None:
+            return False
+        self.grabber = FrameGrabber(self.capture)
+        self.detector = DetectionWorker(self.grabber, self.process_frame)
+        self.grabber.start()
+        self.detector.start()
+        return True
+
+    def stop_capture_threads(self):
+        """Stop background capture, go back to reading on demand."""
+        if self.grabber is None:
+            return False
+        self.detector.stop()
+        self.grabber.stop()
+        self.detector.join()
+        self.grabber.join()
+        self.detector = None
+        self.grabber = None
+        return True
 
     # TODO: @lib.api_call?
     def find_target_refined(self):
@@ -181,14 +299,16 @@ class TargetLocator(object):
         if self.capture is None:
             return self.location  # no input, can't do anything!
 
-        # Skip some frames
-        for i in xrange(self.refinement_skip_samples):
-            img = cv.QueryFrame(self.capture)  # skip
+        # Skip some frames (grab without decoding), unless capture threads
+        # are running, which only ever give fresh frames
+        if self.detector is None:
+            for i in xrange(self.refinement_skip_samples):
+                self.capture.grab()  # skip
 
         # Read till at least a threshold number are good
         best_location = None
         num_good = 0
-        for i in xrange(self.refinement_skip_samples):
+        for i in xrange(self.refinement_num_samples):
             location = self.find_target()
             if location is not None:
                 best_location = location
@@ -209,80 +329,118 @@ class TargetLocator(object):
         if self.capture is None:
             return self.location  # no input, can't do anything!
 
-        # Capture camera frame [API: cv]
-        img = cv.QueryFrame(self.capture)
-        self.imageIn = np.asarray(img[:, :], dtype=np.uint8)
-        # TODO: check cv to cv2 conversion; use cv2 API from here on?
+        if self.detector is not None:
+            # Wait for the detection on a frame we haven't used yet
+            detection = self.detector.wait_for_detection(
+                self.last_detection_seq, self.detection_timeout)
+            if detection is None:
+                self.logger.warning("No new frame detected")
+                return None
+            self.last_detection_seq = detection.seq
+            location = detection.result
+        else:
+            # Capture camera frame into the reused buffer [API: cv2]
+            ok, frame = self.capture.read(self.frame)
+            if not ok:
+                self.logger.warning("Failed to read frame")
+                return None
+            self.frame = frame
+            location = self.process_frame(frame)
+        if location is not None:
+            self.logger.info(
+                "Target @ (%6.2f, %6.2f)", location[0], location[1])
+        return location
+
+    def process_frame(self, frame):
+        """Find target location in given BGR frame (camera or recorded)."""
+        start_time = time()
+        if self.hsv is None or self.hsv.shape != frame.shape:
+            self.allocate_buffers(frame.shape)
+        self.imageIn = frame
 
         # Call appropriate internal work-horse method
-        self._find_target_squares(img)
-        if self.location is not None:
-            self.logger.info(
-                "Target @ (%6.2f, %6.2f)", self.location[0], self.location[1])
+        self._find_target_squares(frame)
+
+        duration = time() - start_time
+        self.frames_processed += 1
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
 
         # Return location (NOTE: must be set by internal method)
         return self.location
 
-    def _find_target_squares(self, img):
+    def allocate_buffers(self, shape):
+        """Allocate intermediate images for frames of the given shape.
+
+        Called on the first frame and when the frame size changes, so
+        processing a frame normally allocates no image memory.
+
+        """
+        height, width = shape[:2]
+        self.hsv = np.empty((height, width, 3), dtype=np.uint8)
+        self.res = np.empty((height, width, 3), dtype=np.uint8)
+        self.blurred = np.empty((height, width, 3), dtype=np.uint8)
+        self.range_mask = np.empty((height, width), dtype=np.uint8)
+        self.red_mask = np.empty((height, width), dtype=np.uint8)
+        self.mask = np.empty((height, width), dtype=np.uint8)
+        self.contour_input = np.empty((height, width), dtype=np.uint8)
+        self.bytes_allocated += sum(buf.nbytes for buf in (
+            self.hsv, self.res, self.blurred, self.range_mask,
+            self.red_mask, self.mask, self.contour_input))
+        self.logger.debug("Allocated buffers for %dx%d frames", width, height)
+
+    def get_stats(self):
+        """Get no. of frames processed, latency and buffer bytes allocated.
+
+        Only the intermediate image buffers are counted, which are
+        allocated on the first frame and when the frame size changes.
+        buffer_bytes_amortized spreads that over the frames processed, it
+        doesn't include temporaries OpenCV allocates within a frame.
+
+        """
+        frames = max(self.frames_processed, 1)
+        return {"frames": self.frames_processed,
+                "avg_ms": self.total_time * 1000 / frames,
+                "max_ms": self.max_time * 1000,
+                "bytes_allocated": self.bytes_allocated,
+                "buffer_bytes_amortized": self.bytes_allocated / frames}
+
+    def _find_target_squares(self, frame):
         """Find target location using the squares method."""
-        # Create compatible intermediate images
-        col_edge = cv.CreateImage((img.width, img.height), 8, 3)
-        dst = cv.CreateImage(cv.GetSize(img), 8, 1)
-        color_dst = cv.CreateImage(cv.GetSize(img), 8, 3)
-        storage = cv.CreateMemStorage(0)
-
-        # Convert to grayscale
-        gray = cv.CreateImage((img.width, img.height), 8, 1)
-        edge = cv.CreateImage((img.width, img.height), 8, 1)
-        hsv = cv2.cvtColor(np.asarray(img[:, :]), cv2.COLOR_BGR2HSV)
-        # NOTE: This converts from cv-style image to cv2-style image
-
-        # TODO: Move the following block to __init__()
-        # Define range of Red color in HSV
-        # working Range [0 64 55], [24 255 255] and [163 64 55] [179 255 255]
-        # See wiki to see what the values mean.
-        # Basically, changing the first element changes the RED limit
-
-        # If red values look unsatisfactory, there are two thing you could do:
-        # 1. Extend RED range.
-        #   Increase the value of the first element in upper_red array
-        #   (the default is 12) or (and) decrease first element in lower_red1.
-        # 2. To compensate for lighting effect, decrease the last element of
-        #   lower_red and lower_red1 array.
-
-        lower_red = np.array([0, 64, 55], dtype=np.uint8)
-        upper_red = np.array([12, 255, 255], dtype=np.uint8)
-
-        lower_red1 = np.array([169, 64, 55], dtype=np.uint8)
-        upper_red1 = np.array([179, 255, 255], dtype=np.uint8)
-
-        # Threshold the image to get only Red color
-        mask1 = cv2.inRange(hsv, lower_red, upper_red)
-        mask2 = cv2.inRange(hsv, lower_red1, upper_red1)
-
-        # Perform an OR operation to get the FINAL MASK, morph to smooth
-        mask3 = np.bitwise_or(mask1, mask2)
-        mask = cv2.morphologyEx(mask3, cv2.MORPH_CLOSE, self.kernel)
+        # Convert to HSV, into preallocated buffers from here on
+        cv2.cvtColor(frame, cv2.COLOR_BGR2HSV, dst=self.hsv)
+
+        # Threshold the image to get only Red color, OR-ing all ranges
+        for i, (lower, upper) in enumerate(self.red_ranges):
+            if i == 0:
+                cv2.inRange(self.hsv, lower, upper, dst=self.red_mask)
+            else:
+                cv2.inRange(self.hsv, lower, upper, dst=self.range_mask)
+                cv2.bitwise_or(self.red_mask, self.range_mask,
+                               dst=self.red_mask)
+
+        # Morph to smooth, to get the FINAL MASK
+        cv2.morphologyEx(self.red_mask, cv2.MORPH_CLOSE, self.kernel,
+                         dst=self.mask)
         # mask = cv2.dilate(mask3, self.kernel, iterations=1)
 
         # Bitwise-AND mask and original image to extract the target
-        self.res = cv2.bitwise_and(
-            np.asarray(img[:, :]), np.asarray(img[:, :]),
-            mask=np.asarray(mask[:, :]))
+        # (masked out pixels are left as they were in dst, so clear it)
+        self.res.fill(0)
+        cv2.bitwise_and(frame, frame, dst=self.res, mask=self.mask)
 
         # Squares is the array that has the pixel locations of the vertices
-        self.squares = self.find_squares(self.res)
+        if self.mode == "fast":
+            self.squares = self.find_squares_fast(self.mask)
+        else:
+            self.squares = self.find_squares(self.res)
         if self.squares:
             self.logger.debug("%d square(s)", len(self.squares))
             # print "Squares: {}".format(self.squares)  # [verbose]
 
             # Process squares array and set self.location to (x, y) pair
-            centroids = []
-            for square in self.squares:
-                # TODO: Reject this square if aspect ratio is too skewed
-                centroid = np.mean(square, axis=0)
-                centroids.append(centroid)  # TODO: faster numpy way?
-            centroids = np.array(centroids)
+            # TODO: Reject squares if aspect ratio is too skewed
+            centroids = np.mean(self.squares, axis=1)
             # print "Centroids:", centroids  # [verbose]
             mean_centroid = np.mean(centroids, axis=0)  # 2D mean
             sd_centroid = np.std(centroids, axis=0)  # 2D standard deviation
@@ -303,7 +461,7 @@ class TargetLocator(object):
 
     def find_squares(self, img):
         """Find and return all squares in given (thresholded) image."""
-        img = cv2.GaussianBlur(img, (5, 5), 0)
+        img = cv2.GaussianBlur(img, (5, 5), 0, dst=self.blurred)
         squares = []
         for gray in cv2.split(img):  # NOTE: iterate over R, G and B planes?
             for thrs in xrange(0, 255, 26):  # NOTE: so many thresholds reqd.?
@@ -338,6 +496,36 @@ class TargetLocator(object):
                             squares.append(cnt)
         return squares
 
+    def find_squares_fast(self, mask):
+        """Find and return all squares in given (binary) red mask.
+
+        The mask already isolates the target, so contours are extracted
+        once, instead of for every color plane and threshold. Candidates
+        are then filtered all at once with square_quads.
+
+        """
+        # Find contours (NOTE: findContours modifies its input)
+        np.copyto(self.contour_input, mask)
+        contours, hierarchy = cv2.findContours(
+            self.contour_input, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        # OpenCV 2.4.3 bug workaround
+        if self.do_cast_contours:
+            contours = [np.float32(c) for c in contours]
+
+        # Simplify contours, keep the ones with four vertices
+        quads = []
+        for cnt in contours:
+            if len(cnt) < 4:
+                continue  # can't be a square, even before simplifying
+            cnt_len = cv2.arcLength(cnt, True)
+            cnt = cv2.approxPolyDP(cnt, 0.02 * cnt_len, True)
+            if len(cnt) == 4:
+                quads.append(cnt.reshape(-1, 2))
+        if not quads:
+            return []
+        quads = np.array(quads)
+        return list(quads[square_quads(quads, self.min_contour_area)])
+
     def display_input(self):
         if self.imageIn is not None:
             cv2.imshow("Input", self.imageIn)
@@ -355,14 +543,18 @@ class TargetLocator(object):
         cv2.imshow("Output", self.res)  # NOTE: someone needs to call waitKey
 
     def clean_up(self):
+        self.stop_capture_threads()
         self.close_device()
 
 
 def runTargetLocator(
-        device=TargetLocator.default_device, gui=False, debug=False):
+        device=TargetLocator.default_device, gui=False, debug=False,
+        mode=TargetLocator.default_mode, threaded=False):
     """A standalone driver for testing TargetLocator."""
 
-    targetLocator = TargetLocator(device)
+    targetLocator = TargetLocator(device, mode)
+    if threaded:
+        targetLocator.start_capture_threads()
     # Quick hack, elevating debug messages to info
     if debug:
         targetLocator.logger.debug = targetLocator.logger.info
@@ -378,7 +570,7 @@ def runTargetLocator(
             if gui:
                 targetLocator.display_input()
                 targetLocator.display_output()
-                key = cv.WaitKey(10)
+                key = cv2.waitKey(10)
                 if key == 0x1b:
                     break
                 key &= 0xff  # use lower 8 bits only
@@ -408,6 +600,12 @@ if __name__ == "__main__":
         '--no_gui', dest='gui', action='store_false',
         default=False,
         help="suppress GUI interface/windows?")
+    argParser.add_argument(
+        '--threaded', action="store_true",
+        help="capture and detect on background threads?")
+    argParser.add_argument(
+        '--mode', choices=TargetLocator.modes,
+        default=TargetLocator.default_mode, help="detection mode")
     argParser.add_argument(
         'input_source', nargs='?',
         default=str(TargetLocator.default_device),
@@ -416,4 +614,5 @@ if __name__ == "__main__":
 
     print "TargetLocator: Running on OpenCV", cv2.__version__
     runTargetLocator(
-        int(options.input_source), gui=options.gui, debug=options.debug)
+        int(options.input_source), gui=options.gui, debug=options.debug,
+        mode=options.mode, threaded=options.threaded)
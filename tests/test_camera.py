@@ -0,0 +1,66 @@
+"""Test cases for background camera capture and detection."""
+
+from time import sleep
+from unittest import TestCase
+
+import bot.vision.camera as camera
+
+
+class FakeCapture(object):
+
+    """Stands in for cv2.VideoCapture, frames are their frame numbers."""
+
+    def __init__(self, period=0.002):
+        self.period = period
+        self.frames_read = 0
+
+    def read(self):
+        sleep(self.period)
+        self.frames_read += 1
+        return True, self.frames_read
+
+
+class TestCamera(TestCase):
+
+    """Test FrameGrabber and DetectionWorker."""
+
+    def setUp(self):
+        self.grabber = camera.FrameGrabber(FakeCapture())
+        self.detected = []
+        self.detector = camera.DetectionWorker(self.grabber, self.detect)
+        self.grabber.start()
+        self.detector.start()
+
+    def tearDown(self):
+        self.detector.stop()
+        self.grabber.stop()
+        self.detector.join()
+        self.grabber.join()
+
+    def detect(self, frame):
+        # Slower than capture, so frames get skipped
+        sleep(0.01)
+        self.detected.append(frame)
+        return frame * 10
+
+    def test_latest_frame(self):
+        """Waiting must give a newer frame than the last one seen."""
+        first = self.grabber.wait_for_frame(0, 1)
+        second = self.grabber.wait_for_frame(first.seq, 1)
+        self.assertTrue(second.seq > first.seq)
+        self.assertEquals(second.seq, second.frame)
+        self.assertTrue(second.time >= first.time)
+
+    def test_detections(self):
+        """Detections must be on fresh frames, skipping stale ones."""
+        seq = 0
+        for i in range(5):
+            detection = self.detector.wait_for_detection(seq, 1)
+            self.assertTrue(detection.seq > seq)
+            self.assertEquals(detection.seq * 10, detection.result)
+            seq = detection.seq
+        self.assertTrue(self.grabber.frames_read > len(self.detected))
+        self.assertEquals(sorted(self.detected), self.detected)
+
+    def test_wait_timeout(self):
+        self.assertEquals(None, self.grabber.wait_for_frame(10 ** 9, 0.01))
@@ -0,0 +1,316 @@
+"""Test cases for CtrlServer."""
+
+import threading
+from time import sleep
+from unittest import TestCase
+
+import zmq
+
+import bot.lib.lib as lib
+import bot.lib.messages as msgs
+import bot.lib.wire as wire
+import bot.simulator.world as sim_world
+import bot.server.ctrl_server as ctrl_server_mod
+
+
+class Exported(object):
+
+    """System with one method of each kind of argspec."""
+
+    @lib.api_call
+    def required(self, a, b):
+        return a, b
+
+    @lib.api_call
+    def defaulted(self, a, b=2):
+        return a, b
+
+    @lib.api_call
+    def keywords(self, a, **kwargs):
+        return a, kwargs
+
+    @lib.api_call
+    def wait(self, secs):
+        sleep(secs)
+
+    def hidden(self):
+        return "hidden"
+
+
+class TestApiMethod(TestCase):
+
+    """Test checking params against argspecs."""
+
+    def setUp(self):
+        self.system = Exported()
+
+    def check(self, method, params):
+        api_method = ctrl_server_mod.ApiMethod(getattr(self.system, method))
+        return api_method.check_params(params)
+
+    def test_required(self):
+        """Every arg without a default must be given."""
+        self.assertIsNone(self.check("required", {"a": 1, "b": 2}))
+        self.assertEqual(self.check("required", {"a": 1}), "missing b")
+        self.assertEqual(self.check("required", {}), "missing a, b")
+
+    def test_defaulted(self):
+        """Args with defaults may be left out."""
+        self.assertIsNone(self.check("defaulted", {"a": 1}))
+        self.assertIsNone(self.check("defaulted", {"a": 1, "b": 3}))
+
+    def test_unexpected(self):
+        """Unknown params are rejected, unless the method takes kwargs."""
+        self.assertEqual(self.check("defaulted", {"a": 1, "c": 3}),
+                         "unexpected c")
+        self.assertIsNone(self.check("keywords", {"a": 1, "c": 3}))
+
+
+class TestRegistry(TestCase):
+
+    """Test dispatching calls through the registry, in rep mode."""
+
+    def setUp(self):
+        """Build a rep mode server on the simulated course."""
+        lib.get_config("bot/config.yaml")
+        sim_world.install(sim_world.SimWorld())
+        self.server = ctrl_server_mod.CtrlServer(testing=True, mode="rep")
+
+    def tearDown(self):
+        self.server.clean_up()
+        sim_world.install(None)
+
+    def call(self, obj_name, method, params):
+        return self.server.handle_msg(
+            msgs.call_req(obj_name, method, params))
+
+    def test_params(self):
+        """Calls with bad params are rejected before calling."""
+        reply = self.call("ctrl", "echo", {})
+        self.assertEqual(reply["type"], "call_reply")
+        self.assertIsNone(reply["call_return"])
+        reply = self.call("ctrl", "echo", {"msg": "hi", "foo": 1})
+        self.assertEqual(reply["type"], "error")
+        self.assertIn("unexpected foo", reply["msg"])
+        reply = self.call("driver", "move", {})
+        self.assertEqual(reply["type"], "error")
+        self.assertIn("missing speed", reply["msg"])
+
+    def test_not_exported(self):
+        """Only @lib.api_call methods can be called."""
+        self.server.systems["exported"] = Exported()
+        self.server.build_registry()
+        reply = self.call("exported", "defaulted", {"a": 1})
+        self.assertEqual(reply["call_return"], (1, 2))
+        for obj_name, method in (("exported", "hidden"),
+                                 ("exported", "no_such_method"),
+                                 ("ctrl", "clean_up")):
+            reply = self.call(obj_name, method, {})
+            self.assertEqual(reply["type"], "error")
+            self.assertIn("Invalid method", reply["msg"])
+        reply = self.call("no_such_system", "echo", {})
+        self.assertIn("Invalid object", reply["msg"])
+
+    def test_list(self):
+        """The list reply has every exported method of every system."""
+        objects = {}
+        for name, obj in self.server.systems.iteritems():
+            objects[name] = [member for member in dir(obj)
+                             if ctrl_server_mod.is_api_method(obj, member)]
+        reply = self.server.handle_msg(msgs.list_req())
+        self.assertEqual(reply["type"], "list_reply")
+        self.assertEqual(
+            dict((name, sorted(methods))
+                 for name, methods in reply["objects"].iteritems()),
+            objects)
+        self.assertIn("echo", reply["objects"]["ctrl"])
+        self.assertNotIn("clean_up", reply["objects"]["ctrl"])
+
+    def test_call_stats(self):
+        """Calls and errors are counted per method, and can be reset."""
+        self.call("ctrl", "echo", {"msg": 1})
+        self.call("ctrl", "echo", {"msg": 2})
+        self.call("ctrl", "exception", {})
+        # Rejected calls aren't counted
+        self.call("ctrl", "echo", {"foo": 1})
+        stats = self.server.get_call_stats(reset=True)
+        self.assertEqual(sorted(stats), ["ctrl.echo", "ctrl.exception"])
+        self.assertEqual(stats["ctrl.echo"]["calls"], 2)
+        self.assertEqual(stats["ctrl.echo"]["errors"], 0)
+        self.assertEqual(stats["ctrl.exception"]["calls"], 1)
+        self.assertEqual(stats["ctrl.exception"]["errors"], 1)
+        self.assertGreaterEqual(stats["ctrl.echo"]["max_ms"],
+                                stats["ctrl.echo"]["avg_ms"])
+        self.assertEqual(self.server.get_call_stats(), {})
+
+
+class TestRouter(TestCase):
+
+    """Test CtrlServer in router mode, over real sockets."""
+
+    def setUp(self):
+        """Start a router mode server on the simulated course."""
+        self.config = lib.get_config("bot/config.yaml")
+        self.world = sim_world.SimWorld()
+        sim_world.install(self.world)
+        self.server = ctrl_server_mod.CtrlServer(testing=True, mode="router")
+        # Keep follower routines running till they're stopped
+        self.server.follower.is_centerred_on_line = \
+            lambda *args, **kwargs: False
+        self.listener = threading.Thread(target=self.server.listen)
+        self.listener.daemon = True
+        self.listener.start()
+
+        self.context = zmq.Context()
+        self.clients = []
+        self.client = self.connect()
+
+    def tearDown(self):
+        """Stop the server if it's still running, close clients."""
+        if self.listener.is_alive():
+            self.request(self.client, msgs.exit_req())
+            self.listener.join(2)
+        for client in self.clients:
+            client.close()
+        self.context.term()
+        sim_world.install(None)
+
+    def connect(self):
+        """Build a REQ client connected to the server."""
+        client = self.context.socket(zmq.REQ)
+        client.setsockopt(zmq.LINGER, 0)
+        client.setsockopt(zmq.RCVTIMEO, 2000)
+        client.connect("{}://{}:{}".format(
+            self.config["server_protocol"], self.config["server_host"],
+            self.config["ctrl_server_port"]))
+        self.clients.append(client)
+        return client
+
+    def request(self, client, msg):
+        """Send a message and wait for its reply."""
+        client.send(wire.dumps(msg))
+        return self.receive(client)
+
+    def receive(self, client):
+        """Wait for a reply, fail if none comes within RCVTIMEO."""
+        try:
+            reply, encoding = wire.loads(client.recv())
+        except zmq.Again:
+            self.fail("No reply from server")
+        return reply
+
+    def wait_for_state(self, job_id, state):
+        """Poll a job till it's in the given state."""
+        deadline = lib.monotonic() + 2
+        while lib.monotonic() < deadline:
+            reply = self.request(self.client, msgs.job_status_req(job_id))
+            if reply["state"] == state:
+                return reply
+        self.fail("Job {} never got to {}".format(job_id, state))
+
+    def start_drive(self, client):
+        """Send a follower call that runs till it's stopped."""
+        client.send(wire.dumps(msgs.call_req(
+            "follower", "drive_to_line", {"timeout": 10})))
+        while self.server.follower.routine_depth == 0:
+            self.server.follower.stop_event.wait(0.01)
+
+    def test_priority_calls(self):
+        """Long follower calls don't block pings or stopping them."""
+        for obj_name, method in (("ctrl", "stop_full"),
+                                 ("follower", "cancel")):
+            waiting = self.connect()
+            self.start_drive(waiting)
+            start = lib.monotonic()
+            self.assertEqual(self.request(self.client, msgs.ping_req()),
+                             msgs.ping_reply())
+            reply = self.request(
+                self.client, msgs.call_req(obj_name, method, {}))
+            self.assertEqual(reply["type"], "call_reply")
+            reply = self.receive(waiting)
+            self.assertEqual(reply["type"], "error")
+            self.assertIn("cancelled", reply["msg"])
+            self.assertLess(lib.monotonic() - start, 0.5)
+
+    def test_stop_full_queued(self):
+        """stop_full cancels queued motion jobs, not just the running one."""
+        running = self.connect()
+        self.start_drive(running)
+        queued = self.connect()
+        queued.send(wire.dumps(msgs.call_req(
+            "follower", "drive_to_line", {"timeout": 10})))
+        while len(self.server.jobs) < 2:
+            self.server.follower.stop_event.wait(0.01)
+        job_id = self.request(self.client, msgs.job_req(
+            "follower", "drive_to_line", {"timeout": 10}))["job_id"]
+        reply = self.request(
+            self.client, msgs.call_req("ctrl", "stop_full", {}))
+        self.assertEqual(reply["type"], "call_reply")
+        for client in (running, queued):
+            reply = self.receive(client)
+            self.assertEqual(reply["type"], "error")
+            self.assertIn("cancelled", reply["msg"])
+        reply = self.request(self.client, msgs.job_status_req(job_id))
+        self.assertEqual(reply["state"], "cancelled")
+        # Nothing queued started driving again
+        self.server.follower.stop_event.wait(0.1)
+        self.assertEqual(self.server.follower.routine_depth, 0)
+        self.assertEqual(self.world.wheels.values(), [0.0] * 4)
+
+    def test_jobs(self):
+        """Jobs can be polled and cancelled, queued or running."""
+        params = {"timeout": 10}
+        running = self.request(self.client, msgs.job_req(
+            "follower", "drive_to_line", params))["job_id"]
+        queued = self.request(self.client, msgs.job_req(
+            "follower", "drive_to_line", params))["job_id"]
+        self.wait_for_state(running, "running")
+        reply = self.request(self.client, msgs.job_status_req(queued))
+        self.assertEqual(reply["state"], "queued")
+        self.assertIsNone(reply["reply"])
+
+        reply = self.request(self.client, msgs.job_cancel_req(queued))
+        self.assertEqual(reply["state"], "cancelled")
+        self.assertEqual(reply["reply"]["type"], "error")
+        reply = self.request(self.client, msgs.job_cancel_req(running))
+        self.assertEqual(reply["state"], "cancelling")
+        reply = self.wait_for_state(running, "cancelled")
+        self.assertEqual(reply["reply"]["type"], "error")
+
+        # Cancelled queued job isn't run once the worker is free
+        done = self.request(self.client, msgs.job_req(
+            "ctrl", "echo", {"msg": "hi"}))["job_id"]
+        reply = self.wait_for_state(done, "done")
+        self.assertEqual(reply["reply"]["call_return"], "hi")
+        reply = self.request(self.client, msgs.job_status_req(queued))
+        self.assertEqual(reply["state"], "cancelled")
+
+    def test_unknown_job(self):
+        """Unknown job IDs give errors."""
+        for msg in (msgs.job_status_req(999), msgs.job_cancel_req(999)):
+            reply = self.request(self.client, msg)
+            self.assertEqual(reply["type"], "error")
+            self.assertIn("Unknown job", reply["msg"])
+
+    def test_exit(self):
+        """The server exits after replying, even with workers started."""
+        self.request(self.client, msgs.job_req(
+            "ctrl", "echo", {"msg": "hi"}))
+        self.assertEqual(self.request(self.client, msgs.exit_req()),
+                         msgs.exit_reply())
+        self.listener.join(2)
+        self.assertFalse(self.listener.is_alive())
+
+    def test_exit_busy_worker(self):
+        """The server exits even if a worker's job outlasts the join."""
+        self.server.worker_join_timeout = 0.1
+        self.server.systems["exported"] = Exported()
+        self.server.build_registry()
+        self.request(self.client, msgs.job_req(
+            "exported", "wait", {"secs": 1.0}))
+        start = lib.monotonic()
+        self.assertEqual(self.request(self.client, msgs.exit_req()),
+                         msgs.exit_reply())
+        self.listener.join(2)
+        self.assertFalse(self.listener.is_alive())
+        self.assertLess(lib.monotonic() - start, 0.5)
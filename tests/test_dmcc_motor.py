@@ -10,6 +10,25 @@ from bot.hardware.dmcc_motor import DMCCMotorSet, DMCCMotor
 import bot.lib.lib as lib
 
 
+class FlakyMotor(object):
+
+    """Stands in for a pyDMCC motor whose I2C writes can fail."""
+
+    def __init__(self):
+        self.fail = True
+        self.written = None
+
+    @property
+    def power(self):
+        return self.written
+
+    @power.setter
+    def power(self, value):
+        if self.fail:
+            raise IOError("I2C write failed")
+        self.written = value
+
+
 class TestDMCCMotorSet(TestCase):
 
     """Test motor set."""
@@ -33,6 +52,35 @@ class TestDMCCMotorSet(TestCase):
         self.assertEqual(len(drive_motor_set.motors), 4)
         self.assertEqual(len(turret_motor_set.motors), 2)
 
+    def test_set_batch(self):
+        """Batches are grouped per board and skip unchanged motors."""
+        motor_set = DMCCMotorSet(self.config['dmcc_drive_motors'])
+        names = ("back_right", "front_left", "back_left", "front_right")
+        plan = motor_set.batch_plan(names)
+        self.assertEqual([1, 3, 2, 0], [i for i, motor in plan])
+
+        self.assertEqual(4, motor_set.set_batch(names, (10, 20, 30, 40)))
+        for name, value in zip(names, (10, 20, 30, 40)):
+            self.assertEqual(value, motor_set[name].power)
+        self.assertEqual(1, motor_set.set_batch(names, (10, 20, 30, 50)))
+        self.assertEqual(50, motor_set["front_right"].power)
+        self.assertEqual(0, motor_set.set_batch(names, (10, 20, 30, 50)))
+        self.assertEqual(
+            4, motor_set.set_batch(names, (10, 20, 30, 50), force=True))
+
+    def test_failed_write(self):
+        """Motors whose write failed are written by the next batch."""
+        motor_set = DMCCMotorSet(self.config['dmcc_drive_motors'])
+        names = ("front_left",)
+        motor = motor_set["front_left"]
+        motor.is_testing = False
+        motor.real_motor = FlakyMotor()
+        self.assertRaises(IOError, motor_set.set_batch, names, (10,))
+        motor.real_motor.fail = False
+        self.assertEqual(1, motor_set.set_batch(names, (10,)))
+        self.assertEqual(10, motor.real_motor.written)
+        self.assertEqual(0, motor_set.set_batch(names, (10,)))
+
     def test_bad_config(self):
         motor_conf = self.config['dmcc_bad_motor_def']
         with self.assertRaises(KeyError):
@@ -2,10 +2,15 @@
 
 import sys
 import os
+import random
+import threading
 import unittest
 
+import numpy as np
+
 import bot.lib.lib as lib
 import bot.follower.follower as f_mod
+from bot.follower.error_cases import RoutineCancelled, RoutineTimeout
 import tests.test_bot as test_bot
 
 
@@ -269,3 +274,117 @@ class TestFollower(test_bot.TestBot):
         self.assertEquals(self.follower.No_Line, self.follower.right_state)
 
         return
+
+    def test_classify_branches(self):
+        """Test branch mask of a single reading."""
+        line = [255] * 8
+        no_line = [0] * 8
+        readings = {
+            "front": line, "back": no_line,
+            "left": no_line, "right": line}
+        mask = self.follower.classify_branches(readings)
+        self.assertEquals(
+            self.follower.Back_Branch | self.follower.Left_Branch, mask)
+        for side, bit in self.follower.Branch_Bits:
+            self.assertEquals(
+                bool(mask & bit), self.follower.count_num_of_hits(
+                    readings[side]) <= 6)
+
+    def test_recovery_cases(self):
+        """Every branch mask must have a recovery case."""
+        self.assertEquals(16, len(self.follower.Recovery_Cases))
+        for message, action, args, again in self.follower.Recovery_Cases:
+            if action is not None:
+                assert callable(getattr(self.follower, action))
+
+    def test_frame_matches_arrays(self):
+        """Vectorized frame methods must match the per-array ones."""
+        order = self.follower.ir_hub.frame_order
+        for trial in range(100):
+            raw = [[random.randint(0, 255) for i in range(8)]
+                   for name in order]
+            # Make some readings tie or sit right on the thresholds
+            raw[0][random.randint(0, 7)] = random.choice([0, 65, 145, 255])
+            frame = self.follower.normalize_frame(np.uint8(raw))
+
+            self.follower.array_block = dict(
+                zip(order, [list(row) for row in raw]))
+            self.follower.normalize_arrays()
+            self.follower.track_position()
+            for name, row in zip(order, frame.tolist()):
+                self.assertEquals(self.follower.array_block[name], row)
+                self.assertEquals(
+                    self.follower.assign_bin(row),
+                    self.follower.assign_frame_bins(np.uint8(row)).tolist())
+            self.assertEquals(
+                (self.follower.bot_front_position,
+                    self.follower.bot_back_position),
+                self.follower.track_frame_position(frame))
+            self.assertEquals(
+                [self.follower.count_num_of_hits(row)
+                    for row in frame.tolist()],
+                self.follower.count_frame_hits(frame))
+
+    def test_routine_timeout(self):
+        """Routines must stop and raise once their timeout passes."""
+        self.follower.is_centerred_on_line = lambda *args, **kwargs: False
+        start = lib.monotonic()
+        self.assertRaises(RoutineTimeout, self.follower.drive_to_line,
+                          timeout=0.05)
+        assert lib.monotonic() - start < 0.05 + 2 * self.follower.loop.period
+        self.assertEquals(0, self.follower.routine_depth)
+        self.assertEquals(None, self.follower.routine_deadline)
+
+    def test_cancel(self):
+        """Cancelling must stop a routine within one control period."""
+        self.follower.is_centerred_on_line = lambda *args, **kwargs: False
+        errors = []
+
+        def rotate():
+            try:
+                self.follower.rotate_to_line("left", timeout=10)
+            except RoutineCancelled as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=rotate)
+        thread.start()
+        # Wait till it's past its initial pause and polling for the line
+        while self.follower.routine_depth == 0:
+            self.follower.stop_event.wait(0.01)
+        self.follower.stop_event.wait(0.4)
+        start = lib.monotonic()
+        self.follower.cancel()
+        thread.join(1)
+        assert not thread.is_alive()
+        assert lib.monotonic() - start < 2 * self.follower.loop.period
+        self.assertEquals(1, len(errors))
+
+        # Cancellation sticks till the next call resets it
+        self.assertRaises(RoutineCancelled, self.follower.drive_to_line,
+                          timeout=0.01)
+        self.follower.reset_cancel()
+        self.assertRaises(RoutineTimeout, self.follower.drive_to_line,
+                          timeout=0.01)
+
+    def test_cancel_turn_around(self):
+        """Cancelling a blind turn must stop it within one control period."""
+        errors = []
+
+        def turn():
+            try:
+                with self.follower.routine():
+                    self.follower.turn_around()
+            except RoutineCancelled as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=turn)
+        thread.start()
+        while self.follower.routine_depth == 0:
+            self.follower.stop_event.wait(0.01)
+        self.follower.stop_event.wait(0.1)
+        start = lib.monotonic()
+        self.follower.cancel()
+        thread.join(1)
+        assert not thread.is_alive()
+        assert lib.monotonic() - start < 2 * self.follower.loop.period
+        self.assertEquals(1, len(errors))
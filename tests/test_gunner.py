@@ -19,8 +19,9 @@ class TestAim(test_bot.TestBot):
         # Build wheel gunner
         self.gunner = gunner.Gunner()
         self.gunner.gun.dart_velocity = 10
-        self.gunner.ultrasonics.read_dists = lambda: \
-            {'front': 0.3, 'left': 0.5, 'back': 2.4384, 'right': 0.7192}
+        self.gunner.ultrasonics.read_all_units = lambda after_seq=None: \
+            {'seq': None, 'dists': {
+                'front': 0.3, 'left': 0.5, 'back': 2.4384, 'right': 0.7192}}
 
     def tearDown(self):
         """Restore testing flag state in config file."""
@@ -41,8 +42,9 @@ class TestFire(test_bot.TestBot):
         super(TestFire, self).setUp()
         # Build wheel gunner
         self.gunner = gunner.Gunner()
-        self.gunner.ultrasonics.read_dists = lambda: \
-            {'front': 0.3, 'left': 0.5, 'back': 2.4384, 'right': 0.7192}
+        self.gunner.ultrasonics.read_all_units = lambda after_seq=None: \
+            {'seq': None, 'dists': {
+                'front': 0.3, 'left': 0.5, 'back': 2.4384, 'right': 0.7192}}
         self.gunner.gun.dart_velocity = 10
 
     def tearDown(self):
@@ -69,7 +71,8 @@ class TestLocalize(test_bot.TestBot):
         self.good_dists = {
             'front': x_size - 0.5, 'back': 0.5,
             'left': 1.0, 'right': y_size - 1.0}
-        self.gunner.ultrasonics.read_dists = lambda: self.good_dists
+        self.gunner.ultrasonics.read_all_units = lambda after_seq=None: \
+            {'seq': None, 'dists': self.good_dists}
         self.logger.info("Running: {}".format(self._testMethodName))
 
     def test_localize(self):
@@ -1,11 +1,12 @@
 """Test cases for IRHub abstraction class."""
 
 import random
-from time import time, sleep
+from time import sleep
 import unittest
 
 import bot.lib.lib as lib
 import bot.hardware.ir_hub as ir_hub_mod
+import bot.hardware.ir_analog as ir_analog_mod
 import tests.test_bot as test_bot
 
 
@@ -192,7 +193,7 @@ class TestReadCached(test_bot.TestBot):
         """Test that time value is reasonable."""
         result = self.ir_hub.read_cached()
         # Just a very general assertion that the time's reasonable
-        assert time() - result["time"] < 60
+        assert lib.monotonic() - result["time"] < 60
 
     def testSeries(self):
         """Test caching behavior with a series of reads over time."""
@@ -208,3 +209,103 @@ class TestReadCached(test_bot.TestBot):
                 assert result["fresh"] is True
             else:
                 assert result["fresh"] is False
+
+
+class TestReadAllBlock(test_bot.TestBot):
+
+    """Test reading all arrays with block scans on a simulated bus."""
+
+    def build_ir_hub(self, scan_mode):
+        """Build IRHub on a simulated backend with known channel values."""
+        backend = ir_analog_mod.SimulatedBackend(scan_mode)
+        ir_hub = ir_hub_mod.IRHub(backend)
+        self.expected = {}
+        for name, array in ir_hub.arrays.iteritems():
+            self.expected[name] = []
+            for cmd in ir_hub.channel_cmds:
+                value = random.randint(0, 255)
+                backend.values[(array.i2c_addr, cmd)] = value
+                self.expected[name].append(value)
+        return ir_hub
+
+    def test_values(self):
+        """Confirm block scan returns every channel in channel order."""
+        ir_hub = self.build_ir_hub("rdwr")
+        readings = ir_hub.read_all()
+        for name, reading in readings.iteritems():
+            assert reading == self.expected[name]
+
+    def test_block_transactions(self):
+        """Confirm a block scan takes one transaction per array."""
+        ir_hub = self.build_ir_hub("rdwr")
+        ir_hub.read_all()
+        stats = ir_hub.get_scan_stats()
+        assert stats["transactions"] == len(ir_hub.arrays)
+        assert stats["usecs"] > 0
+
+    def test_byte_transactions(self):
+        """Confirm a byte scan takes one transaction per channel."""
+        ir_hub = self.build_ir_hub("byte")
+        ir_hub.read_all()
+        stats = ir_hub.get_scan_stats()
+        assert stats["transactions"] == \
+            len(ir_hub.arrays) * len(ir_hub.channel_cmds)
+
+
+class TestSampler(test_bot.TestBot):
+
+    """Test background IR sampling."""
+
+    def setUp(self):
+        """Get config and built IRHub object on a simulated bus."""
+        # Run general bot test setup
+        super(TestSampler, self).setUp()
+
+        # Build IR hub abstraction object
+        self.backend = ir_analog_mod.SimulatedBackend("rdwr")
+        self.ir_hub = ir_hub_mod.IRHub(self.backend)
+
+    def tearDown(self):
+        """Stop sampler, restore testing flag state in config file."""
+        self.ir_hub.stop_sampler()
+        # Run general bot test tear down
+        super(TestSampler, self).tearDown()
+
+    def test_snapshots(self):
+        """Confirm snapshots are published in order with fresh values."""
+        self.ir_hub.start_sampler(rate=200)
+        first = self.ir_hub.sampler.wait_for_snapshot(timeout=1)
+        assert first is not None
+
+        array = self.ir_hub.arrays["front"]
+        self.backend.values[(array.i2c_addr, self.ir_hub.channel_cmds[0])] = 7
+        second = self.ir_hub.sampler.wait_for_snapshot(first.seq, timeout=1)
+        second = self.ir_hub.sampler.wait_for_snapshot(second.seq, timeout=1)
+        assert second.seq > first.seq
+        assert second.time >= first.time
+        assert second.readings["front"][0] == 7
+        assert self.ir_hub.read_all()["front"][0] == 7
+
+    def test_read_all_copy(self):
+        """Confirm callers can't modify the published snapshot."""
+        self.ir_hub.start_sampler(rate=200)
+        readings = self.ir_hub.read_all()
+        readings["front"][0] = 99
+        assert self.ir_hub.sampler.snapshot.readings["front"][0] == 0
+
+    def test_scan_errors(self):
+        """Confirm failed scans are survived and stale frames rejected."""
+        scan = self.ir_hub.scan
+
+        def failing_scan():
+            raise IOError("I2C bus error")
+        self.ir_hub.scan = failing_scan
+        self.ir_hub.start_sampler(rate=200)
+        with self.assertRaises(IOError):
+            self.ir_hub.read_all()
+        assert self.ir_hub.get_sampler_stats()["errors"] > 0
+
+        # Sampler recovers once scans work again
+        self.ir_hub.scan = scan
+        assert self.ir_hub.read_all()["front"][0] == 0
+        assert self.ir_hub.sampler.is_alive()
@@ -0,0 +1,54 @@
+"""Test cases for mecanum kinematics."""
+
+import random
+from unittest import TestCase
+
+import numpy as np
+
+import bot.driver.kinematics as kinematics
+
+
+class TestKinematics(TestCase):
+
+    """Table-based wheel math must exactly match the original math."""
+
+    def setUp(self):
+        """Build a mix of common and random commands."""
+        self.commands = [(speed, angle, rate)
+                         for speed in (1, 35, 50, 100)
+                         for angle in (0, 45, 90, 180, 270, -90, 360)
+                         for rate in (-30, 0, 10)]
+        for i in range(200):
+            self.commands.append((random.uniform(1, 100),
+                                  random.uniform(-360, 360),
+                                  random.uniform(-100, 100)))
+
+    def test_move_wheels(self):
+        """Test move_wheels against the original move math."""
+        for speed, angle, rate in self.commands:
+            self.assertEqual(
+                kinematics.reference_move_wheels(speed, angle),
+                kinematics.move_wheels(speed, angle))
+
+    def test_compound_wheels(self):
+        """Test compound_wheels against the original compound_move math."""
+        for speed, angle, rate in self.commands:
+            self.assertEqual(
+                kinematics.reference_compound_wheels(speed, angle, rate),
+                kinematics.compound_wheels(speed, angle, rate))
+
+    def test_compound_wheels_array(self):
+        """Vectorized rows must match compound_wheels."""
+        speeds, angles, rates = zip(*self.commands)
+        wheels = kinematics.compound_wheels_array(speeds, angles, rates)
+        self.assertEqual((len(self.commands), 4), wheels.shape)
+        for row, command in zip(wheels.tolist(), self.commands):
+            self.assertEqual(
+                kinematics.reference_compound_wheels(*command), tuple(row))
+
+    def test_zero_wheels(self):
+        """Commands with no wheel motion are nan in the array version."""
+        wheels = kinematics.compound_wheels_array([0], [0], [0])
+        assert np.isnan(wheels).all()
+        with self.assertRaises(ZeroDivisionError):
+            kinematics.compound_wheels(0, 0, 0)
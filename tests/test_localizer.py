@@ -0,0 +1,69 @@
+"""Test cases for the streaming ultrasonic localizer."""
+
+import random
+from unittest import TestCase
+
+import bot.lib.lib as lib
+from bot.gunner.localizer import StreamingLocalizer
+
+
+class TestStreamingLocalizer(TestCase):
+
+    """Test outlier rejection and pose estimates."""
+
+    def setUp(self):
+        config = lib.get_config("bot/config.yaml")
+        self.x_size = config['course']['default']['x_size']
+        self.localizer = StreamingLocalizer(self.x_size)
+        self.good_dists = {
+            'front': self.x_size - 0.5, 'back': 0.5,
+            'left': 1.0, 'right': 1.4}
+
+    def noisy(self, dists, noise=0.002):
+        return dict((name, dist + random.gauss(0, noise))
+                    for name, dist in dists.iteritems())
+
+    def test_estimate(self):
+        for i in range(8):
+            self.localizer.add(self.noisy(self.good_dists))
+        estimate = self.localizer.estimate()
+        self.assertAlmostEqual(estimate.x, 0.5, places=2)
+        self.assertAlmostEqual(estimate.y, 1.0, places=2)
+        self.assertTrue(abs(estimate.theta) < 5)
+        self.assertEquals(estimate.covariance.shape, (3, 3))
+        self.assertTrue(self.localizer.is_confident(estimate))
+
+    def test_outliers(self):
+        """Bad echoes must be rejected, not averaged in."""
+        for i in range(10):
+            self.localizer.add(self.noisy(self.good_dists))
+        for bad in ({'left': 0.2}, {'back': 2.0}, {'front': 0.3}):
+            dists = dict(self.good_dists)
+            dists.update(bad)
+            self.localizer.add(dists)
+        estimate = self.localizer.estimate()
+        self.assertEquals(estimate.samples, 10)
+        self.assertAlmostEqual(estimate.x, 0.5, places=2)
+        self.assertAlmostEqual(estimate.y, 1.0, places=2)
+
+    def test_ring_buffer(self):
+        """Old frames must be replaced once the buffer is full."""
+        dists = dict(self.good_dists, left=1.2)
+        for i in range(len(self.localizer.frames)):
+            self.localizer.add(self.good_dists)
+        for i in range(len(self.localizer.frames)):
+            self.localizer.add(dists)
+        self.assertAlmostEqual(self.localizer.estimate().y, 1.2, places=2)
+
+    def test_not_confident(self):
+        self.localizer.add(self.good_dists)
+        estimate = self.localizer.estimate()
+        self.assertEquals(estimate.covariance, None)
+        self.assertFalse(self.localizer.is_confident(estimate))
+        self.assertFalse(self.localizer.is_confident(None))
+
+    def test_invalid_frames(self):
+        """Frames ratio_localizer would reject give no pose."""
+        for i in range(5):
+            self.localizer.add(dict(self.good_dists, front=0.3))
+        self.assertEquals(self.localizer.estimate(), None)
@@ -0,0 +1,64 @@
+"""Test cases for the fixed-rate control loop scheduler."""
+
+from time import sleep
+from unittest import TestCase
+
+import bot.lib.lib as lib
+import bot.follower.loop_scheduler as loop_scheduler_mod
+
+
+class TestLoopScheduler(TestCase):
+
+    """Test tick timing, overruns and skipped actuation."""
+
+    def setUp(self):
+        """Build a fast scheduler."""
+        self.loop = loop_scheduler_mod.LoopScheduler(rate=200)
+
+    def test_fixed_rate(self):
+        """Ticks should come one period apart, without drift."""
+        start = lib.monotonic()
+        for i in range(21):
+            self.loop.wait_for_tick()
+            self.loop.end_phase("read")
+        elapsed = lib.monotonic() - start
+        self.assertAlmostEqual(elapsed, 20 * self.loop.period, delta=0.02)
+        self.assertAlmostEqual(self.loop.dt, self.loop.period, delta=0.004)
+        stats = self.loop.get_stats()
+        self.assertEqual(21, stats["ticks"])
+        self.assertEqual(20, sum(stats["period_hist"]))
+        self.assertEqual(0, stats["overruns"])
+
+    def test_overrun(self):
+        """A slow tick is an overrun and its actuation is skipped once."""
+        self.loop.wait_for_tick()
+        self.loop.end_phase("read")
+        sleep(3 * self.loop.period)
+        self.loop.end_phase("compute")
+        self.assertTrue(self.loop.deadline_missed())
+        self.assertFalse(self.loop.should_actuate())
+        # Never skip two ticks in a row
+        self.assertTrue(self.loop.should_actuate())
+
+        dt = self.loop.wait_for_tick()
+        self.assertTrue(dt >= 3 * self.loop.period)
+        stats = self.loop.get_stats()
+        self.assertEqual(1, stats["overruns"])
+        self.assertEqual(1, stats["skipped_actuations"])
+        self.assertEqual(1, stats["period_hist"][-1] +
+                         sum(stats["period_hist"][:-1]))
+        self.assertTrue(stats["phase_max"]["compute"] >=
+                        3 * self.loop.period)
+
+    def test_late_tick(self):
+        """A tick late by less than a period keeps the schedule."""
+        loop = loop_scheduler_mod.LoopScheduler(rate=20)
+        loop.wait_for_tick()
+        deadline = loop.next_deadline
+        sleep(1.5 * loop.period)
+        self.assertTrue(loop.deadline_missed())
+        loop.should_actuate()
+        self.assertEqual(1, loop.get_stats()["missed_deadlines"])
+        loop.wait_for_tick()
+        self.assertEqual(0, loop.get_stats()["overruns"])
+        self.assertEqual(deadline + loop.period, loop.next_deadline)
@@ -64,3 +64,9 @@ class TestPID(test_bot.TestBot):
             assert abs(test_output[index] - output_value[index]) <= \
                 .001, "{} != {}, {}".format(
                     test_output[index], output_value[index], n)
+
+    def test_pid_zero_timestep(self):
+        """A zero timestep shouldn't divide by zero."""
+        self.pid.set_k_values(1.0, 1.0, 0.0)
+        self.pid.pid(0, 1, 0.1)
+        self.assertEqual(-2, self.pid.pid(0, 2, 0))
@@ -0,0 +1,163 @@
+"""Test cases for scheduling PubServer topics."""
+
+from operator import itemgetter
+from unittest import TestCase
+
+from bot.server.pub_server import TopicScheduler
+
+
+class SchedulerTest(TestCase):
+
+    """Build a scheduler of a few topics, on a clock we control."""
+
+    pub_topics = {
+        "default": {"period": 1.0, "jitter": 0.05, "max_age": 0.0},
+        "motor": {"period": 0.5},
+        "motor_vel": {"max_age": 0.1}}
+
+    def setUp(self):
+        self.clock = 100.0
+        self.reads = {"motor_vel": 0, "turret": 0}
+
+        def read(name, value):
+            def sampler():
+                self.reads[name] += 1
+                return value
+            return sampler
+        samplers = {"motor_vel": read("motor_vel", {"fl": 1, "fr": 2}),
+                    "turret": read("turret", 45)}
+        topics = {"motor_vel_fl": ("motor_vel", itemgetter("fl")),
+                  "motor_vel_fr": ("motor_vel", itemgetter("fr")),
+                  "turret": ("turret", None)}
+        self.scheduler = TopicScheduler(samplers, topics, self.pub_topics)
+        self.scheduler.clock = lambda: self.clock
+        self.sent = []
+
+    def send(self, topic_name, seq, sample_time, value):
+        self.sent.append((topic_name, seq, sample_time, value))
+
+    def subscribe(self, prefix):
+        self.scheduler.subscription_changed("\x01" + prefix)
+        self.scheduler.update_active_topics()
+
+    def publish(self):
+        """Publish what's due, get the names of the topics sent."""
+        del self.sent[:]
+        self.scheduler.publish_due(self.send)
+        return sorted(topic_name for topic_name, seq, sample_time, value
+                      in self.sent)
+
+
+class TestSchedule(SchedulerTest):
+
+    """Test topic settings, the heap schedule and shared samplers."""
+
+    def test_topic_settings(self):
+        """Settings come from the longest prefix, then the default."""
+        self.assertEqual(self.scheduler.settings["turret"],
+                         self.pub_topics["default"])
+        self.assertEqual(self.scheduler.settings["motor_vel_fl"],
+                         {"period": 1.0, "jitter": 0.05, "max_age": 0.1})
+        self.assertEqual(self.scheduler.topic_settings("motor_speed"),
+                         {"period": 0.5, "jitter": 0.05, "max_age": 0.0})
+
+    def test_periods(self):
+        """Topics go out when subscribed, then once per period."""
+        self.subscribe("")
+        self.assertEqual(self.scheduler.time_to_next_pub(1), 0)
+        self.assertEqual(self.publish(),
+                         ["motor_vel_fl", "motor_vel_fr", "turret"])
+        self.assertAlmostEqual(self.scheduler.time_to_next_pub(1), 0.95)
+        self.clock += 0.5
+        self.assertEqual(self.publish(), [])
+        # Within jitter of being due
+        self.clock += 0.46
+        self.assertEqual(self.publish(),
+                         ["motor_vel_fl", "motor_vel_fr", "turret"])
+        self.assertEqual([seq for topic_name, seq, sample_time, value
+                          in self.sent], [1, 1, 1])
+
+    def test_fall_behind(self):
+        """Topics that fall behind go out once, not in a burst."""
+        self.subscribe("turret")
+        self.publish()
+        self.clock += 10
+        self.assertEqual(self.publish(), ["turret"])
+        self.assertEqual(self.scheduler.due_times["turret"], self.clock + 1)
+
+    def test_shared_sampler(self):
+        """Topics of one sampler reuse samples younger than max_age."""
+        self.subscribe("motor_vel")
+        self.publish()
+        self.assertEqual(sorted(value for topic_name, seq, sample_time, value
+                                in self.sent), [1, 2])
+        self.assertEqual(self.reads["motor_vel"], 1)
+        self.clock += 1.0
+        self.publish()
+        self.assertEqual(self.reads["motor_vel"], 2)
+        stats = self.scheduler.get_stats()
+        self.assertEqual(stats["sampler_reads"],
+                         {"motor_vel": 2, "turret": 0})
+
+    def test_stats(self):
+        """Publishes are counted, and ones later than jitter overrun."""
+        self.subscribe("turret")
+        self.publish()
+        self.clock += 1.2
+        self.publish()
+        stats = self.scheduler.get_stats()["topics"]
+        self.assertEqual(stats["turret"]["published"], 2)
+        self.assertEqual(stats["turret"]["overruns"], 1)
+        self.assertAlmostEqual(stats["turret"]["max_late"], 0.2)
+        self.assertEqual(stats["motor_vel_fl"]["published"], 0)
+
+
+class TestSubscriptions(SchedulerTest):
+
+    """Test that only subscribed topics are sampled and published."""
+
+    def test_nothing_subscribed(self):
+        """Without subscribers, no sampler is read."""
+        self.assertEqual(self.scheduler.time_to_next_pub(1), 1)
+        self.clock += 5
+        self.assertEqual(self.publish(), [])
+        self.assertEqual(self.reads, {"motor_vel": 0, "turret": 0})
+
+    def test_prefixes(self):
+        """Subscriptions match topics by prefix, like ZMQ does."""
+        self.subscribe("motor_vel_f")
+        self.assertEqual(self.publish(), ["motor_vel_fl", "motor_vel_fr"])
+        self.assertEqual(self.reads["turret"], 0)
+        self.subscribe("tur")
+        self.assertEqual(self.publish(), ["turret"])
+
+    def test_unsubscribe(self):
+        """Topics stop once their last matching prefix is unsubscribed."""
+        self.subscribe("motor")
+        self.subscribe("motor_vel_fl")
+        self.publish()
+        self.assertTrue(self.scheduler.subscription_changed("\x00motor"))
+        self.scheduler.update_active_topics()
+        self.clock += 1
+        self.assertEqual(self.publish(), ["motor_vel_fl"])
+        self.scheduler.subscription_changed("\x00motor_vel_fl")
+        self.scheduler.update_active_topics()
+        self.clock += 1
+        self.assertEqual(self.publish(), [])
+        self.assertEqual(self.scheduler.time_to_next_pub(1), 1)
+
+    def test_resubscribe(self):
+        """Topics subscribed again go out right away, just once."""
+        self.subscribe("turret")
+        self.publish()
+        self.scheduler.subscription_changed("\x00turret")
+        self.scheduler.update_active_topics()
+        self.clock += 0.2
+        self.subscribe("turret")
+        self.assertEqual(self.publish(), ["turret"])
+        self.assertEqual(self.publish(), [])
+
+    def test_empty_message(self):
+        """Empty messages from XPUB don't change subscriptions."""
+        self.assertFalse(self.scheduler.subscription_changed(""))
+        self.assertEqual(self.scheduler.subscriptions, set())
@@ -0,0 +1,116 @@
+"""Test cases for recording and replaying sensor logs."""
+
+import os
+import shutil
+import struct
+import tempfile
+from time import sleep
+from unittest import TestCase
+
+import bot.lib.lib as lib
+import bot.simulator.recording as recording
+import bot.simulator.world as sim_world
+from bot.hardware.ir_hub import IRHub
+from bot.hardware.ultrasonic import Ultrasonic
+
+
+class SmallChunkRecorder(recording.Recorder):
+
+    """Recorder that grows its log every few records."""
+
+    chunk_size = 64
+
+
+class TestSensorLog(TestCase):
+
+    """Test writing and reading back log files."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "sensors.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        """Records read back in order, by stream."""
+        recorder = recording.Recorder(self.path)
+        recorder.append("color", (1, 100, 20, 30, 40), 1.0)
+        recorder.append("ultrasonic", (10, 20, 30, 40), 1.5)
+        recorder.append("color", (0, 90.5, 10, 20, 30), 2.0)
+        recorder.close()
+        logs = recording.read_log(self.path)
+        times, values = logs["color"]
+        self.assertEqual(times.tolist(), [1.0, 2.0])
+        self.assertEqual(values.tolist(), [[1, 100, 20, 30, 40],
+                                           [0, 90.5, 10, 20, 30]])
+        self.assertEqual(logs["ultrasonic"][1].tolist(), [[10, 20, 30, 40]])
+        self.assertEqual(logs["ir"][1].shape, (0, 32))
+
+    def test_grow_unclosed(self):
+        """Logs past the first chunk can be read without closing."""
+        recorder = SmallChunkRecorder(self.path)
+        for i in xrange(100):
+            recorder.append("ultrasonic", (i, i, i, i), float(i))
+        # 100 records of 25 bytes fill many 64 byte chunks
+        self.assertGreater(len(recorder.mem), 30 * recorder.chunk_size)
+        recorder.mem.flush()
+        times, values = recording.read_log(self.path)["ultrasonic"]
+        self.assertEqual(times.tolist(), range(100))
+        self.assertEqual(values[-1].tolist(), [99] * 4)
+        recorder.close()
+        self.assertEqual(os.path.getsize(self.path),
+                         len(recording.magic) + 100 * 25)
+
+
+class TestReplay(TestCase):
+
+    """Test recording sensors on the simulated course and replaying them."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "sensors.log")
+        lib.get_config("bot/config.yaml")
+        self.world = sim_world.SimWorld()
+        sim_world.install(self.world)
+
+    def tearDown(self):
+        recording.install()
+        sim_world.install(None)
+        shutil.rmtree(self.dir)
+
+    def test_ir(self):
+        """Replayed scans match the recorded ones."""
+        recording.install(recorder=recording.Recorder(self.path))
+        recorded = IRHub().read_all()
+        recording.get_recorder().close()
+
+        recording.install(replayer=recording.Replayer(self.path))
+        self.world.reset((0.1, 0.1, 0.0))
+        ir_hub = IRHub()
+        self.assertEqual(ir_hub.read_all(), recorded)
+        self.assertEqual(ir_hub.read_frame().tolist(),
+                         [recorded[name] for name in ir_hub.frame_order])
+
+    def test_ultrasonic(self):
+        """Frames are replayed in order, faster at higher speeds."""
+        recording.install(recorder=recording.Recorder(self.path))
+        us = Ultrasonic()
+        us.wait_for_interrupt = lambda: None
+        frames = []
+        for i in xrange(3):
+            us.pru_mem = struct.pack('IIIIIIII', *range(i, i + 8))
+            frames.append(us.read_times())
+            sleep(0.1)
+        recording.get_recorder().close()
+
+        speed = 10.0
+        replayer = recording.Replayer(self.path, speed)
+        recording.install(replayer=replayer)
+        us = Ultrasonic()
+        replayer.start()
+        start_time = lib.monotonic()
+        self.assertEqual([us.read_times() for i in xrange(3)], frames)
+        secs = lib.monotonic() - start_time
+        self.assertGreater(secs, 0.2 / speed)
+        self.assertLess(secs, 0.2)
@@ -0,0 +1,117 @@
+"""Test cases for the simulated course and hardware."""
+
+from unittest import TestCase
+
+import bot.lib.lib as lib
+import bot.simulator.world as sim_world
+from bot.hardware.ultrasonic import Ultrasonic
+
+
+class TestSimWorld(TestCase):
+
+    """Test the world model, with its clock stopped."""
+
+    def setUp(self):
+        """Build world at the start pose, on a clock we control."""
+        self.config = lib.get_config("bot/config.yaml")
+        self.world = sim_world.SimWorld()
+        self.clock = 0.0
+        self.world.now = lambda: self.clock
+        self.world.reset()
+        self.x, self.y, self.heading = self.world.start_pose
+
+    def test_ir_on_line(self):
+        """Front and back arrays straddle the line, sides are clear."""
+        line = self.world.ir_line_value
+        floor = self.world.ir_floor_value
+        for name in ("front", "back"):
+            readings = self.world.ir_readings(name)
+            self.assertEqual(readings[3:5], [line, line])
+            self.assertEqual(readings[:3] + readings[5:], [floor] * 6)
+        for name in ("left", "right"):
+            self.assertEqual(self.world.ir_readings(name), [floor] * 8)
+
+    def test_move_forward(self):
+        """Equal wheel powers drive the bot straight ahead."""
+        for wheel in self.world.wheels:
+            self.world.set_wheel(wheel, 50)
+        self.clock = 1.0
+        x, y, heading = self.world.pose
+        self.assertAlmostEqual(x, self.x)
+        self.assertAlmostEqual(y, self.y + self.world.max_wheel_speed / 2)
+        self.assertAlmostEqual(heading, self.heading)
+
+    def test_rotate(self):
+        """Wheels set like MecDriver.rotate turn counterclockwise."""
+        for wheel, power in (("front_left", -50), ("front_right", 50),
+                             ("back_left", -50), ("back_right", 50)):
+            self.world.set_wheel(wheel, power)
+        self.clock = 1.0
+        x, y, heading = self.world.pose
+        self.assertAlmostEqual(x, self.x)
+        self.assertAlmostEqual(y, self.y)
+        self.assertAlmostEqual(
+            heading, self.heading + 57.29578 *
+            self.world.max_wheel_speed / 2 / self.world.wheel_lever, 3)
+
+    def test_ranges(self):
+        """Ultrasonics measure from each sensor to the course walls."""
+        sensors = self.config["ultrasonics"]["sensors"]
+        ranges = self.world.ranges(sensors)
+        self.assertAlmostEqual(ranges["back"], self.y - 0.15)
+        self.assertAlmostEqual(ranges["front"],
+                               self.world.y_size - self.y - 0.15)
+        self.assertAlmostEqual(ranges["left"], self.x - 0.15)
+        self.assertAlmostEqual(ranges["right"],
+                               self.world.x_size - self.x - 0.15)
+
+    def test_motors(self):
+        """Drive motors move their wheel, others don't move the bot."""
+        dmccs = self.world.build_dmccs({
+            "front_left": {"board_num": 0, "motor_num": 1},
+            "front_right": {"board_num": 0, "motor_num": 2, "invert": True},
+            "gun": {"board_num": 2, "motor_num": 1}})
+        dmccs[0].motors[1].power = 40
+        dmccs[0].motors[2].power = -40
+        dmccs[2].motors[1].power = 100
+        self.assertEqual(self.world.wheels["front_left"], 40)
+        self.assertEqual(self.world.wheels["front_right"], 40)
+        self.assertEqual(self.world.wheels["back_left"], 0)
+        self.assertEqual(dmccs[2].motors[1].velocity,
+                         self.world.motor_max_velocity)
+
+    def test_reset_pru(self):
+        """After a reset, the next PRU frame is a period from the reset."""
+        waits = []
+        self.world.sleep_until = waits.append
+        self.clock = 10.0
+        self.world.pru.wait_for_event(None)
+        self.clock = 0.0
+        self.world.reset()
+        self.world.pru.wait_for_event(None)
+        self.assertEqual(waits, [10.0 + self.world.pru.frame_period,
+                                 self.world.pru.frame_period])
+
+
+class TestSimUltrasonic(TestCase):
+
+    """Test Ultrasonic reading the simulated PRU."""
+
+    def setUp(self):
+        lib.get_config("bot/config.yaml")
+        self.world = sim_world.SimWorld()
+        sim_world.install(self.world)
+        self.us = Ultrasonic()
+
+    def tearDown(self):
+        sim_world.install(None)
+
+    def test_dists(self):
+        """Distances from center match the start pose."""
+        # Don't wait for the next frame
+        self.world.pru.next_frame = self.world.now()
+        x, y, heading = self.world.start_pose
+        dists = self.us.read_dists()
+        self.assertAlmostEqual(dists["back"], y, 3)
+        self.assertAlmostEqual(dists["left"], x, 3)
+        self.assertAlmostEqual(dists["front"], self.world.y_size - y, 3)
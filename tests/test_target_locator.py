@@ -0,0 +1,40 @@
+"""Test cases for TargetLocator square detection."""
+
+from unittest import TestCase
+
+import numpy as np
+
+import bot.vision.targeting as targeting
+
+
+class TestSquareQuads(TestCase):
+
+    """Vectorized square tests must match the per-contour ones."""
+
+    def setUp(self):
+        """Build squares, in both vertex orders, and other quads."""
+        square = np.int32([[100, 100], [150, 101], [149, 151], [99, 150]])
+        self.quads = np.array([
+            square,
+            square[::-1],
+            square // 2,  # too small
+            np.int32([[100, 100], [200, 100], [200, 130], [100, 130]]),
+            np.int32([[100, 100], [150, 100], [100, 150], [150, 150]]),
+            np.int32([[100, 100], [160, 100], [180, 150], [120, 150]]),
+            np.int32([[100, 100], [100, 100], [150, 150], [99, 150]])])
+
+    def test_square_quads(self):
+        """Only the squares big enough should be kept."""
+        keep = targeting.square_quads(self.quads, 1000)
+        self.assertEquals(
+            [True, True, False, True, False, False, False], keep.tolist())
+
+    def test_square_quads_angles(self):
+        """Kept quads must have every angle_cos below the limit."""
+        keep = targeting.square_quads(self.quads, 0)
+        for quad, kept in zip(self.quads, keep):
+            if kept:
+                self.assertTrue(max(
+                    targeting.angle_cos(quad[i], quad[(i + 1) % 4],
+                                        quad[(i + 2) % 4])
+                    for i in range(4)) < 0.1)
@@ -3,6 +3,8 @@
 from os import path
 from unittest import TestCase
 
+import numpy as np
+
 import bot.lib.lib as lib
 import bot.gunner.targeting_solver as targeting
 
@@ -42,3 +44,54 @@ class TestTargetingSolver(TestCase):
     def test_getFiringSolution_bad_velocity(self):
         with self.assertRaises(ValueError):
             targeting.getFiringSolution(.3572, .9144, 0, .5)
+
+    def test_lookupElevationAngle(self):
+        """Interpolated angles must be close to the exact solver's."""
+        # Points in and around the firing box, at likely dart velocities
+        for distance, velocity in ((.9422, 7.4439), (.889, 5.3),
+                                   (1.21, 6.1), (1.63, 9.8), (1.02, 13.2),
+                                   (1.4, 11.35)):
+            exact = targeting.getExactElevationAngle(distance, velocity)
+            fast = targeting.lookupElevationAngle(distance, velocity)
+            self.assertTrue(abs(exact - fast) < .15,
+                            "{} {}: {} vs {}".format(distance, velocity,
+                                                     exact, fast))
+
+    def test_lookupElevationAngle_off_table(self):
+        self.assertEquals(targeting.lookupElevationAngle(10, 7.4439), None)
+        self.assertEquals(targeting.lookupElevationAngle(.9422, 100), None)
+
+    def test_buildElevationTable(self):
+        table = targeting.buildElevationTable([1, 1.1], [8, 9])
+        self.assertEquals(table.shape, (3, 3))
+        self.assertEquals(table[1:, 0].tolist(), [1, 1.1])
+        self.assertEquals(table[0, 1:].tolist(), [8, 9])
+        # Grid points are exact, midpoints are between their neighbours
+        self.assertEquals(
+            targeting.lookupElevationAngle(1.1, 8, table), table[2, 1])
+        self.assertEquals(
+            targeting.lookupElevationAngle(1, 9, table), table[1, 2])
+        middle = targeting.lookupElevationAngle(1.05, 8.5, table)
+        self.assertAlmostEqual(middle, np.mean(table[1:, 1:]), places=9)
+
+    def test_getHeightsAtDistance(self):
+        """Batch integration must match getVertLaunchAngle exactly."""
+        angles = np.linspace(15, 75, 9)
+        heights = targeting.getHeightsAtDistance(7.4439, angles, .9422)
+        for angle, height in zip(angles, heights):
+            self.assertEquals(height, targeting.getVertLaunchAngle(
+                7.4439, angle, targeting.z0, .9422))
+
+    def test_getExactElevationAngle(self):
+        """Search must agree with the original search, within tolerance."""
+        for distance, velocity in ((.9422, 7.4439), (1.5, 12.1)):
+            linear = targeting.getLinearElevationAngle(distance, velocity)
+            fast = targeting.getExactElevationAngle(distance, velocity)
+            self.assertTrue(abs(linear - fast) < .011)
+            self.assertTrue(targeting.lastSolveStats["iterations"] <= 6)
+            rk4 = targeting.getExactElevationAngle(distance, velocity, "rk4")
+            self.assertTrue(abs(linear - rk4) < .2)
+
+    def test_getExactElevationAngle_out_of_range(self):
+        with self.assertRaises(ValueError):
+            targeting.getExactElevationAngle(20, 2)
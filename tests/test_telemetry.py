@@ -0,0 +1,49 @@
+"""Test cases for the telemetry encoding of published topics."""
+
+from unittest import TestCase
+
+import numpy as np
+
+import bot.lib.telemetry as telemetry
+import bot.lib.wire as wire
+
+
+class TestTelemetry(TestCase):
+
+    """Test that topic values survive being packed into frames."""
+
+    def test_values(self):
+        """Plain values come back as they were sent."""
+        for value in [7, 1.5, "fr: DMCCMotor", None,
+                      {"front": [0, 255], "back": [1, 2]}]:
+            frames = telemetry.pack_frames("topic", 3, 12.25, value)
+            self.assertEqual(3, len(frames))
+            self.assertEqual(("topic", 3, 12.25, value),
+                             telemetry.unpack_frames(frames))
+
+    def test_arrays(self):
+        """Arrays keep their dtype and shape."""
+        for value in [np.arange(32, dtype=np.uint8).reshape(4, 8),
+                      np.array([1.5, -2.0, 3.0, 0.0]),
+                      np.arange(6, dtype=np.int16).reshape(3, 2).T,
+                      np.array(["front", "back"], dtype="|S12"),
+                      np.array([1 + 2j, -0.5j], dtype=np.complex128),
+                      np.array([0, 60], dtype="<M8[s]")]:
+            frames = telemetry.pack_frames("ir_frame", 1, 0.5, value)
+            frames = [str(buffer(frame)) for frame in frames]
+            topic, seq, timestamp, decoded = telemetry.unpack_frames(frames)
+            self.assertEqual(value.dtype, decoded.dtype)
+            self.assertEqual(value.tolist(), decoded.tolist())
+
+    def test_unpackable(self):
+        """Values wire can't pack are sent as strings."""
+        value = np.uint8(7)
+        frames = telemetry.pack_frames("topic", 0, 0.0, value)
+        self.assertEqual("7", telemetry.unpack_frames(frames)[3])
+
+    def test_bad_frames(self):
+        """Malformed messages raise WireError."""
+        for frames in [["topic"], ["topic", "short", ""],
+                       ["topic", telemetry.header_struct.pack(0, 0.0, 9), ""]]:
+            with self.assertRaises(wire.WireError):
+                telemetry.unpack_frames(frames)
@@ -3,6 +3,8 @@
 from os import path
 from unittest import TestCase, expectedFailure
 import struct
+import Queue
+from time import sleep
 
 import bot.lib.lib as lib
 import bot.hardware.ultrasonic
@@ -52,3 +54,78 @@ class TestUltrasonic(TestCase):
         us.pru_mem = struct.pack('IIIIIIII', 1, 2, 3, 4, 5, 6, 7, 8)
         dists = us.read_dists()
         self.assertEqual(dists['back'], 3/5877.0 + 0.15)
+
+    def test_all_units(self):
+        us = Ultrasonic()
+        us.pru_mem = struct.pack('IIIIIIII', 1, 2, 3, 4, 5, 6, 7, 8)
+        units = us.read_all_units()
+        self.assertIsNone(units['seq'])
+        self.assertEqual(units['times']['right'], 7)
+        self.assertEqual(units['meters']['right'], 7/5877.0)
+        self.assertEqual(units['inches']['right'], 7/149.3)
+        self.assertEqual(units['dists']['right'], 7/5877.0 + 0.15)
+        self.assertEqual(units['dists']['front'], 1/5877.0 + 0.15)
+
+
+class TestUltrasonicWaiter(TestCase):
+
+    """Test reading frames published by the background PRU waiter."""
+
+    def setUp(self):
+        config_file = path.dirname(path.realpath(__file__))+"/test_config.yaml"
+        lib.get_config(config_file)
+        self.us = Ultrasonic()
+        self.us.pru_mem = struct.pack('IIIIIIII', 1, 2, 3, 4, 5, 6, 7, 8)
+        self.interrupts = Queue.Queue()
+        self.us.wait_for_interrupt = self.interrupts.get
+
+    def tearDown(self):
+        self.us.stop_waiter()
+        # Let the waiter see it's been stopped
+        self.interrupts.put(None)
+
+    def test_snapshot(self):
+        """Frames are published once per interrupt, duplicates dropped."""
+        self.us.start_waiter()
+        for i in range(3):
+            self.interrupts.put(None)
+            self.interrupts.put(None)  # duplicate
+            snapshot = self.us.wait_for_snapshot(i)
+            self.assertEqual(snapshot.seq, i + 1)
+            sleep(self.us.duplicate_interval * 2)
+        self.assertEqual(self.us.read_times()['back'], 3)
+        self.assertEqual(self.us.read_dists()['back'], 3/5877.0 + 0.15)
+        stats = self.us.get_waiter_stats()
+        self.assertEqual(stats["seq"], 3)
+        self.assertEqual(stats["duplicates"], 3)
+        self.assertTrue(stats["period"] >= self.us.duplicate_interval)
+
+    def test_stale(self):
+        """Reads fail once the PRU stops interrupting for max_age."""
+        self.us.max_age = 0.05
+        self.us.start_waiter()
+        self.interrupts.put(None)
+        self.assertEqual(self.us.wait_for_snapshot().seq, 1)
+        self.assertEqual(self.us.read_times()['front'], 1)
+        sleep(self.us.max_age)
+        with self.assertRaises(IOError):
+            self.us.read_times()
+
+    def test_all_units(self):
+        """All units come from one frame, consecutive reads get new ones."""
+        self.us.start_waiter()
+        self.interrupts.put(None)
+        units = self.us.read_all_units()
+        self.assertEqual(units['seq'], 1)
+        self.assertEqual(units['times']['left'], 5)
+        self.assertEqual(units['meters']['left'], 5/5877.0)
+        self.assertEqual(units['inches']['left'], 5/149.3)
+        self.assertEqual(units['dists']['left'], 5/5877.0 + 0.15)
+
+        sleep(self.us.duplicate_interval * 2)
+        self.us.pru_mem = struct.pack('IIIIIIII', 9, 0, 3, 0, 5, 0, 7, 0)
+        self.interrupts.put(None)
+        units = self.us.read_all_units(units['seq'])
+        self.assertEqual(units['seq'], 2)
+        self.assertEqual(units['times']['front'], 9)
+        self.assertEqual(units['dists']['front'], 9/5877.0 + 0.15)
@@ -0,0 +1,67 @@
+"""Test cases for message encodings."""
+
+from unittest import TestCase
+
+import bot.lib.messages as msgs
+import bot.lib.wire as wire
+
+
+class TestWire(TestCase):
+
+    """Test that every message survives both encodings."""
+
+    def setUp(self):
+        """Build one of each message."""
+        self.messages = [
+            msgs.error("Bad things"),
+            msgs.ping_req(),
+            msgs.ping_reply(),
+            msgs.list_req(),
+            msgs.list_reply({"driver": ["move", "rotate"], "ctrl": []}),
+            msgs.call_req("driver", "move", {"speed": 50, "angle": 12.5}),
+            msgs.call_reply("Called ir_hub.read_all", {
+                "front": [0, 255, -1, 2 ** 40], "ok": True, "fail": False,
+                "none": None, u"caf\xe9": u"\xfcber", "nested": [[1.5], {}]}),
+            msgs.exit_req(),
+            msgs.exit_reply(),
+            msgs.hello_req(["bin", "json"]),
+            msgs.hello_reply("bin"),
+            msgs.batch_req([msgs.call_req("ctrl", "echo", {"msg": 1}),
+                            msgs.call_req("ctrl", "stop_full", {})], False),
+            msgs.batch_reply([msgs.call_reply("Called ctrl.echo", 1),
+                              msgs.error("Exception: 'x'")]),
+            msgs.job_req("follower", "follow_ignoring_turns", {}),
+            msgs.job_reply(7),
+            msgs.job_status_req(7),
+            msgs.job_cancel_req(7),
+            msgs.job_status_reply(7, "done", msgs.call_reply("Called", 1))]
+
+    def test_round_trip(self):
+        """Decoded messages must equal the originals."""
+        for encoding in wire.encodings:
+            for msg in self.messages:
+                data = wire.dumps(msg, encoding)
+                self.assertEqual((msg, encoding), wire.loads(data))
+
+    def test_all_types_packed(self):
+        """Every message type must have a bin layout."""
+        self.assertEqual(len(wire.msg_fields), len(self.messages))
+        for msg in self.messages:
+            self.assertTrue(msg["type"] in wire.msg_type_bytes)
+
+    def test_compact(self):
+        """Bin frames should be smaller than JSON."""
+        self.assertEqual(1, len(wire.dumps(msgs.ping_req(), "bin")))
+        for msg in self.messages:
+            self.assertTrue(
+                len(wire.dumps(msg, "bin")) <= len(wire.dumps(msg, "json")))
+
+    def test_bad_messages(self):
+        """Undecodable and unencodable messages raise WireError."""
+        move = wire.dumps(msgs.call_req("driver", "move", {}), "bin")
+        for data in ["", "not json", move[:-1], move + "x", "\xff"]:
+            with self.assertRaises(wire.WireError):
+                wire.loads(data)
+        for encoding in wire.encodings:
+            with self.assertRaises(wire.WireError):
+                wire.dumps(msgs.call_reply("x", object()), encoding)